@@ -1,4 +1,5 @@
 from config import *
+import noise
 
 class Engine:
     """
@@ -16,6 +17,10 @@ class Engine:
         self.screenWidth = width
         self.screenHeight = height
 
+        #white, blue or r2, see noise.py
+        self.noiseKind = "white"
+        self.noiseSeed = 0
+
         #general OpenGL configuration
         self.shader = self.createShader("shaders/frameBufferVertex.txt",
                                         "shaders/frameBufferFragment.txt")
@@ -97,22 +102,15 @@ class Engine:
     def createNoiseTexture(self):
 
         """
-            generate four screens' worth of noise
+            generate four screens' worth of noise, or map it in
+            from the cache if this size and seed were made before
         """
 
-        noise = []
-
-        # random noise: (x y z -)
-        for y in range(self.screenHeight):
-            for x in range(self.screenWidth * 4):
-                radius = np.random.uniform(low = 0.0, high = 0.99)
-                theta = np.random.uniform(low = 0.0, high = 2 * np.pi)
-                phi = np.random.uniform(low = 0.0, high = np.pi)
-                noise.append(radius * np.cos(theta) * np.cos(phi))
-                noise.append(radius * np.sin(theta) * np.cos(phi))
-                noise.append(radius * np.sin(phi))
-                noise.append(0.0)
-        self.noiseData = np.array(noise, dtype=np.float32)
+        # noise vectors: (x y z -)
+        self.noiseData = noise.load(
+            4 * self.screenWidth, self.screenHeight,
+            seed = self.noiseSeed, kind = self.noiseKind
+        )
 
         self.noiseTexture = glGenTextures(1)
         glActiveTexture(GL_TEXTURE2)
@@ -126,7 +124,7 @@ class Engine:
         glTexImage2D(
             GL_TEXTURE_2D,0,GL_RGBA32F, 
             4 * self.screenWidth,self.screenHeight,
-            0,GL_RGBA,GL_FLOAT,bytes(self.noiseData)
+            0,GL_RGBA,GL_FLOAT,np.ascontiguousarray(self.noiseData)
         )
     
     def createShader(self, vertexFilepath, fragmentFilepath):
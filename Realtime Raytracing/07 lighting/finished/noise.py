@@ -0,0 +1,135 @@
+from config import *
+import os
+
+#Sample vectors for the raytracer's noise texture: the camera ray jitter
+#reads .xy and the reflection scatter reads .xyz. Every generator returns
+#a (height, width, 4) float32 array, filled in one pass, and the result
+#is cached on disk as raw .npy so later startups just map the file in.
+
+KINDS = ("white", "blue", "r2")
+
+#R-sequence generator for three dimensions: the real root of x^4 = x + 1
+PLASTIC_3D = 1.2207440846057596
+
+def to_vectors(samples):
+    """
+        Turn (height, width, 3) uniform samples into (height, width, 4)
+        vectors: radius, theta and phi, as the original noise loop drew them.
+    """
+
+    radius = 0.99 * samples[...,0]
+    theta = 2 * np.pi * samples[...,1]
+    phi = np.pi * samples[...,2]
+
+    vectors = np.zeros(samples.shape[:2] + (4,), dtype = np.float32)
+    vectors[...,0] = radius * np.cos(theta) * np.cos(phi)
+    vectors[...,1] = radius * np.sin(theta) * np.cos(phi)
+    vectors[...,2] = radius * np.sin(phi)
+    return vectors
+
+def white_samples(width, height, rng):
+
+    return rng.random((height, width, 3))
+
+def r2_samples(width, height, rng):
+    """
+        Consecutive pixels take consecutive points of the 3D R-sequence,
+        so any run of pixels covers the unit cube evenly. The seed picks
+        a random shift of the whole sequence.
+    """
+
+    alpha = 1 / PLASTIC_3D ** np.arange(1, 4)
+    shift = rng.random(3)
+    index = np.arange(width * height, dtype = np.float64)[:,np.newaxis]
+    samples = np.modf(shift + index * alpha)[0]
+    return samples.reshape(height, width, 3)
+
+def blue_tile(size, rng):
+    """
+        A size x size tile of blue noise, three channels: white noise
+        with its low frequencies filtered out, then ranked so each
+        channel is uniform again. The filter is applied with an FFT,
+        so the tile wraps seamlessly.
+    """
+
+    frequency_x = np.fft.fftfreq(size)[np.newaxis,:]
+    frequency_y = np.fft.fftfreq(size)[:,np.newaxis]
+    frequency = np.sqrt(frequency_x ** 2 + frequency_y ** 2)
+    high_pass = 1 - np.exp(-(frequency / 0.2) ** 2)
+
+    white = rng.random((3, size, size))
+    filtered = np.real(np.fft.ifft2(np.fft.fft2(white) * high_pass))
+
+    rank = np.argsort(np.argsort(filtered.reshape(3, -1), axis = 1), axis = 1)
+    samples = (rank + 0.5) / (size * size)
+    return np.moveaxis(samples.reshape(3, size, size), 0, -1)
+
+def blue_samples(width, height, rng, tile_size = 64, screens = 4):
+    """
+        Blue noise tiles repeated over the texture, a different tile
+        for each screen's worth so the samples of a pixel don't repeat.
+    """
+
+    screen_width = width // screens
+    samples = np.empty((height, width, 3))
+    for screen in range(screens):
+        first = screen * screen_width
+        last = width if screen == screens - 1 else first + screen_width
+        tile = blue_tile(tile_size, rng)
+        repeats = (-(-height // tile_size), -(-(last - first) // tile_size), 1)
+        samples[:,first:last] = np.tile(tile, repeats)[:height,:last - first]
+    return samples
+
+def generate(width, height, seed = 0, kind = "white"):
+    """
+        Build a (height, width, 4) float32 array of noise vectors.
+
+            Parameters:
+                width, height (int): size of the noise texture
+                seed (int): seed for the random generator
+                kind (str): "white", "blue" or "r2"
+    """
+
+    if kind not in KINDS:
+        raise ValueError(f"unknown noise kind {kind}, expected one of {KINDS}")
+
+    rng = np.random.default_rng(seed)
+    if kind == "blue":
+        samples = blue_samples(width, height, rng)
+    elif kind == "r2":
+        samples = r2_samples(width, height, rng)
+    else:
+        samples = white_samples(width, height, rng)
+
+    return to_vectors(samples)
+
+def load(width, height, seed = 0, kind = "white", folder = "cache"):
+    """
+        The noise for (width, height, seed, kind), memory mapped from
+        folder if it was generated before, otherwise generated and saved.
+        Pass folder = None to skip the cache.
+    """
+
+    if folder is None:
+        return generate(width, height, seed, kind)
+
+    filepath = os.path.join(folder, f"noise_{kind}_{width}x{height}_{seed}.npy")
+    if os.path.exists(filepath):
+        try:
+            data = np.load(filepath, mmap_mode = "r")
+            if data.shape == (height, width, 4) and data.dtype == np.float32:
+                return data
+        except ValueError:
+            #truncated or not a .npy, make it again
+            pass
+
+    data = generate(width, height, seed, kind)
+
+    #write then rename, so a crash never leaves half a file behind
+    os.makedirs(folder, exist_ok = True)
+    temporary = f"{filepath}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        np.save(f, data)
+    os.replace(temporary, filepath)
+
+    return data
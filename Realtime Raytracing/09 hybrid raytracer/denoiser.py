@@ -0,0 +1,158 @@
+from config import *
+
+#Edge avoiding a-trous filtering of the raytracer's output, see
+#shaders/denoise.txt for how one pass works. Denoiser runs the passes on
+#the GPU; denoise() is the same filter in NumPy, for checking it and for
+#images rendered on the CPU. Images are (height, width, channels),
+#bottom row first, as the g-buffer stores them.
+
+#B3 spline taps, centre in the middle
+KERNEL = np.array((1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16))
+
+MINIMUM_ALBEDO = 0.01
+
+def get_pass_settings(iteration, color_phi):
+    """
+        Tap spacing and colour falloff of a pass: the spacing doubles
+        each pass and colour differences count for twice as much.
+    """
+
+    step = 2 ** iteration
+    return step, color_phi / step
+
+def filter_pass(lighting, normal, position, step, color_phi, normal_phi, position_phi):
+    """
+        One pass over (height, width, 3) lighting, guided by the g-buffer
+        normals (0 to 1, as stored) and positions of the same pixels.
+    """
+
+    height, width = lighting.shape[:2]
+    rows = np.arange(height)
+    cols = np.arange(width)
+
+    total = np.zeros_like(lighting)
+    weights = np.zeros((height, width), dtype = lighting.dtype)
+
+    for y in range(-2, 3):
+        tap_rows = np.clip(rows + step * y, 0, height - 1)[:,np.newaxis]
+        for x in range(-2, 3):
+            tap_cols = np.clip(cols + step * x, 0, width - 1)[np.newaxis,:]
+
+            tap_lighting = lighting[tap_rows, tap_cols]
+            difference = lighting - tap_lighting
+            color_weight = np.exp(-np.sum(difference * difference, axis = 2) / color_phi)
+
+            difference = normal - normal[tap_rows, tap_cols]
+            normal_weight = np.exp(-np.sum(difference * difference, axis = 2) / (step * step) / normal_phi)
+
+            difference = position - position[tap_rows, tap_cols]
+            position_weight = np.exp(-np.sum(difference * difference, axis = 2) / position_phi)
+
+            weight = KERNEL[y + 2] * KERNEL[x + 2] * np.minimum(color_weight, 1.0) \
+                    * np.minimum(normal_weight, 1.0) * np.minimum(position_weight, 1.0)
+            total += weight[:,:,np.newaxis] * tap_lighting
+            weights += weight
+
+    return total / weights[:,:,np.newaxis]
+
+def denoise(color, albedo, emissive, normal, position, iterations = 4,
+            color_phi = 0.5, normal_phi = 0.01, position_phi = 0.1):
+    """
+        Filter a rendered image the way Denoiser does: take the emissive
+        off and divide the albedo out, filter what's left, then put them
+        back. All arguments but the settings are (height, width, 3).
+    """
+
+    albedo = np.maximum(albedo, MINIMUM_ALBEDO)
+    lighting = (color - emissive) / albedo
+
+    for iteration in range(iterations):
+        step, phi = get_pass_settings(iteration, color_phi)
+        lighting = filter_pass(lighting, normal, position, step, phi, normal_phi, position_phi)
+
+    return lighting * albedo + emissive
+
+class Denoiser:
+    """
+        Runs the filter passes between two screen sized textures.
+    """
+
+    def __init__(self, shader, width, height, iterations = 4,
+                 color_phi = 0.5, normal_phi = 0.01, position_phi = 0.1):
+        """
+            Parameters:
+                shader (int): the compiled shaders/denoise.txt
+                width, height (int): screen size
+                iterations (int): passes to run, 0 to show the raw image
+                color_phi, normal_phi, position_phi (float): how much
+                    difference in each is tolerated before a tap
+                    stops counting, in squared units
+        """
+
+        self.shader = shader
+        self.iterations = iterations
+        self.color_phi = color_phi
+        self.normal_phi = normal_phi
+        self.position_phi = position_phi
+
+        self.textures = [self.make_texture(width, height) for i in range(2)]
+
+        glUseProgram(self.shader)
+        self.locations = {
+            name: glGetUniformLocation(self.shader, name)
+            for name in (
+                "stepSize", "colorPhi", "normalPhi", "positionPhi",
+                "demodulate", "remodulate"
+            )
+        }
+
+    def make_texture(self, width, height):
+
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, width, height, 0, GL_RGBA, GL_FLOAT, None)
+        return texture
+
+    def run(self, source, gTextures, workGroupCount):
+        """
+            Filter the source texture, guided by the g-buffer's
+            (g0, g1, g2) textures. Returns the texture holding the
+            result, source itself if there are no passes to run.
+        """
+
+        if self.iterations <= 0:
+            return source
+
+        glUseProgram(self.shader)
+        for unit,texture in enumerate(gTextures, start = 2):
+            glBindImageTexture(unit, texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+
+        glUniform1f(self.locations["normalPhi"], self.normal_phi)
+        glUniform1f(self.locations["positionPhi"], self.position_phi)
+
+        for iteration in range(self.iterations):
+
+            step, color_phi = get_pass_settings(iteration, self.color_phi)
+            glUniform1i(self.locations["stepSize"], step)
+            glUniform1f(self.locations["colorPhi"], color_phi)
+            glUniform1i(self.locations["demodulate"], iteration == 0)
+            glUniform1i(self.locations["remodulate"], iteration == self.iterations - 1)
+
+            target = self.textures[iteration % 2]
+            glBindImageTexture(0, source, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+            glBindImageTexture(1, target, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+            glDispatchCompute(*workGroupCount, 1)
+            #the next pass reads it, the last is drawn
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | GL_TEXTURE_FETCH_BARRIER_BIT)
+            source = target
+
+        return source
+
+    def destroy(self):
+
+        glDeleteTextures(len(self.textures), self.textures)
+        glDeleteProgram(self.shader)
@@ -1,5 +1,7 @@
 from config import *
-import megatexture
+import denoiser
+import materialstore
+import residency
 
 class Engine:
     """
@@ -20,6 +22,10 @@ class Engine:
         self.targetFrameRate = 60
         self.frameRateMargin = 10
 
+        #texture memory for materials, in bytes: the active rooms'
+        #materials and those behind nearby doors are kept within it
+        self.materialBudget = 160 * 2**20
+
         #general OpenGL configuration
         self.shader = self.createShader("shaders/frameBufferVertex.txt",
                                         "shaders/frameBufferFragment.txt")
@@ -31,6 +37,8 @@ class Engine:
             "shaders/g_fragment.txt"
         )
 
+        self.createMaterialStore()
+
         self.set_onetime_shader_data()
 
         self.get_shader_locations()
@@ -40,17 +48,18 @@ class Engine:
         self.createQuad()
         self.createColorBuffers()
         self.createResourceMemory()
-        self.createMegaTexture()
+
+        #edge aware blur of the lighting, set its iterations to 0 to turn it off
+        self.denoiser = denoiser.Denoiser(
+            self.createComputeShader("shaders/denoise.txt"),
+            self.screenWidth, self.screenHeight
+        )
+        self.outputTexture = self.colorBuffer
     
     def set_onetime_shader_data(self):
 
-        glUseProgram(self.shaderGPass)
-
-        glUniform1i(
-            glGetUniformLocation(
-                self.shaderGPass, "megaTexture"
-            ), 0
-        )
+        self.materialStore.set_samplers(self.shaderGPass)
+        self.materialStore.set_samplers(self.rayTracerShader)
     
     def get_shader_locations(self):
 
@@ -208,15 +217,21 @@ class Engine:
     
         glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,5,1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
     
-    def createMegaTexture(self):
+    def createMaterialStore(self):
 
+        #by material index, which faces carry as a vertex attribute and
+        #planes as material_index. Nothing is decoded until it's needed
         filenames = [
             "AlienArchitecture", "AlternatingColumnsConcreteTile", "BiomechanicalPlumbing", 
             "CarvedStoneFloorCheckered", "ChemicalStrippedConcrete", "ClayBrick",
             "CrumblingBrickWall", "DiamondSquareFlourishTiles", "EgyptianHieroglyphMetal"
         ]
 
-        self.megaTexture = megatexture.MegaTexture(filenames)
+        self.materialStore = materialstore.MaterialStore(
+            filenames, preload = False,
+            capacity = materialstore.get_capacity(self.materialBudget, len(filenames))
+        )
+        self.materialResidency = residency.MaterialResidency(self.materialStore)
     
     def createShader(self, vertexFilepath, fragmentFilepath):
         """
@@ -308,6 +323,8 @@ class Engine:
 
         scene.outDated = False
 
+        self.materialResidency.update(scene)
+
         glUseProgram(self.rayTracerShader)
 
         #spheres
@@ -388,8 +405,7 @@ class Engine:
         ))
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glEnable(GL_DEPTH_TEST)
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.megaTexture.texture)
+        self.materialStore.bind()
 
         glEnable(GL_CULL_FACE)
         glCullFace(GL_BACK)
@@ -417,8 +433,7 @@ class Engine:
         glBindImageTexture(0, self.colorBuffer, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
         glActiveTexture(GL_TEXTURE1)
         glBindImageTexture(1, self.objectDataTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
-        glActiveTexture(GL_TEXTURE3)
-        glBindImageTexture(3, self.megaTexture.texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        self.materialStore.bind()
         #g-Buffer
         glActiveTexture(GL_TEXTURE4)
         glBindImageTexture(4, self.g0Texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
@@ -440,13 +455,22 @@ class Engine:
         glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
         glBindImageTexture(0, 0, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
 
+    def denoise_pass(self):
+
+        #the filter works in 8x8 pixel groups
+        self.outputTexture = self.denoiser.run(
+            self.colorBuffer,
+            (self.g0Texture, self.g1Texture, self.g2Texture),
+            ((self.screenWidth + 7) // 8, (self.screenHeight + 7) // 8)
+        )
+
     def drawScreen(self):
         glDisable(GL_CULL_FACE)
         glDisable(GL_DEPTH_TEST)
         glUseProgram(self.shader)
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
         glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.colorBuffer)
+        glBindTexture(GL_TEXTURE_2D, self.outputTexture)
         #glBindTexture(GL_TEXTURE_2D, self.g2Texture)
         glBindVertexArray(self.vao)
         glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
@@ -460,6 +484,7 @@ class Engine:
         self.updateScene(scene)
         self.geometry_pass(scene)
         self.raytrace_pass(scene)
+        self.denoise_pass()
         self.drawScreen()
     
     def destroy(self):
@@ -472,4 +497,7 @@ class Engine:
         glDeleteVertexArrays(1, (self.vao,))
         glDeleteBuffers(1, (self.vbo,))
         glDeleteTextures(1, (self.colorBuffer,))
+        self.materialResidency.destroy()
+        self.denoiser.destroy()
+        self.materialStore.destroy()
         glDeleteProgram(self.shader)
\ No newline at end of file
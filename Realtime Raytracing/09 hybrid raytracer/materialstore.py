@@ -0,0 +1,193 @@
+from config import *
+import megatexture
+
+#Material maps kept as texture arrays, one array per kind of map and one
+#layer per material, each with its own mip chain, so filtering never
+#reaches into a neighbouring material. Texels are 8 bits a channel, a
+#quarter of the atlas' RGBA32F. Shaders find a material's layer through
+#a table indexed by material_index, bound as a storage buffer. Materials
+#without a layer of their own share a plain fallback layer.
+
+#sampler uniform for each kind of map, in megatexture.MAPS order
+SAMPLERS = ("albedoMaps", "emissiveMaps", "glossMaps", "normalMaps", "specularMaps")
+
+#colour maps, stored as sRGB when asked to
+COLOR_MAPS = ("albedo", "emissive")
+
+#texel of the fallback layer in each kind of map: matte grey, unlit, flat
+FALLBACK_TEXELS = {
+    "albedo": (128, 128, 128, 255),
+    "emissive": (0, 0, 0, 255),
+    "glossiness": (0, 0, 0, 255),
+    "normal": (128, 128, 255, 255),
+    "specular": (0, 0, 0, 255)
+}
+
+def get_layer_bytes(texture_size = 1024):
+    """
+        Bytes one material takes across the arrays, mips included.
+    """
+
+    texels = sum(
+        (texture_size >> level) ** 2 for level in range(int(np.log2(texture_size)) + 1)
+    )
+    return 4 * texels * len(SAMPLERS)
+
+def get_capacity(budget, material_count, texture_size = 1024):
+    """
+        Material layers that fit in budget bytes beside the fallback
+        layer, but no more than there are materials.
+    """
+
+    return max(1, min(material_count, int(budget // get_layer_bytes(texture_size)) - 1))
+
+class MaterialStore:
+
+    def __init__(self, filenames, binding = 2, first_unit = 8, capacity = None,
+                 preload = True, srgb = False, texture_size = 1024,
+                 folder = "textures", cache = "cache"):
+        """
+            Parameters:
+                filenames (list): material names, by material_index
+                binding (int): storage buffer binding of the layer table
+                first_unit (int): texture unit of the first map array,
+                    the others follow on
+                capacity (int): material layers per array, defaults to
+                    every material. The fallback layer comes on top
+                preload (bool): fill the layers with the first materials,
+                    otherwise they start empty
+                srgb (bool): store albedo and emissive as sRGB, so they
+                    are linearized when sampled
+                texture_size (int): size of every map, in texels
+                folder, cache (str): passed on to megatexture.load_material
+        """
+
+        self.filenames = list(filenames)
+        self.material_count = len(self.filenames)
+        self.binding = binding
+        self.first_unit = first_unit
+        self.capacity = capacity or self.material_count
+        self.srgb = srgb
+        self.folder = folder
+        self.cache = cache
+
+        #nothing is decoded until a material is loaded
+        self.texture_size = texture_size
+        self.levels = int(np.log2(self.texture_size)) + 1
+
+        self.textures = [self.make_array(kind) for kind in megatexture.MAPS]
+
+        #the last layer stands in for every material which isn't loaded
+        self.fallback_layer = self.capacity
+        self.load_fallback()
+
+        #layer of each material, the fallback while it isn't loaded
+        self.layers = np.full(self.material_count, self.fallback_layer, dtype = np.int32)
+        self.table = glGenBuffers(1)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.table)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, self.layers.nbytes, self.layers, GL_DYNAMIC_DRAW)
+
+        if preload:
+            for material in range(min(self.capacity, self.material_count)):
+                self.load(material, material)
+        self.upload_table()
+
+    def get_internal_format(self, kind):
+
+        if self.srgb and kind in COLOR_MAPS:
+            return GL_SRGB8_ALPHA8
+        return GL_RGBA8
+
+    def make_array(self, kind):
+
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+        glTexStorage3D(
+            GL_TEXTURE_2D_ARRAY, self.levels, self.get_internal_format(kind),
+            self.texture_size, self.texture_size, self.capacity + 1
+        )
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        return texture
+
+    def read(self, material):
+        """
+            All of a material's maps, ready to upload, decoding only
+            this material. Touches no GL state, so it's safe to call
+            from another thread.
+        """
+
+        return megatexture.load_material(
+            self.filenames[material], self.folder, self.texture_size, self.cache
+        )
+
+    def upload(self, maps, layer):
+        """
+            Copy maps, in megatexture.MAPS order, into a layer
+            and rebuild its mips.
+        """
+
+        for map_index,texture in enumerate(self.textures):
+            glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+            glTexSubImage3D(
+                GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer,
+                self.texture_size, self.texture_size, 1,
+                GL_RGBA, GL_UNSIGNED_BYTE, maps[map_index]
+            )
+            glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+
+    def load_fallback(self):
+
+        maps = np.empty((len(megatexture.MAPS), self.texture_size, self.texture_size, 4), dtype = np.uint8)
+        for map_index,kind in enumerate(megatexture.MAPS):
+            maps[map_index] = FALLBACK_TEXELS[kind]
+        self.upload(maps, self.fallback_layer)
+
+    def load(self, material, layer, maps = None):
+        """
+            Copy a material's maps, read now unless given, into
+            a layer. The table isn't touched until upload_table.
+        """
+
+        if maps is None:
+            maps = self.read(material)
+
+        self.upload(maps, layer)
+
+        self.layers[self.layers == layer] = self.fallback_layer
+        self.layers[material] = layer
+
+    def upload_table(self):
+
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.table)
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, self.layers.nbytes, self.layers)
+
+    def set_samplers(self, shader):
+        """
+            Point a program's map samplers at the arrays' texture units.
+        """
+
+        glUseProgram(shader)
+        for i,name in enumerate(SAMPLERS):
+            glUniform1i(glGetUniformLocation(shader, name), self.first_unit + i)
+
+    def bind(self):
+
+        for i,texture in enumerate(self.textures):
+            glActiveTexture(GL_TEXTURE0 + self.first_unit + i)
+            glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.table)
+
+    def get_memory_usage(self):
+        """
+            Bytes of texture memory held by the arrays, mips included.
+        """
+
+        return get_layer_bytes(self.texture_size) * (self.capacity + 1)
+
+    def destroy(self):
+
+        glDeleteTextures(len(self.textures), self.textures)
+        glDeleteBuffers(1, (self.table,))
@@ -1,34 +1,234 @@
 from config import *
+import os
+import sys
+import time
+import json
+import hashlib
+import tempfile
+import multiprocessing
+
+#Every material's five maps, side by side, one material per row of the
+#atlas. Decoding 45 PNGs takes seconds, so the decoded atlas is kept in
+#a raw .npy next to a manifest of the sources it was built from. While
+#those are unchanged, a launch just maps the .npy and hands it to GL.
+
+MAPS = ("albedo", "emissive", "glossiness", "normal", "specular")
+
+MANIFEST_VERSION = 1
+
+def get_map_path(folder, name, kind):
+
+    return os.path.join(folder, name, f"{name}_{kind}.png")
+
+def get_slot_origin(slot, texture_count, texture_size):
+    """
+        Top left pixel (x, y) of a material's maps in the atlas,
+        the first material sits on the bottom row.
+    """
+
+    return (0, (texture_count - slot - 1) * texture_size)
+
+def describe_sources(filenames, folder):
+    """
+        Size and modification time of every source image,
+        enough to notice an edited or replaced texture.
+    """
+
+    sources = {}
+    for name in filenames:
+        for kind in MAPS:
+            filepath = get_map_path(folder, name, kind)
+            status = os.stat(filepath)
+            sources[filepath] = [status.st_size, status.st_mtime_ns]
+    return sources
+
+def decode(filepath, texture_size):
+    """
+        Read one map as a (texture_size, texture_size, 4) uint8 array.
+    """
+
+    image = pg.image.load(filepath)
+    if image.get_size() != (texture_size, texture_size):
+        image = pg.transform.smoothscale(image, (texture_size, texture_size))
+
+    #opaque, as the converted surfaces were
+    pixels = np.full((texture_size, texture_size, 4), 255, dtype = np.uint8)
+    pixels[...,:3] = np.frombuffer(
+        pg.image.tostring(image, "RGB"), dtype = np.uint8
+    ).reshape(texture_size, texture_size, 3)
+    return pixels
+
+def decode_into(task):
+    """
+        Pool worker: decode a map straight into its place in the atlas file.
+    """
+
+    filepath, atlas_path, x, y, texture_size = task
+
+    atlas = np.load(atlas_path, mmap_mode = "r+")
+    atlas[y:y + texture_size, x:x + texture_size] = decode(filepath, texture_size)
+    atlas.flush()
+
+    return filepath
+
+def get_tasks(filenames, folder, texture_size):
+    """
+        (filepath, x, y) of every map, x and y being where it goes in the atlas.
+    """
+
+    tasks = []
+    for slot,name in enumerate(filenames):
+        x,y = get_slot_origin(slot, len(filenames), texture_size)
+        for i,kind in enumerate(MAPS):
+            tasks.append((get_map_path(folder, name, kind), x + i * texture_size, y))
+    return tasks
+
+def build_atlas(filenames, folder = "textures", texture_size = 1024, atlas_path = None, processes = None):
+    """
+        Decode every map into one (height, width, 4) uint8 atlas.
+        With an atlas_path the maps are decoded over a process pool
+        and written straight into that .npy file, which is returned
+        memory mapped. Otherwise they're decoded here, in memory.
+    """
+
+    shape = (len(filenames) * texture_size, len(MAPS) * texture_size, 4)
+    tasks = get_tasks(filenames, folder, texture_size)
+
+    if atlas_path is None:
+        atlas = np.zeros(shape, dtype = np.uint8)
+        for filepath,x,y in tasks:
+            atlas[y:y + texture_size, x:x + texture_size] = decode(filepath, texture_size)
+        return atlas
+
+    atlas = np.lib.format.open_memmap(atlas_path, mode = "w+", dtype = np.uint8, shape = shape)
+    del atlas
+
+    with multiprocessing.Pool(processes = processes) as pool:
+        for filepath in pool.imap_unordered(
+            decode_into,
+            [(filepath, atlas_path, x, y, texture_size) for filepath,x,y in tasks]):
+            pass
+
+    return np.load(atlas_path, mmap_mode = "r")
+
+def get_cache_paths(filenames, texture_size, cache, prefix = "megatexture"):
+
+    key = hashlib.sha1(json.dumps([filenames, texture_size]).encode()).hexdigest()[:12]
+    stem = os.path.join(cache, f"{prefix}_{key}")
+    return f"{stem}.npy", f"{stem}.json"
+
+def get_temporary_path(path):
+    """
+        A new, empty file beside path to build it in before swapping
+        it into place. Every call gets its own, so writers on other
+        threads or processes never share one.
+    """
+
+    folder, name = os.path.split(path)
+    handle, temporary = tempfile.mkstemp(
+        dir = folder, prefix = f"{name}.", suffix = f".tmp{os.path.splitext(name)[1]}"
+    )
+    os.close(handle)
+    return temporary
+
+def load_atlas(filenames, folder = "textures", texture_size = 1024, cache = "cache", processes = None):
+    """
+        The atlas for these materials, mapped from the cache if it was
+        built from the current sources, otherwise built and cached.
+        Pass cache = None to always decode, in memory.
+
+        Returns the atlas and its manifest, which lists each
+        material's slot and the sources the atlas was built from.
+    """
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "texture_size": texture_size,
+        "maps": list(MAPS),
+        "materials": {name: slot for slot,name in enumerate(filenames)},
+        "sources": describe_sources(filenames, folder)
+    }
+
+    if cache is None:
+        return build_atlas(filenames, folder, texture_size), manifest
+
+    atlas_path, manifest_path = get_cache_paths(filenames, texture_size, cache)
+
+    if os.path.exists(manifest_path) and os.path.exists(atlas_path):
+        with open(manifest_path, "r") as f:
+            cached = json.load(f)
+        if cached == manifest:
+            return np.load(atlas_path, mmap_mode = "r"), manifest
+
+    #build under temporary names, then swap them in, the manifest last
+    #so it only ever describes a complete atlas
+    os.makedirs(cache, exist_ok = True)
+    temporary = get_temporary_path(atlas_path)
+    build_atlas(filenames, folder, texture_size, temporary, processes)
+    os.replace(temporary, atlas_path)
+
+    temporary = get_temporary_path(manifest_path)
+    with open(temporary, "w") as f:
+        json.dump(manifest, f, indent = 4)
+    os.replace(temporary, manifest_path)
+
+    return np.load(atlas_path, mmap_mode = "r"), manifest
+
+def load_material(name, folder = "textures", texture_size = 1024, cache = "cache"):
+    """
+        One material's maps, decoded on their own: a (maps, texture_size,
+        texture_size, 4) uint8 array, in MAPS order. Read from the cache
+        if it was built from the current sources, otherwise decoded and
+        cached. Pass cache = None to always decode.
+    """
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "texture_size": texture_size,
+        "maps": list(MAPS),
+        "sources": describe_sources((name,), folder)
+    }
+
+    if cache is None:
+        return np.stack([decode(get_map_path(folder, name, kind), texture_size) for kind in MAPS])
+
+    maps_path, manifest_path = get_cache_paths([name], texture_size, cache, prefix = "material")
+
+    if os.path.exists(manifest_path) and os.path.exists(maps_path):
+        with open(manifest_path, "r") as f:
+            cached = json.load(f)
+        if cached == manifest:
+            return np.load(maps_path)
+
+    maps = np.stack([decode(get_map_path(folder, name, kind), texture_size) for kind in MAPS])
+
+    #same swap as load_atlas, the manifest last
+    os.makedirs(cache, exist_ok = True)
+    temporary = get_temporary_path(maps_path)
+    np.save(temporary, maps)
+    os.replace(temporary, maps_path)
+
+    temporary = get_temporary_path(manifest_path)
+    with open(temporary, "w") as f:
+        json.dump(manifest, f, indent = 4)
+    os.replace(temporary, manifest_path)
+
+    return maps
 
 class MegaTexture:
 
-    def __init__(self, filenames):
-        
-        texture_size = 1024
-        texture_count = len(filenames)
-        width = 5 * texture_size
-        height = texture_count * texture_size
-
-        
-        textureData = pg.Surface((width,height)).convert()
-        for i in range(texture_count):
-            #load albedo
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_albedo.png").convert()
-            textureData.blit(image, (0, (texture_count - i - 1) * texture_size))
-            #load emissive
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_emissive.png").convert()
-            textureData.blit(image, (texture_size, (texture_count - i - 1) * texture_size))
-            #load glossmap
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_glossiness.png").convert()
-            textureData.blit(image, (2 * texture_size, (texture_count - i - 1) * texture_size))
-            #load normal
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_normal.png").convert()
-            textureData.blit(image, (3 * texture_size, (texture_count - i - 1) * texture_size))
-            #load specular
-            image = pg.image.load(f"textures\{filenames[i]}\{filenames[i]}_specular.png").convert()
-            textureData.blit(image, (4 * texture_size, (texture_count - i - 1) * texture_size))
-        img_data = pg.image.tostring(textureData,"RGBA")
+    def __init__(self, filenames, folder = "textures", cache = "cache", processes = None):
+        """
+            Parameters:
+                filenames (list): material names, in slot order
+                folder (str): directory holding a folder per material
+                cache (str): where the decoded atlas is kept, None for nowhere
+                processes (int): decoding processes, defaults to the core count
+        """
 
+        texture_size = 1024
+        atlas, self.manifest = load_atlas(filenames, folder, texture_size, cache, processes)
+        height, width = atlas.shape[:2]
 
         self.texture = glGenTextures(1)
         glBindTexture(GL_TEXTURE_2D, self.texture)
@@ -36,8 +236,17 @@ class MegaTexture:
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,width, height,0,GL_RGBA,GL_UNSIGNED_BYTE,img_data)
+        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,width, height,0,GL_RGBA,GL_UNSIGNED_BYTE,atlas)
         glGenerateMipmap(GL_TEXTURE_2D)
-    
+
     def destroy(self):
-        glDeleteTextures(1, self.texture)
\ No newline at end of file
+        glDeleteTextures(1, self.texture)
+
+if __name__ == "__main__":
+
+    #prebuild the atlas: python megatexture.py [material ...]
+    folder = "textures"
+    filenames = sys.argv[1:] or sorted(os.listdir(folder))
+    start = time.perf_counter()
+    atlas, manifest = load_atlas(filenames, folder)
+    print(f"{len(filenames)} materials, {atlas.shape[1]}x{atlas.shape[0]} atlas in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,260 @@
+from config import *
+import collections
+import queue
+import threading
+
+#Decides which materials hold a layer of the MaterialStore when there
+#are more materials than layers. The active rooms' materials are loaded
+#before the frame that needs them, the rooms behind nearby doors are read
+#ahead on a worker thread, and whatever was used longest ago makes room.
+#If the active rooms need more materials than there are layers, the ones
+#left over are drawn with the store's fallback layer until room is made.
+
+class MaterialResidency:
+
+    def __init__(self, store, prefetch_distance = 2.0, uploads_per_frame = 1):
+        """
+            Parameters:
+                store (MaterialStore): layers to manage, preload or not
+                prefetch_distance (float): how close to a door, in grid
+                    cells, the player must be to read ahead behind it
+                uploads_per_frame (int): prefetched materials moved into
+                    layers per frame, each rebuilds five mip chains
+        """
+
+        self.store = store
+        self.prefetch_distance = prefetch_distance
+        self.uploads_per_frame = uploads_per_frame
+
+        #material: layer, least recently used first
+        self.resident = collections.OrderedDict()
+        for material in np.flatnonzero(store.layers != store.fallback_layer):
+            self.resident[int(material)] = int(store.layers[material])
+        self.free_layers = [
+            layer for layer in range(store.capacity)
+            if layer not in self.resident.values()
+        ]
+
+        #materials asked of the worker, the maps it has read and
+        #the errors of any it couldn't, which are left on the fallback
+        self.requested = set()
+        self.staged = {}
+        self.failed = {}
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target = self.read_materials, daemon = True)
+        self.worker.start()
+
+        self.door_rooms = None
+
+        self.load_count = 0
+        self.eviction_count = 0
+        #needed materials left on the fallback layer last update
+        self.fallback_count = 0
+
+    def read_materials(self):
+        """
+            Worker thread: read requested materials until told to stop.
+        """
+
+        while True:
+            material = self.requests.get()
+            if material is None:
+                return
+            #a failed read mustn't kill the thread, or the material
+            #would be waited on forever
+            try:
+                self.results.put((material, self.store.read(material), None))
+            except Exception as error:
+                self.results.put((material, None, error))
+
+    def wrap(self, materials):
+        """
+            Material indices wrapped onto the store's materials, as
+            the shaders wrap them, lowest first.
+        """
+
+        return sorted(set(int(material) % self.store.material_count for material in materials))
+
+    def find_door_rooms(self, rooms):
+        """
+            For each door, the rooms it opens onto.
+        """
+
+        self.door_rooms = collections.defaultdict(list)
+        for _room in rooms:
+            for _door in _room.doors:
+                self.door_rooms[id(_door)].append(_room)
+
+    def get_layer(self, needed):
+        """
+            A layer to load into: a free one, otherwise the least
+            recently used one not needed this frame. None if there's none.
+        """
+
+        if len(self.free_layers) > 0:
+            return self.free_layers.pop()
+
+        for material in self.resident:
+            if material not in needed:
+                layer = self.resident.pop(material)
+                self.eviction_count += 1
+                return layer
+
+        return None
+
+    def make_resident(self, material, needed, maps = None):
+
+        layer = self.get_layer(needed)
+        if layer is None:
+            return False
+
+        #read here if the worker hasn't, failing the same way it would
+        if maps is None:
+            try:
+                maps = self.store.read(material)
+            except Exception as error:
+                self.failed[material] = error
+                return False
+
+        self.store.load(material, layer, maps)
+        self.resident[material] = layer
+        self.load_count += 1
+        return True
+
+    def take(self, material, maps, error):
+        """
+            Take one of the worker's results.
+        """
+
+        self.requested.discard(material)
+        if error is not None:
+            self.failed[material] = error
+        elif material not in self.resident:
+            self.staged[material] = maps
+
+    def collect(self):
+        """
+            Take whatever the worker has finished reading.
+        """
+
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.take(*result)
+
+    def wait_for(self, material):
+        """
+            Block until the worker has finished reading material,
+            taking whatever else it finishes in the meantime.
+        """
+
+        while material in self.requested:
+            self.take(*self.results.get())
+
+    def prefetch(self, scene, needed):
+        """
+            Ask the worker for the materials behind any door of the
+            active rooms that the player is close to, as many as fit
+            beside the ones needed now.
+        """
+
+        if self.door_rooms is None:
+            self.find_door_rooms(scene.rooms)
+
+        #nearest door first
+        x,y = scene.camera.position[0:2]
+        doors = []
+        for _room in scene.active_rooms:
+            for _door in _room.doors:
+                row,col = _door.coordinate
+                distance = np.hypot(x - (col + 0.5), y - (row + 0.5))
+                if distance <= self.prefetch_distance:
+                    doors.append((distance, _door))
+        doors.sort(key = lambda entry: entry[0])
+
+        wanted = []
+        for distance,_door in doors:
+            for neighbour in self.door_rooms[id(_door)]:
+                for material in self.wrap(neighbour.get_materials()):
+                    if material not in needed and material not in wanted \
+                        and material not in self.failed:
+                        wanted.append(material)
+
+        #more than that and they'd only evict each other
+        for material in wanted[:max(0, self.store.capacity - len(needed))]:
+            if material in self.resident:
+                self.resident.move_to_end(material)
+            elif material not in self.staged and material not in self.requested:
+                self.requested.add(material)
+                self.requests.put(material)
+
+    def update(self, scene):
+        """
+            Make the active rooms' materials resident, start reading
+            ahead behind nearby doors and move read materials into
+            layers. Call before drawing, on the GL thread.
+        """
+
+        needed = set()
+        for _room in scene.active_rooms:
+            needed.update(self.wrap(_room.get_materials()))
+
+        self.collect()
+        changed = False
+
+        #anything visible now can't wait for the worker, though past
+        #the budget what doesn't fit stays on the fallback layer
+        self.fallback_count = 0
+        for material in sorted(needed):
+            if material in self.resident:
+                self.resident.move_to_end(material)
+                continue
+            #rather than read it a second time, alongside the worker
+            self.wait_for(material)
+            if material in self.failed:
+                self.fallback_count += 1
+                continue
+            maps = self.staged.pop(material, None)
+            if self.make_resident(material, needed, maps):
+                changed = True
+                continue
+            if maps is not None:
+                self.staged[material] = maps
+            self.fallback_count += 1
+
+        self.prefetch(scene, needed)
+
+        #a few read ahead materials per frame
+        uploads = 0
+        while len(self.staged) > 0 and uploads < self.uploads_per_frame:
+            material = next(iter(self.staged))
+            if not self.make_resident(material, needed, self.staged.pop(material)):
+                break
+            uploads += 1
+            changed = True
+
+        if changed:
+            self.store.upload_table()
+
+    def stats(self):
+
+        return {
+            "resident": len(self.resident),
+            "capacity": self.store.capacity,
+            "materials": self.store.material_count,
+            "staged": len(self.staged),
+            "requested": len(self.requested),
+            "loads": self.load_count,
+            "evictions": self.eviction_count,
+            "fallback": self.fallback_count,
+            "failed": len(self.failed),
+            "bytes": self.store.get_memory_usage()
+        }
+
+    def destroy(self):
+
+        self.requests.put(None)
+        self.worker.join()
@@ -15,6 +15,9 @@ class Room:
         self.internalCoordinates = []
         self.doors = []
 
+        #materials of the faces, see geometry.record_material
+        self.materials = set()
+
         self.vertices = []
         self.vertexCount = 0
     
@@ -28,6 +31,19 @@ class Room:
         if sphere not in self.spheres:
             self.spheres.append(sphere)
     
+    def get_materials(self):
+        """
+            Every material index drawn or traced in this room,
+            its doors included.
+        """
+
+        materials = set(self.materials)
+        materials.update(int(_plane.material_index) for _plane in self.planes)
+        for _door in self.doors:
+            materials.update(_door.materials)
+            materials.update(int(_plane.material_index) for _plane in _door.planes)
+        return materials
+    
     def finalize(self):
 
         self.vertices = np.array(self.vertices, dtype=np.float32)
@@ -39,21 +55,25 @@ class Room:
         offset = 0
         #position
         glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
         #texture
         glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 8
         #tangent
         glEnableVertexAttribArray(2)
-        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
         #bitangent
         glEnableVertexAttribArray(3)
-        glVertexAttribPointer(3, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(3, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
         #normal
         glEnableVertexAttribArray(4)
-        glVertexAttribPointer(4, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
-        offset += 12
\ No newline at end of file
+        glVertexAttribPointer(4, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
+        offset += 12
+        #material
+        glEnableVertexAttribArray(5)
+        glVertexAttribPointer(5, 1, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
+        offset += 4
\ No newline at end of file
@@ -244,24 +244,28 @@ class Scene:
         offset = 0
         #position
         glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
         #texture
         glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 8
         #tangent
         glEnableVertexAttribArray(2)
-        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
         #bitangent
         glEnableVertexAttribArray(3)
-        glVertexAttribPointer(3, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(3, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
         #normal
         glEnableVertexAttribArray(4)
-        glVertexAttribPointer(4, 3, GL_FLOAT, GL_FALSE, 56, ctypes.c_void_p(offset))
+        glVertexAttribPointer(4, 3, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
         offset += 12
+        #material
+        glEnableVertexAttribArray(5)
+        glVertexAttribPointer(5, 1, GL_FLOAT, GL_FALSE, 60, ctypes.c_void_p(offset))
+        offset += 4
     
         for _room in self.rooms:
             _room.finalize()
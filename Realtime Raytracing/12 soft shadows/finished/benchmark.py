@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+
+#Renders a fixed camera path at each work group size and reports
+#milliseconds per frame, e.g.
+#   python benchmark.py --tiles 1x1 8x8 16x8 --frames 120
+#   python benchmark.py --software      (Mesa llvmpipe, no GPU needed)
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description = "time the raytracer at several work group sizes")
+    parser.add_argument("--tiles", nargs = "+", default = ["1x1", "8x8", "16x8", "16x16", "32x8"])
+    parser.add_argument("--frames", type = int, default = 120)
+    parser.add_argument("--warmup", type = int, default = 10)
+    parser.add_argument("--width", type = int, default = 800)
+    parser.add_argument("--height", type = int, default = 600)
+    parser.add_argument("--software", action = "store_true", help = "force Mesa's llvmpipe rasterizer")
+    return parser.parse_args()
+
+arguments = parse_arguments()
+if arguments.software:
+    #must be set before the driver is loaded
+    os.environ["LIBGL_ALWAYS_SOFTWARE"] = "1"
+    os.environ["GALLIUM_DRIVER"] = "llvmpipe"
+
+from config import *
+import time
+import engine
+import scene
+
+def move_camera(_scene, frame, frameCount):
+    """
+        Turn on the spot in the first room, looking up and down.
+    """
+
+    _scene.camera.theta = 360 * frame / frameCount
+    _scene.camera.phi = 20 * np.sin(2 * np.pi * frame / frameCount)
+    _scene.camera.recalculateVectors()
+
+def run(tileSize, window, arguments):
+    """
+        Render the camera path with the given work group size.
+        Returns (wall clock ms/frame, raytrace pass summary).
+    """
+
+    _scene = scene.Scene()
+    graphicsEngine = engine.Engine(arguments.width, arguments.height, window, tileSize)
+
+    frameTimes = []
+    for frame in range(arguments.warmup + arguments.frames):
+        move_camera(_scene, frame, arguments.frames)
+        _scene.update(rate = 1)
+
+        start = time.perf_counter()
+        graphicsEngine.renderScene(_scene)
+        glFinish()
+        if frame >= arguments.warmup:
+            frameTimes.append(1000 * (time.perf_counter() - start))
+
+    #collect the last timer queries
+    graphicsEngine.profiler.end_frame()
+    raytrace = graphicsEngine.profiler.summary()["raytrace_pass"]
+    graphicsEngine.destroy()
+
+    return np.mean(frameTimes), raytrace
+
+if __name__ == "__main__":
+
+    glfw.init()
+    glfw.window_hint(GLFW_CONSTANTS.GLFW_CONTEXT_VERSION_MAJOR, 4)
+    glfw.window_hint(GLFW_CONSTANTS.GLFW_CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(GLFW_CONSTANTS.GLFW_OPENGL_PROFILE, GLFW_CONSTANTS.GLFW_OPENGL_CORE_PROFILE)
+    glfw.window_hint(GLFW_CONSTANTS.GLFW_OPENGL_FORWARD_COMPAT, GL_TRUE)
+    glfw.window_hint(GLFW_CONSTANTS.GLFW_DOUBLEBUFFER, False)
+    glfw.window_hint(GLFW_CONSTANTS.GLFW_VISIBLE, False)
+    window = glfw.create_window(arguments.width, arguments.height, "benchmark", None, None)
+    glfw.make_context_current(window)
+
+    print(f"renderer: {glGetString(GL_RENDERER).decode()}")
+    print(f"{'tile':>8} {'ms/frame':>10} {'raytrace p50':>14} {'raytrace p95':>14}")
+    for tile in arguments.tiles:
+        tileSize = tuple(int(size) for size in tile.split("x"))
+        frameTime, raytrace = run(tileSize, window, arguments)
+        clock = "gpu" if raytrace["gpu"]["count"] > 0 else "cpu"
+        print(f"{tile:>8} {frameTime:>10.2f} {raytrace[clock]['p50']:>14.2f} {raytrace[clock]['p95']:>14.2f}")
+
+    glfw.terminate()
+    sys.exit(0)
@@ -0,0 +1,352 @@
+from config import *
+import time
+import packing
+import lightcull
+
+#A NumPy port of the lighting in shaders/rayTracer.txt, for checking
+#levels without a GL 4.3 context. The geometry pass is replaced by a
+#primary trace against the same triangles the rasterizer draws, which
+#gives the same positions and normals, but flat albedo instead of materials.
+
+LIGHT_SIZE = 0.05
+OFFSETS = LIGHT_SIZE * np.array(
+    (
+        (-1, -1, -1), ( 1, -1, -1), ( 1,  1, -1), (-1,  1, -1),
+        (-1, -1,  1), ( 1, -1,  1), ( 1,  1,  1), (-1,  1,  1)
+    ), dtype = np.float32
+)
+
+def normalize(vectors):
+
+    return vectors / np.linalg.norm(vectors, axis = -1, keepdims = True)
+
+def save_image(image, filepath):
+    """
+        Save a float image: .npy files keep the raw values,
+        anything else is clamped to 8 bits and written by PIL.
+    """
+
+    if filepath.endswith(".npy"):
+        np.save(filepath, image)
+        return
+
+    pixels = (255 * np.clip(image, 0.0, 1.0)).astype(np.uint8)
+    Image.fromarray(pixels, mode = "RGB").save(filepath)
+
+class CPURayTracer:
+    """
+        Renders packed object records on the CPU.
+    """
+
+    def __init__(self, width, height, fovy = 45, batch_size = 8192, albedo = 0.8,
+                 light_tile_size = 16):
+        """
+            Parameters:
+                width, height (int): size of the output image
+                fovy (float): vertical field of view of the geometry pass
+                batch_size (int): pixels lit together
+                albedo (float): surface color used in place of materials
+                light_tile_size (int): pixels per side of a light culling
+                    tile, None to try every light at every pixel
+        """
+
+        self.width = width
+        self.height = height
+        self.fovy = fovy
+        self.batch_size = batch_size
+        self.albedo = albedo
+        self.light_tile_size = light_tile_size
+
+        self.ray_count = 0
+        self.render_time = 0.0
+
+    def load(self, objects, sphere_count, plane_count, light_count, triangles):
+        """
+            Unpack the records into plain arrays for tracing.
+        """
+
+        self.triangles = triangles
+
+        spheres = objects[:sphere_count]
+        self.sphere_centers = spheres[:,0:3]
+        self.sphere_radii = spheres[:,3]
+
+        planes = objects[sphere_count:sphere_count + plane_count]
+        self.plane_centers = planes[:,0:3]
+        self.plane_tangents = planes[:,3:6]
+        self.plane_bitangents = planes[:,6:9]
+        self.plane_normals = planes[:,9:12]
+        self.plane_bounds = planes[:,12:16]
+
+        lights = objects[sphere_count + plane_count:sphere_count + plane_count + light_count]
+        self.light_positions = lights[:,0:3]
+        self.light_strengths = lights[:,3]
+        self.light_colors = lights[:,4:7]
+        self.light_ranges = lights[:,7]
+
+    def primary_rays(self, camera, tile = None):
+        """
+            One ray through the center of each pixel of the tile
+            (x, y, width, height), or of the whole screen, bottom row
+            first, using the geometry pass's perspective projection.
+        """
+
+        x, y, width, height = tile or (0, 0, self.width, self.height)
+        x,y = np.meshgrid(
+            np.arange(x, x + width, dtype = np.float32),
+            np.arange(y, y + height, dtype = np.float32)
+        )
+        scale = np.tan(np.deg2rad(self.fovy) / 2)
+        horizontal = ((2 * x.ravel() + 1) / self.width - 1) * scale * self.width / self.height
+        vertical = ((2 * y.ravel() + 1) / self.height - 1) * scale
+
+        directions = camera.forwards + horizontal[:,np.newaxis] * camera.right \
+                    + vertical[:,np.newaxis] * camera.up
+
+        return normalize(directions).astype(np.float32)
+
+    def geometry_pass(self, camera, tile = None):
+        """
+            Trace the triangles from the camera, filling a g-buffer of
+            (color, emissive, position, normal, hit) per pixel.
+        """
+
+        triangles = self.triangles
+        directions = self.primary_rays(camera, tile)
+        self.ray_count += len(directions)
+
+        color = np.zeros_like(directions)
+        emissive = np.zeros_like(directions)
+        position = np.zeros_like(directions)
+        normal = np.zeros_like(directions)
+        hit = np.zeros(len(directions), dtype = bool)
+        if len(triangles) == 0:
+            return color, emissive, position, normal, hit
+
+        corners = triangles[:,:,0:3]
+        normals = triangles[:,:,11:14]
+        edge_a = corners[:,1] - corners[:,0]
+        edge_b = corners[:,2] - corners[:,0]
+        #every ray starts at the camera, so these only depend on the triangle
+        offset = camera.position - corners[:,0]
+        q = np.cross(offset, edge_a)
+        q_dot_edge_b = np.einsum("tk,tk->t", q, edge_b)
+
+        for first in range(0, len(directions), self.batch_size):
+            last = first + self.batch_size
+            direction = directions[first:last]
+
+            #Moller-Trumbore, every ray against every triangle
+            p = np.cross(direction[:,np.newaxis,:], edge_b)
+            determinant = np.einsum("rtk,tk->rt", p, edge_a)
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                inverse = 1.0 / determinant
+                u = np.einsum("rtk,tk->rt", p, offset) * inverse
+                v = (direction @ q.T) * inverse
+                t = q_dot_edge_b * inverse
+
+            #back faces are culled, as in the geometry pass
+            facing = np.einsum("rk,tk->rt", direction, normals[:,0]) < 0
+            valid = facing & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0.1)
+            t = np.where(valid, t, np.inf)
+
+            nearest = np.argmin(t, axis = 1)
+            rows = np.arange(len(direction))
+            distance = t[rows, nearest]
+            found = np.isfinite(distance)
+
+            #interpolate the corner normals, like the rasterizer does
+            rows = rows[found]
+            nearest = nearest[found]
+            weights = np.stack((1 - u - v, u, v), axis = 2)[rows, nearest][:,:,np.newaxis]
+            blended = np.sum(weights * normals[nearest], axis = 1)
+
+            hit[first:last] = found
+            position[first:last] = camera.position + np.where(found, distance, 0)[:,np.newaxis] * direction
+            normal[first + rows] = normalize(blended)
+
+        color[hit] = self.albedo
+
+        return color, emissive, position, normal, hit
+
+    def sphere_distances(self, origins, directions):
+        """
+            distanceTo(Ray, Sphere) for every ray against every sphere.
+        """
+
+        co = origins[:,np.newaxis,:] - self.sphere_centers
+        a = np.sum(directions * directions, axis = 1)[:,np.newaxis]
+        b = 2 * np.einsum("rk,rsk->rs", directions, co)
+        c = np.sum(co * co, axis = 2) - self.sphere_radii ** 2
+        discriminant = b * b - 4 * a * c
+
+        with np.errstate(invalid = "ignore"):
+            t = (-b - np.sqrt(discriminant)) / (2 * a)
+
+        length = t * np.linalg.norm(directions, axis = 1)[:,np.newaxis]
+        distance = np.where(t < 0.0001, 9999, length)
+        return np.where(discriminant > 0.0, distance, 99999)
+
+    def plane_distances(self, origins, directions):
+        """
+            distanceTo(Ray, Plane) for every ray against every plane.
+            Planes are one sided, only their front faces are hit.
+        """
+
+        denom = directions @ self.plane_normals.T
+        offset = np.einsum("pk,pk->p", self.plane_centers, self.plane_normals)[np.newaxis,:] \
+                - origins @ self.plane_normals.T
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            t = offset / denom
+
+        test_point = origins[:,np.newaxis,:] + t[:,:,np.newaxis] * directions[:,np.newaxis,:]
+        test_direction = test_point - self.plane_centers
+        u = np.einsum("rpk,pk->rp", test_direction, self.plane_tangents)
+        v = np.einsum("rpk,pk->rp", test_direction, self.plane_bitangents)
+
+        inside = (u > self.plane_bounds[:,0]) & (u < self.plane_bounds[:,1]) \
+                & (v > self.plane_bounds[:,2]) & (v < self.plane_bounds[:,3])
+        length = t * np.linalg.norm(directions, axis = 1)[:,np.newaxis]
+
+        distance = np.where(inside, length, 9999)
+        distance = np.where(t < 0.0001, 9999, distance)
+        return np.where(denom < 0.000001, distance, 9999)
+
+    def blocked(self, origins, directions, distance_to_light):
+        """
+            Shadow test: does anything sit between each point and its light?
+        """
+
+        self.ray_count += len(origins)
+        blocked = np.zeros(len(origins), dtype = bool)
+
+        if len(self.sphere_radii) > 0:
+            blocked |= np.any(self.sphere_distances(origins, directions) < distance_to_light[:,np.newaxis], axis = 1)
+        if len(self.plane_normals) > 0:
+            blocked |= np.any(self.plane_distances(origins, directions) < distance_to_light[:,np.newaxis], axis = 1)
+
+        return blocked
+
+    def get_listed_lights(self, camera, tile = None):
+        """
+            (pixels, lights) boolean array of the lights listed for
+            each pixel's light culling tile, as the shader reads them.
+        """
+
+        x, y, width, height = tile or (0, 0, self.width, self.height)
+        if self.light_tile_size is None:
+            return np.ones((width * height, len(self.light_positions)), dtype = bool)
+
+        grid, tiles = lightcull.build_light_grid(
+            self.light_positions, self.light_ranges, camera,
+            self.width, self.height, self.light_tile_size, self.fovy
+        )
+        x,y = np.meshgrid(np.arange(x, x + width), np.arange(y, y + height))
+        return lightcull.get_pixel_lights(
+            grid, tiles, self.light_tile_size, x.ravel(), y.ravel(), len(self.light_positions)
+        )
+
+    def light_fragments(self, position, normal, viewer_position, listed = None):
+        """
+            light_fragment() for a batch of g-buffer samples: ambient
+            light, then 8 shadow rays per light, for the lights listed
+            for each sample and in range of it.
+        """
+
+        color = np.full(position.shape, 0.2, dtype = np.float32)
+        frag_viewer = normalize(viewer_position - position)
+        if listed is None:
+            listed = np.ones((len(position), len(self.light_positions)), dtype = bool)
+
+        for i,(light_position, light_color, strength, light_range) in enumerate(zip(
+            self.light_positions, self.light_colors, self.light_strengths, self.light_ranges)):
+
+            in_range = np.linalg.norm(light_position - position, axis = 1) <= light_range
+            reached = np.flatnonzero(listed[:,i] & in_range)
+            if len(reached) == 0:
+                continue
+
+            for offset in OFFSETS:
+
+                frag_light = light_position + offset - position[reached]
+                distance_to_light = np.linalg.norm(frag_light, axis = 1)
+                frag_light = frag_light / distance_to_light[:,np.newaxis]
+                halfway = normalize(frag_viewer[reached] + frag_light)
+
+                lit = ~self.blocked(position[reached], frag_light, distance_to_light)
+
+                attenuation = strength / (distance_to_light * distance_to_light)
+                diffuse = np.maximum(0.0, np.sum(normal[reached] * frag_light, axis = 1))
+                specular = np.maximum(0.0, np.sum(normal[reached] * halfway, axis = 1)) ** 64
+                color[reached] += (lit * 0.125 * (diffuse + specular) * attenuation)[:,np.newaxis] * light_color
+
+        return color
+
+    def shade(self, gbuffer, viewer_position, listed = None):
+        """
+            main() of the shader: light each g-buffer sample,
+            listed being get_listed_lights for the same pixels.
+        """
+
+        color, emissive, position, normal, hit = gbuffer
+        final_color = np.array(emissive)
+
+        #empty pixels have no color to light
+        samples = np.flatnonzero(hit)
+        for first in range(0, len(samples), self.batch_size):
+            batch = samples[first:first + self.batch_size]
+            final_color[batch] += color[batch] * self.light_fragments(
+                position[batch], normal[batch], viewer_position,
+                None if listed is None else listed[batch]
+            )
+
+        return final_color
+
+    def render_tile(self, camera, tile = None):
+        """
+            Render one tile (x, y, width, height) of the loaded level,
+            or the whole screen. Returns a (height, width, 3) array,
+            bottom row first.
+        """
+
+        gbuffer = self.geometry_pass(camera, tile)
+        colors = self.shade(gbuffer, camera.position, self.get_listed_lights(camera, tile))
+
+        x, y, width, height = tile or (0, 0, self.width, self.height)
+        return colors.reshape(height, width, 3)
+
+    def render(self, objects, sphere_count, plane_count, light_count, triangles, camera):
+        """
+            Render the packed objects and triangles from the camera's point of view.
+            Returns a (height, width, 3) float32 image, top row first.
+        """
+
+        start = time.perf_counter()
+        self.ray_count = 0
+        self.load(objects, sphere_count, plane_count, light_count, triangles)
+
+        image = self.render_tile(camera)
+
+        self.render_time = time.perf_counter() - start
+
+        return np.ascontiguousarray(image[::-1])
+
+    def rays_per_second(self):
+
+        if self.render_time == 0:
+            return 0.0
+        return self.ray_count / self.render_time
+
+if __name__ == "__main__":
+
+    import scene
+
+    _scene = scene.Scene(use_gl = False)
+    objects, sphere_count, plane_count, light_count = packing.pack_scene(_scene)
+    triangles = packing.pack_triangles(_scene)
+
+    tracer = CPURayTracer(200, 150)
+    image = tracer.render(objects, sphere_count, plane_count, light_count, triangles, _scene.camera)
+    save_image(image, "cpu_frame.npy")
+    print(f"{tracer.ray_count} rays in {tracer.render_time:.2f}s, {tracer.rays_per_second():.0f} rays/s")
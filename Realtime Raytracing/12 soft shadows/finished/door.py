@@ -27,7 +27,8 @@ class Door:
             return
         self.finalized = True
 
-        self.vertices = np.array(self.vertices, dtype=np.float32)
+        #a view of a baked level goes to the driver as it is
+        self.vertices = np.ascontiguousarray(self.vertices, dtype=np.float32)
         self.vao = glGenVertexArrays(1)
         glBindVertexArray(self.vao)
         self.vbo = glGenBuffers(1)
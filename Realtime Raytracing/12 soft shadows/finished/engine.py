@@ -1,37 +1,57 @@
 from config import *
-import megatexture
+import re
+import denoiser
+import lightcull
+import materialstore
+import objectstore
+import packing
+import profiler
 
 class Engine:
     """
         Responsible for drawing scenes
     """
 
-    def __init__(self, width, height, window):
+    def __init__(self, width, height, window, tileSize = (8, 8)):
         """
             Initialize a flat raytracing context
             
                 Parameters:
                     width (int): width of screen
                     height (int): height of screen
+                    tileSize (tuple): pixels per work group, (x, y)
         """
         self.screenWidth = width
         self.screenHeight = height
+        self.tileSize = tileSize
         self.window = window
 
         self.targetFrameRate = 60
         self.frameRateMargin = 10
 
+        #shadow rays per light each frame: the temporal pass blends
+        #frames together, so they add up to all eight over a few frames
+        self.temporalAccumulation = True
+        self.shadowSamples = 2
+        self.temporalBlend = 0.125
+        self.frameIndex = 0
+        self.previousCamera = None
+
         #general OpenGL configuration
         self.shader = self.createShader("shaders/frameBufferVertex.txt",
                                         "shaders/frameBufferFragment.txt")
         
-        self.rayTracerShader = self.createComputeShader("shaders/rayTracer.txt")
+        self.rayTracerShader = self.createComputeShader("shaders/rayTracer.txt", tileSize)
+
+        self.temporalShader = self.createComputeShader("shaders/temporal.txt", tileSize)
 
         self.shaderGPass = self.createShader(
             "shaders/g_vertex.txt",
             "shaders/g_fragment.txt"
         )
 
+        self.createMaterialStore()
+
         self.set_onetime_shader_data()
 
         self.get_shader_locations()
@@ -41,17 +61,20 @@ class Engine:
         self.createQuad()
         self.createColorBuffers()
         self.createResourceMemory()
-        self.createMegaTexture()
+
+        #edge aware blur of the lighting, set its iterations to 0 to turn it off
+        self.denoiser = denoiser.Denoiser(
+            self.createComputeShader("shaders/denoise.txt", tileSize),
+            self.screenWidth, self.screenHeight
+        )
+
+        self.layoutKey = None
+
+        self.profiler = profiler.Profiler()
     
     def set_onetime_shader_data(self):
 
-        glUseProgram(self.shaderGPass)
-
-        glUniform1i(
-            glGetUniformLocation(
-                self.shaderGPass, "megaTexture"
-            ), 0
-        )
+        self.materialStore.set_samplers(self.shaderGPass)
     
     def get_shader_locations(self):
 
@@ -81,6 +104,22 @@ class Engine:
         self.sphereCountLocation = glGetUniformLocation(self.rayTracerShader, "sphereCount")
         self.planeCountLocation = glGetUniformLocation(self.rayTracerShader, "planeCount")
         self.lightCountLocation = glGetUniformLocation(self.rayTracerShader, "lightCount")
+        self.lightTilesLocation = glGetUniformLocation(self.rayTracerShader, "lightTiles")
+        self.lightTileSizeLocation = glGetUniformLocation(self.rayTracerShader, "lightTileSize")
+        self.shadowSamplesLocation = glGetUniformLocation(self.rayTracerShader, "shadowSamples")
+        self.frameIndexLocation = glGetUniformLocation(self.rayTracerShader, "frameIndex")
+
+        glUseProgram(self.temporalShader)
+
+        self.temporalLocations = {
+            name: glGetUniformLocation(self.temporalShader, name)
+            for name in (
+                "viewer.position", "viewer.forwards", "viewer.right", "viewer.up",
+                "previousViewer.position", "previousViewer.forwards",
+                "previousViewer.right", "previousViewer.up",
+                "projectionScale", "blendFactor", "historyValid"
+            )
+        }
      
     def createQuad(self):
         # x, y, z, s, t
@@ -181,35 +220,56 @@ class Engine:
 
     
         glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, self.screenWidth, self.screenHeight, 0, GL_RGBA, GL_FLOAT, None)
+
+        #for the temporal pass: lighting blended over frames, plus depth,
+        #one read while the other is written, swapping every frame
+        self.historyTextures = []
+        for i in range(2):
+            historyTexture = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, historyTexture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, self.screenWidth, self.screenHeight, 0, GL_RGBA, GL_FLOAT, None)
+            self.historyTextures.append(historyTexture)
+        self.historyIndex = 0
+
+        #what drawScreen shows
+        self.outputTexture = self.colorBuffer
     
     def createResourceMemory(self):
 
         """
-            allocate storage for up to 1024 objects (why not?)
+            allocate storage for 1024 objects to begin with, the
+            store grows if the active rooms hold more than that.
         """
 
-        objectData = []
+        self.objectStore = objectstore.ObjectStore(packing.RECORD, binding = 1)
+        self.objectData = self.objectStore.data.reshape(-1)
 
-        # sphere: (cx cy cz r)  (- - - -)     (- - - -)     (- - - -)
-        # plane:  (cx cy cz tx) (ty tz bx by) (bz nx ny nz) (umin umax vmin vmax)
-        # light:  (x y z s)     (r g b -)     (- - - -)     (- - - -)
-        for object in range(1024):
-            for attribute in range(16):
-                objectData.append(0.0)
-        self.objectData = np.array(objectData, dtype=np.float32)
+        #lights listed per 16x16 pixel tile
+        self.lightGrid = lightcull.LightGrid(binding = 3)
+        self.lightSlots = (0, 0)
 
-        self.objectDataTexture = glGenTextures(1)
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.objectDataTexture)
+        #the store is split into a region each for spheres, planes and
+        #lights, sized to hold every such object the active rooms have
+        self.slotRegions = [(0, 0), (0, 0), (0, 0)]
+        self.slotObjects = []
+        self.slotRecorders = []
+        self.slotVersions = []
+        self.freeSlots = [[], [], []]
+        #slot of every object which has one, by id
+        self.objectSlots = {}
 
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,4,1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
+    def getStorageStats(self):
+        """
+            Capacity and occupancy of the object store.
+        """
+
+        return self.objectStore.stats()
     
-    def createMegaTexture(self):
+    def createMaterialStore(self):
 
         filenames = [
             "AlienArchitecture", "AlternatingColumnsConcreteTile", "BiomechanicalPlumbing", 
@@ -217,7 +277,7 @@ class Engine:
             "CrumblingBrickWall", "DiamondSquareFlourishTiles", "EgyptianHieroglyphMetal"
         ]
 
-        self.megaTexture = megatexture.MegaTexture(filenames)
+        self.materialStore = materialstore.MaterialStore(filenames)
     
     def createShader(self, vertexFilepath, fragmentFilepath):
         """
@@ -236,117 +296,165 @@ class Engine:
         
         return shader
     
-    def createComputeShader(self, filepath):
+    def createComputeShader(self, filepath, localSize = (1, 1)):
         """
             Read source code, compile and link shaders.
+            The work group size in the source is replaced by localSize.
             Returns the compiled and linked program.
         """
 
         with open(filepath,'r') as f:
-            compute_src = f.readlines()
+            compute_src = f.read()
+
+        compute_src = re.sub(
+            r"layout\(local_size_x = \d+, local_size_y = \d+\) in;",
+            f"layout(local_size_x = {localSize[0]}, local_size_y = {localSize[1]}) in;",
+            compute_src
+        )
         
         shader = compileProgram(compileShader(compute_src, GL_COMPUTE_SHADER))
         
         return shader
 
-    def recordSphere(self, i, _sphere):
+    def getWorkGroupCount(self):
+        """
+            Work groups needed to cover the screen with tiles, the shader
+            skips the pixels of edge tiles which fall off the screen.
+        """
 
-        # sphere: (cx cy cz r) (- - - -) (- - - -) (- - - -)
+        tileWidth,tileHeight = self.tileSize
+        return (
+            (self.screenWidth + tileWidth - 1) // tileWidth,
+            (self.screenHeight + tileHeight - 1) // tileHeight
+        )
 
-        self.objectData[16*i]     = _sphere.center[0]
-        self.objectData[16*i + 1] = _sphere.center[1]
-        self.objectData[16*i + 2] = _sphere.center[2]
+    def layoutSlots(self, counts):
+        """
+            Split the object store into regions for spheres, planes
+            and lights, each at least doubling if it's too small
+            for the given count. Every slot starts out empty.
+        """
 
-        self.objectData[16*i + 3] = _sphere.radius
-    
-    def recordPlane(self, i, _plane):
+        glUseProgram(self.rayTracerShader)
+
+        sizes = []
+        for count,(first, size) in zip(counts, self.slotRegions):
+            if count > size:
+                size = max(count, 2 * size)
+            sizes.append(size)
+
+        firsts = np.cumsum([0] + sizes[:-1])
+        self.slotRegions = [(int(first), size) for first,size in zip(firsts, sizes)]
+        total = sum(sizes)
+
+        glUniform1f(self.sphereCountLocation, sizes[0])
+        glUniform1f(self.planeCountLocation, sizes[1])
+        glUniform1f(self.lightCountLocation, sizes[2])
+        self.lightSlots = self.slotRegions[2]
+
+        self.objectStore.reserve(total)
+        self.objectStore.count = total
+        #the store may have reallocated its array
+        self.objectData = self.objectStore.data.reshape(-1)
+        self.objectStore.data[:total] = packing.EMPTY_RECORD
+
+        self.slotObjects = [None] * total
+        self.slotRecorders = [packing.record_sphere] * sizes[0] \
+                            + [packing.record_plane] * sizes[1] \
+                            + [packing.record_light] * sizes[2]
+        #nothing has been uploaded to the new slots yet
+        self.slotVersions = [-1] * total
+        #handed out lowest first, so new objects tend to sit together
+        self.freeSlots = [list(range(first + size - 1, first - 1, -1)) for first,size in self.slotRegions]
+        self.objectSlots = {}
+
+    def assignSlots(self, scene):
+        """
+            Give every object of the active rooms a persistent record
+            in the object store. Objects keep their slots for as long
+            as they stay active: only those entering get a slot, and
+            those leaving give theirs back, emptied. Returns the slots
+            emptied, which need uploading.
+        """
 
-        # plane:  (cx cy cz tx) (ty tz bx by) (bz nx ny nz) (umin umax vmin vmax)
+        kinds = packing.gather_objects(scene)
 
-        self.objectData[16*i]     = _plane.center[0]
-        self.objectData[16*i + 1] = _plane.center[1]
-        self.objectData[16*i + 2] = _plane.center[2]
+        emptied = []
+        if any(len(objects) > size for objects,(first, size) in zip(kinds, self.slotRegions)):
+            self.layoutSlots([len(objects) for objects in kinds])
+            emptied = list(range(len(self.slotObjects)))
 
-        self.objectData[16*i + 3] = _plane.tangent[0]
-        self.objectData[16*i + 4] = _plane.tangent[1]
-        self.objectData[16*i + 5] = _plane.tangent[2]
+        active = set(id(_object) for objects in kinds for _object in objects)
 
-        self.objectData[16*i + 6] = _plane.bitangent[0]
-        self.objectData[16*i + 7] = _plane.bitangent[1]
-        self.objectData[16*i + 8] = _plane.bitangent[2]
+        for slot,_object in enumerate(self.slotObjects):
+            if _object is not None and id(_object) not in active:
+                del self.objectSlots[id(_object)]
+                self.slotObjects[slot] = None
+                self.slotVersions[slot] = -1
+                packing.record_empty(self.objectData, slot)
+                self.freeSlots[self.getSlotKind(slot)].append(slot)
+                emptied.append(slot)
 
-        self.objectData[16*i + 9]  = _plane.normal[0]
-        self.objectData[16*i + 10] = _plane.normal[1]
-        self.objectData[16*i + 11] = _plane.normal[2]
+        for kind,objects in enumerate(kinds):
+            self.freeSlots[kind].sort(reverse = True)
+            for _object in objects:
+                if id(_object) not in self.objectSlots:
+                    slot = self.freeSlots[kind].pop()
+                    self.objectSlots[id(_object)] = slot
+                    self.slotObjects[slot] = _object
 
-        self.objectData[16*i + 12] = _plane.uMin
-        self.objectData[16*i + 13] = _plane.uMax
-        self.objectData[16*i + 14] = _plane.vMin
-        self.objectData[16*i + 15] = _plane.vMax
-    
-    def recordLight(self, i, _light):
+        return emptied
+
+    def getSlotKind(self, slot):
+        """
+            0 for a sphere slot, 1 for a plane slot, 2 for a light slot.
+        """
 
-        # light:  (x y z s)     (r g b -)     (- - - -)     (- - - -)
+        for kind,(first, size) in enumerate(self.slotRegions):
+            if slot < first + size:
+                return kind
 
-        self.objectData[16*i]     = _light.position[0]
-        self.objectData[16*i + 1] = _light.position[1]
-        self.objectData[16*i + 2] = _light.position[2]
-        self.objectData[16*i + 3] = _light.strength
+    def uploadSlots(self, slots):
+        """
+            Send the given (sorted) records of the object store,
+            merging neighbouring records into a single upload.
+        """
+
+        if len(slots) == 0:
+            return
+
+        slots = np.array(slots)
+        breaks = np.flatnonzero(np.diff(slots) != 1) + 1
+        for run in np.split(slots, breaks):
+            self.objectStore.upload(run[0], len(run))
 
-        self.objectData[16*i + 4] = _light.color[0]
-        self.objectData[16*i + 5] = _light.color[1]
-        self.objectData[16*i + 6] = _light.color[2]
-    
     def updateScene(self, scene):
 
         scene.outDated = False
 
-        glUseProgram(self.rayTracerShader)
-
-        #spheres
-        sphereCount = 0
-        objectCount = 0
-        for i,_sphere in enumerate(scene.spheres):
-            self.recordSphere(i + sphereCount + objectCount, _sphere)
-        sphereCount += len(scene.spheres)
-        for room in scene.active_rooms:
-            for i, _sphere in enumerate(room.spheres):
-                self.recordSphere(i + sphereCount + objectCount, _sphere)
-            sphereCount += len(room.spheres)
-        glUniform1f(self.sphereCountLocation, sphereCount)
-        objectCount += sphereCount
-
-        #planes
-        planeCount = 0
-        for i,_plane in enumerate(scene.planes):
-            self.recordPlane(i + planeCount + objectCount, _plane)
-        planeCount += len(scene.planes)
-        for room in scene.active_rooms:
-            for i, _plane in enumerate(room.planes):
-                self.recordPlane(i + planeCount + objectCount, _plane)
-            planeCount += len(room.planes)
-            for door in room.doors:
-                for i,_plane in enumerate(door.planes):
-                    self.recordPlane(i + planeCount + objectCount, _plane)
-                planeCount += len(door.planes)
-        glUniform1f(self.planeCountLocation, planeCount)
-        objectCount += planeCount
-
-        #lights
-        lightCount = 0
-        for i,_light in enumerate(scene.lights):
-            self.recordLight(i + lightCount + objectCount, _light)
-        lightCount += len(scene.lights)
-        for room in scene.active_rooms:
-            for i, _light in enumerate(room.lights):
-                self.recordLight(i + lightCount + objectCount, _light)
-            lightCount += len(room.lights)
-        glUniform1f(self.lightCountLocation, lightCount)
-        objectCount += lightCount
-
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.objectDataTexture)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,4,1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
+        layoutKey = (len(scene.spheres), len(scene.planes), len(scene.lights)) \
+                    + tuple(id(room) for room in scene.active_rooms)
+        dirtySlots = []
+        if layoutKey != self.layoutKey:
+            self.layoutKey = layoutKey
+            dirtySlots = self.assignSlots(scene)
+
+        #only objects which changed since their last upload are recorded
+        for slot,_object in enumerate(self.slotObjects):
+            if _object is not None and _object.version != self.slotVersions[slot]:
+                self.slotRecorders[slot](self.objectData, slot, _object)
+                self.slotVersions[slot] = _object.version
+                dirtySlots.append(slot)
+
+        #a slot emptied and taken again this frame is only sent once
+        self.uploadSlots(sorted(set(dirtySlots)))
+
+        #the view moves every frame, so the light lists are rebuilt
+        first, count = self.lightSlots
+        lights = self.objectStore.data[first:first + count]
+        self.lightGrid.update(
+            lights[:,0:3], lights[:,7], scene.camera, self.screenWidth, self.screenHeight
+        )
     
     def prepare_geometry_pass(self, scene):
 
@@ -381,16 +489,15 @@ class Engine:
         ))
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glEnable(GL_DEPTH_TEST)
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.megaTexture.texture)
+        self.materialStore.bind()
 
         glEnable(GL_CULL_FACE)
         glCullFace(GL_BACK)
 
         glBindVertexArray(scene.vao)
         glDrawArrays(GL_TRIANGLES, 0, scene.vertexCount)
-        for _room in scene.active_rooms:
-            for _door in _room.doors:
+        for _room,doors in packing.gather_rooms(scene):
+            for _door in doors:
                 glBindVertexArray(_door.vao)
                 glDrawArrays(GL_TRIANGLES, 0, _door.vertexCount)
             glBindVertexArray(_room.vao)
@@ -408,8 +515,12 @@ class Engine:
 
         glActiveTexture(GL_TEXTURE0)
         glBindImageTexture(0, self.colorBuffer, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
-        glActiveTexture(GL_TEXTURE1)
-        glBindImageTexture(1, self.objectDataTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        self.objectStore.bind()
+        self.lightGrid.bind()
+        glUniform2i(self.lightTilesLocation, *self.lightGrid.tiles)
+        glUniform1i(self.lightTileSizeLocation, self.lightGrid.tile_size)
+        glUniform1i(self.shadowSamplesLocation, self.shadowSamples if self.temporalAccumulation else 8)
+        glUniform1i(self.frameIndexLocation, self.frameIndex)
         #g-Buffer
         glActiveTexture(GL_TEXTURE2)
         glBindImageTexture(2, self.g0Texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
@@ -425,19 +536,77 @@ class Engine:
         self.prepare_raytrace_pass(scene)
 
         glUseProgram(self.rayTracerShader)
-        glDispatchCompute(self.screenWidth, self.screenHeight, 1)
+        glDispatchCompute(*self.getWorkGroupCount(), 1)
   
         # make sure writing to image has finished before read
         glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
         glBindImageTexture(0, 0, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
 
+    def temporal_pass(self, scene):
+        """
+            Reproject last frame's history with last frame's camera
+            and blend this frame's lighting into it.
+        """
+
+        camera = scene.camera
+        basis = (camera.position, camera.forwards, camera.right, camera.up)
+        previousBasis = self.previousCamera or basis
+
+        glUseProgram(self.temporalShader)
+
+        locations = self.temporalLocations
+        for name,current,previous in zip(("position", "forwards", "right", "up"), basis, previousBasis):
+            glUniform3fv(locations[f"viewer.{name}"], 1, current)
+            glUniform3fv(locations[f"previousViewer.{name}"], 1, previous)
+        #as in prepare_geometry_pass
+        scale = np.tan(np.deg2rad(45) / 2)
+        glUniform2f(locations["projectionScale"], scale * self.screenWidth / self.screenHeight, scale)
+        glUniform1f(locations["blendFactor"], self.temporalBlend)
+        glUniform1i(locations["historyValid"], self.previousCamera is not None)
+
+        historyIn = self.historyTextures[self.historyIndex]
+        self.historyIndex = 1 - self.historyIndex
+        historyOut = self.historyTextures[self.historyIndex]
+
+        glBindImageTexture(0, self.colorBuffer, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        glBindImageTexture(1, historyOut, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+        glBindImageTexture(6, historyIn, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        glBindImageTexture(3, self.g1Texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        glBindImageTexture(4, self.g2Texture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+
+        glDispatchCompute(*self.getWorkGroupCount(), 1)
+
+        # the history is read as an image next frame, and drawn now
+        glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | GL_TEXTURE_FETCH_BARRIER_BIT)
+        glBindImageTexture(0, 0, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+
+        self.previousCamera = tuple(np.array(vector) for vector in basis)
+        self.frameIndex += 1
+
+    def getLightingTexture(self):
+        """
+            The texture holding this frame's lighting, before denoising.
+        """
+
+        if self.temporalAccumulation:
+            return self.historyTextures[self.historyIndex]
+        return self.colorBuffer
+
+    def denoise_pass(self):
+
+        self.outputTexture = self.denoiser.run(
+            self.getLightingTexture(),
+            (self.g0Texture, self.g1Texture, self.g2Texture),
+            self.getWorkGroupCount()
+        )
+
     def drawScreen(self):
         glDisable(GL_CULL_FACE)
         glDisable(GL_DEPTH_TEST)
         glUseProgram(self.shader)
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
         glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.colorBuffer)
+        glBindTexture(GL_TEXTURE_2D, self.outputTexture)
         #glBindTexture(GL_TEXTURE_2D, self.g2Texture)
         glBindVertexArray(self.vao)
         glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
@@ -449,10 +618,20 @@ class Engine:
             Draw all objects in the scene
         """
         
-        self.updateScene(scene)
-        self.geometry_pass(scene)
-        self.raytrace_pass(scene)
-        self.drawScreen()
+        with self.profiler.measure("updateScene"):
+            self.updateScene(scene)
+        with self.profiler.measure("geometry_pass"):
+            self.geometry_pass(scene)
+        with self.profiler.measure("raytrace_pass"):
+            self.raytrace_pass(scene)
+        if self.temporalAccumulation:
+            with self.profiler.measure("temporal_pass"):
+                self.temporal_pass(scene)
+        with self.profiler.measure("denoise_pass"):
+            self.denoise_pass()
+        with self.profiler.measure("drawScreen"):
+            self.drawScreen()
+        self.profiler.end_frame()
     
     def destroy(self):
         """
@@ -461,7 +640,14 @@ class Engine:
         glUseProgram(self.rayTracerShader)
         glMemoryBarrier(GL_ALL_BARRIER_BITS)
         glDeleteProgram(self.rayTracerShader)
+        glDeleteProgram(self.temporalShader)
         glDeleteVertexArrays(1, (self.vao,))
         glDeleteBuffers(1, (self.vbo,))
         glDeleteTextures(1, (self.colorBuffer,))
+        glDeleteTextures(len(self.historyTextures), self.historyTextures)
+        self.objectStore.destroy()
+        self.lightGrid.destroy()
+        self.denoiser.destroy()
+        self.materialStore.destroy()
+        self.profiler.destroy()
         glDeleteProgram(self.shader)
\ No newline at end of file
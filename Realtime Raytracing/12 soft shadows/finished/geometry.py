@@ -1,8 +1,33 @@
+import collections
+import numpy as np
 import room
 import door
 import plane
 import edge
 
+#Levels are grids of blocks: 0 is empty space, "d" a door and anything
+#else a wall, its number picking the material. Each step below works on
+#the whole grid at once, so big maps compile in well under a second.
+
+EMPTY_BLOCKS = (0, "d")
+
+def get_blocks(array):
+    """
+        The grid as a 2D object array, numbers and "d"s alike.
+    """
+
+    blocks = np.empty((len(array), len(array[0])), dtype = object)
+    blocks[:] = array
+    return blocks
+
+def get_empty_mask(array):
+    """
+        Boolean array, True where the block is empty space or a door.
+    """
+
+    blocks = get_blocks(array)
+    return (blocks == 0) | (blocks == "d")
+
 def get_lumped_geometry_from(array):
     """
         Get a description of what planes are visible.
@@ -12,318 +37,168 @@ def get_lumped_geometry_from(array):
         8: West wall
     """
 
-    rows = len(array)
-    cols = len(array[0])
+    solid = ~get_empty_mask(array)
 
-    empty_blocks = (0, "d")
+    #off the edge of the map counts as solid
+    padded = np.pad(solid, 1, constant_values = True)
+    north = padded[:-2, 1:-1]
+    east = padded[1:-1, 2:]
+    south = padded[2:, 1:-1]
+    west = padded[1:-1, :-2]
 
-    result = [[0 for col in range(cols)] for row in range(rows)]
+    result = np.where(solid, 15, 0)
+    result -= 1 * (solid & north)
+    result -= 2 * (solid & east)
+    result -= 4 * (solid & south)
+    result -= 8 * (solid & west)
 
-    for row in range(rows):
-        for col in range(cols):
-
-            #block
-            if array[row][col] not in empty_blocks:
-                result[row][col] = 15
+    return result
 
-                #north
-                if row == 0 or array[row - 1][col] not in empty_blocks:
-                    result[row][col] -= 1
-                
-                #east
-                if col == (cols - 1) or array[row][col + 1] not in empty_blocks:
-                    result[row][col] -= 2
-                
-                #south
-                if row == (rows - 1) or array[row + 1][col] not in empty_blocks:
-                    result[row][col] -= 4
-                
-                #west
-                if col == 0 or array[row][col - 1] not in empty_blocks:
-                    result[row][col] -= 8
-        
+def get_runs(bits):
+    """
+        Runs of True along each row of a boolean array.
+        Returns (row, first column, last column) arrays,
+        in the order a row by row scan would meet them.
+    """
 
-    return result
+    padded = np.pad(bits.astype(np.int8), ((0, 0), (1, 1)))
+    steps = np.diff(padded, axis = 1)
+    line, first = np.nonzero(steps == 1)
+    last = np.nonzero(steps == -1)[1] - 1
+    return line, first, last
 
 def get_edges(wall_mask):
+    """
+        Merge the visible faces of neighbouring blocks into edges:
+        north and south faces along rows, east and west faces
+        along columns.
+    """
 
-    rows = len(wall_mask)
-    cols = len(wall_mask[0])
+    wall_mask = np.asarray(wall_mask)
     edges = []
-    id = 0
 
-    #debugging: print mask
-    """
-    for row in range(rows):
-        for col in range(cols):
-            print(f"{wall_mask[row][col]} ", end="")
-        print()
-    """
-    
-    #North edges: 1
-    building_edge = False
-    _edge = None
-    for row in range(rows):
-        for col in range(cols):
-            
-            if wall_mask[row][col] & 1:
-                if not building_edge:
-                    building_edge = True
-                    _edge = edge.Edge(id)
-                    id += 1
-                    _edge.point_a = (row, col)
-                    _edge.type = edge.NORTH
-            else:
-                if building_edge:
-                    building_edge = False
-                    _edge.point_b = (row, col - 1)
-                    edges.append(_edge)
-            
-        if building_edge:
-            building_edge = False
-            _edge.point_b = (row, cols - 1)
-            edges.append(_edge)
-        
-    #East edges: 2
-    building_edge = False
-    _edge = None
-    for col in range(cols):
-        for row in range(rows):
-            
-            if wall_mask[row][col] & 2:
-                if not building_edge:
-                    building_edge = True
-                    _edge = edge.Edge(id)
-                    id += 1
-                    _edge.point_a = (row, col)
-                    _edge.type = edge.EAST
-            else:
-                if building_edge:
-                    building_edge = False
-                    _edge.point_b = (row - 1, col)
-                    edges.append(_edge)
-            
-        if building_edge:
-            building_edge = False
-            _edge.point_b = (rows - 1, col)
-            edges.append(_edge)
-    
-    #South: 4
-    building_edge = False
-    _edge = None
-    for row in range(rows):
-        for col in range(cols):
-            
-            if wall_mask[row][col] & 4:
-                if not building_edge:
-                    building_edge = True
-                    _edge = edge.Edge(id)
-                    id += 1
-                    _edge.point_b = (row, col)
-                    _edge.type = edge.SOUTH
+    for bit, transposed in ((edge.NORTH, False), (edge.EAST, True), (edge.SOUTH, False), (edge.WEST, True)):
+
+        bits = (wall_mask & bit) != 0
+        if transposed:
+            bits = bits.T
+
+        for line, first, last in zip(*get_runs(bits)):
+
+            line, first, last = int(line), int(first), int(last)
+            if transposed:
+                start, end = (first, line), (last, line)
             else:
-                if building_edge:
-                    building_edge = False
-                    _edge.point_a = (row, col - 1)
-                    edges.append(_edge)
-            
-        if building_edge:
-            building_edge = False
-            _edge.point_a = (row, cols - 1)
-            edges.append(_edge)
-        
-    #West: 8
-    building_edge = False
-    _edge = None
-    for col in range(cols):
-        for row in range(rows):
-            
-            if wall_mask[row][col] & 8:
-                if not building_edge:
-                    building_edge = True
-                    _edge = edge.Edge(id)
-                    id += 1
-                    _edge.point_b = (row, col)
-                    _edge.type = edge.WEST
+                start, end = (line, first), (line, last)
+
+            _edge = edge.Edge(len(edges))
+            _edge.type = bit
+            #edges run clockwise around the rooms
+            if bit in (edge.NORTH, edge.EAST):
+                _edge.point_a, _edge.point_b = start, end
             else:
-                if building_edge:
-                    building_edge = False
-                    _edge.point_a = (row - 1, col)
-                    edges.append(_edge)
-            
-        if building_edge:
-            building_edge = False
-            _edge.point_a = (rows - 1, col)
+                _edge.point_a, _edge.point_b = end, start
             edges.append(_edge)
-    
-    #debugging: print set of edges
+
+    return edges
+
+def make_door(row, col, walls):
     """
-    for _edge in edges:
-        print(f"Edge {_edge.id}: ", end="")
-        if _edge.type == edge.NORTH:
-            print("North: ",end="")
-        elif _edge.type == edge.EAST:
-            print("East: ",end="")
-        elif _edge.type == edge.SOUTH:
-            print("South: ",end="")
-        elif _edge.type == edge.WEST:
-            print("West: ",end="")
-        print(f"({_edge.point_a[0]}, {_edge.point_a[1]}) -> ({_edge.point_b[0]}, {_edge.point_b[1]})")
+        Make a door, build its central planes, then its external planes.
     """
 
-    return edges
+    newDoor = door.Door((row, col))
+    make_north_wall(row, col, 7, newDoor)
+    make_east_wall(row, col, 7, newDoor)
+    make_south_wall(row, col, 7, newDoor)
+    make_west_wall(row, col, 7, newDoor)
+    make_ceiling(row, col, 7, newDoor)
+    make_floor(row, col, 7, newDoor)
+    if walls[row+1][col] not in EMPTY_BLOCKS:
+        #horizontal, add top and bottom
+        make_north_wall(row + 1, col, 7, newDoor)
+        make_south_wall(row - 1, col, 7, newDoor)
+    else:
+        #vertical, add left and right
+        make_east_wall(row, col - 1, 7,newDoor)
+        make_west_wall(row, col + 1, 7,newDoor)
+    return newDoor
 
 def make_rooms(walls, doors, rooms):
     """
-        Perform Depth First search to partition the empty space
-        into rooms.
+        Flood fill the empty space to partition it into rooms.
+        Rooms spread through empty blocks but stop at doors, which
+        are shared with every room they touch.
 
-        Add planes to rooms.
+        Each room gets, in the order they're reached: its internal
+        coordinates (empty blocks and doors), its coordinates (the
+        walls around it) and its doors.
     """
 
-    #list of coordinates to search.
-    coordinates_to_expand = []
-    #history of coordinates which have already been searched.
-    expanded_coordinates = []
-    empty_blocks = (0, "d")
-
-    #get the first open block to search from
-    starting_coordinate = get_new_room(walls, expanded_coordinates)
-
-    while starting_coordinate is not None:
-        #start looking in a new room
-        coordinates_to_expand.append(starting_coordinate)
-        #empty blocks can be 0 or "d", but doors can be expanded from both sides,
-        #so remove any doors currently in history.
-        for i,coordinate in enumerate(expanded_coordinates):
-            row, col = coordinate
-            if walls[row][col] == "d":
-                expanded_coordinates.pop(i)
+    blocks = get_blocks(walls)
+    is_door = (blocks == "d")
+    empty = (blocks == 0) | is_door
+    open_space = empty & ~is_door
+    rows, cols = empty.shape
+
+    #room number of every open block, -1 until it's reached
+    labels = np.full(empty.shape, -1, dtype = np.int64)
+    door_lookup = {_door.coordinate: _door for _door in doors}
+
+    #rooms start from the first open block a row by row scan
+    #finds which isn't in a room yet
+    for start in np.flatnonzero(open_space):
+
+        start = divmod(int(start), cols)
+        if labels[start] >= 0:
+            continue
+
         newRoom = room.Room()
-    
-        #keep expanding empty space within the room, until done.
+        label = len(rooms)
+        labels[start] = label
+        internal = set()
+        surrounding = set()
+
+        coordinates_to_expand = collections.deque((start,))
         while len(coordinates_to_expand) > 0:
 
-            searched_coordinate = coordinates_to_expand.pop(0)
-            if searched_coordinate in expanded_coordinates:
-                #just in case the algorithm tells us to search
-                #the same space twice.
-                continue
-            expanded_coordinates.append(searched_coordinate)
-            neighbors = expand(walls, searched_coordinate, expanded_coordinates)
-            
+            row, col = coordinates_to_expand.popleft()
+            neighbors = [(row, col)]
+            if row > 0:
+                neighbors.append((row - 1, col))
+            if row < rows - 1:
+                neighbors.append((row + 1, col))
+            if col > 0:
+                neighbors.append((row, col - 1))
+            if col < cols - 1:
+                neighbors.append((row, col + 1))
+
             for coordinate in neighbors:
-                row,col = coordinate
-                #in the next iteration, only the empty space neighbours
-                #will be expanded
-                if walls[row][col] in empty_blocks:
-
-                    if coordinate not in expanded_coordinates:
-                        coordinates_to_expand.append(coordinate)
-                    
-                    #If we're on a door then search to see if the door already exists
-                    #(doors can belong to multiple rooms)
-                    if walls[row][col] == "d":
-                        alreadyExists = False
-                        for _door in doors:
-                            if coordinate == _door.coordinate:
-                                alreadyExists = True
-                        
-                        if not alreadyExists:
-                            #make a door, build the central planes,
-                            #then build the external planes
-                            newDoor = door.Door(coordinate)
-                            make_north_wall(row, col, 7, newDoor)
-                            make_east_wall(row, col, 7, newDoor)
-                            make_south_wall(row, col, 7, newDoor)
-                            make_west_wall(row, col, 7, newDoor)
-                            make_ceiling(row, col, 7, newDoor)
-                            make_floor(row, col, 7, newDoor)
-                            if walls[row+1][col] not in empty_blocks:
-                                #horizontal, add top and bottom
-                                make_north_wall(row + 1, col, 7, newDoor)
-                                make_south_wall(row - 1, col, 7, newDoor)
-                            else:
-                                #vertical, add left and right
-                                make_east_wall(row, col - 1, 7,newDoor)
-                                make_west_wall(row, col + 1, 7,newDoor)
-                            
-                            doors.append(newDoor)
-                            newRoom.doors.append(newDoor)
-                        else:
-                            #a door exists, find the instance of the door, and add it to the
-                            #current room
-                            newDoor = get_door_by_coordinate(doors, coordinate)
-                            newRoom.doors.append(newDoor)
-
-                        
-                    if coordinate not in newRoom.internalCoordinates:
-                        newRoom.internalCoordinates.append(coordinate)
-
-                elif coordinate not in newRoom.coordinates:
-                    newRoom.coordinates.append(coordinate)
-
-        #this room has been fully expanded, add it to the set
-        #of rooms, then attempt to start a new room.
-        rooms.append(newRoom)
-        starting_coordinate = get_new_room(walls, expanded_coordinates)
 
-def get_new_room(walls, expanded_coordinates):
-    """
-        Search the set of rooms and if an empty space is found
-        that hasn't been searched, return that coordinate.
-        Otherwise, return None
-    """
+                if not empty[coordinate]:
+                    if coordinate not in surrounding:
+                        surrounding.add(coordinate)
+                        newRoom.coordinates.append(coordinate)
+                    continue
 
-    #get dimensions of map
-    rows = len(walls)
-    cols = len(walls[0])
+                if open_space[coordinate] and labels[coordinate] < 0:
+                    labels[coordinate] = label
+                    coordinates_to_expand.append(coordinate)
 
-    for row in range(rows):
-        for col in range(cols):
-            if walls[row][col] == 0:
-                possible_solution = (row,col)
-                if possible_solution not in expanded_coordinates:
-                    return possible_solution
-    return None
+                if coordinate not in internal:
+                    internal.add(coordinate)
+                    newRoom.internalCoordinates.append(coordinate)
 
-def expand(walls, coordinate, expanded_coordinates):
-    """
-        return the neighbourhood of coordinates around a given coordinate,
-        returning all those which are in the same room.
-    """
+                    if is_door[coordinate]:
+                        #doors can belong to multiple rooms
+                        if coordinate not in door_lookup:
+                            door_lookup[coordinate] = make_door(*coordinate, walls)
+                            doors.append(door_lookup[coordinate])
+                        newRoom.doors.append(door_lookup[coordinate])
 
-    coordinates = [coordinate,]
+        rooms.append(newRoom)
 
-    rows = len(walls)
-    cols = len(walls[0])
-    
-    row,col = coordinate
-
-    onDoor = (walls[row][col] == "d")
-
-    if row > 0:
-        if (not onDoor) \
-            or (onDoor and walls[row - 1][col] != 0) \
-            and coordinate not in expanded_coordinates:
-            coordinates.append((row - 1, col))
-    if row < rows - 1:
-        if (not onDoor) \
-            or (onDoor and walls[row + 1][col] != 0) \
-            and coordinate not in expanded_coordinates:
-            coordinates.append((row + 1, col))
-    if col > 0:
-        if (not onDoor) \
-            or (onDoor and walls[row][col - 1] != 0) \
-            and coordinate not in expanded_coordinates:
-            coordinates.append((row, col - 1))
-    if col < cols - 1:
-        if (not onDoor) \
-            or (onDoor and walls[row][col + 1] != 0) \
-            and coordinate not in expanded_coordinates:
-            coordinates.append((row, col + 1))
-    
-    return coordinates
+    return labels
 
 def send_edge(_edge, target):
 
@@ -412,8 +287,7 @@ def make_north_wall(row, col, material, target):
         col + 1.0, row, 1.0, 1.0/5.0, (9.0 - material)/9.0,         -1.0, 0.0, 0.0, 0.0, 0.0, -1.0, 0.0, -1.0, 0.0, #z+,x+
     ]
 
-    for data in vertices:
-        target.vertices.append(data)
+    target.vertices.extend(vertices)
     
     target.vertexCount += 6
     
@@ -430,8 +304,7 @@ def make_east_wall(row, col, material, target):
         col + 1.0, row,       0.0, 0.0,     (9.0 - (material + 1.0))/9.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 1.0, 0.0, 0.0, #z-,y-
     ]
 
-    for data in vertices:
-        target.vertices.append(data)
+    target.vertices.extend(vertices)
     
     target.vertexCount += 6
 
@@ -448,8 +321,7 @@ def make_south_wall(row, col, material, target):
         col + 1.0, row + 1.0, 1.0, 1.0/5.0, (9.0 - material)/9.0,         -1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 1.0, 0.0, #z+,x+
     ]
 
-    for data in vertices:
-        target.vertices.append(data)
+    target.vertices.extend(vertices)
     
     target.vertexCount += 6
 
@@ -466,8 +338,7 @@ def make_west_wall(row, col, material, target):
         col, row + 1.0, 1.0, 1.0/5.0, (9.0 - material)/9.0,         0.0, 1.0, 0.0, 0.0, 0.0, -1.0, -1.0, 0.0, 0.0, #z+,y+
     ]
 
-    for data in vertices:
-        target.vertices.append(data)
+    target.vertices.extend(vertices)
     
     target.vertexCount += 6
 
@@ -484,8 +355,7 @@ def make_ceiling(row, col, material, target):
         col + 1, row,       1.0, 1.0/5.0, (9.0 - material)/9.0,         0.0, -1.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, -1.0, #x+,y-
     ]
 
-    for data in vertices:
-        target.vertices.append(data)
+    target.vertices.extend(vertices)
     
     target.vertexCount += 6
 
@@ -502,8 +372,7 @@ def make_floor(row, col, material, target):
         col + 1.0, row + 1.0, 0.0, 1.0/5.0, (9.0 - material)/9.0,         0.0, 1.0, 0.0, -1.0, 0.0, 0.0, 0.0, 0.0, 1.0, #x+,y+
     ]
 
-    for data in vertices:
-        target.vertices.append(data)
+    target.vertices.extend(vertices)
     
     target.vertexCount += 6
 
@@ -531,36 +400,64 @@ def get_geometry_at_point(row, col, target, walls, floors, ceilings, wall_mask):
         make_floor(row, col, floors[row][col] - 1, target)
         make_ceiling(row, col, ceilings[row][col] - 1, target)
 
-def classify_edges(edges):
+def get_next_edges(edges):
+    """
+        For each edge, the index of the first edge that starts next
+        to (or on) the block it ends on, -1 if none does.
+    """
 
-    for _edge in edges:
+    count = len(edges)
+    index = np.arange(count)
+    starts = np.array([_edge.point_a for _edge in edges], dtype = np.int64).reshape(-1, 2) + 1
+    ends = np.array([_edge.point_b for _edge in edges], dtype = np.int64).reshape(-1, 2) + 1
+
+    #the first two edges starting from each block, padded by a
+    #block all round so every neighbour can be looked up
+    shape = tuple(np.maximum(starts.max(axis = 0, initial = 0), ends.max(axis = 0, initial = 0)) + 2)
+    first = np.full(shape, count, dtype = np.int64)
+    np.minimum.at(first, (starts[:,0], starts[:,1]), index)
+    second = np.full(shape, count, dtype = np.int64)
+    later = first[starts[:,0], starts[:,1]] != index
+    np.minimum.at(second, (starts[later,0], starts[later,1]), index[later])
+
+    next_edges = np.full(count, count, dtype = np.int64)
+    for d_row in (-1, 0, 1):
+        for d_col in (-1, 0, 1):
+            row, col = ends[:,0] + d_row, ends[:,1] + d_col
+            candidate = first[row, col]
+            #an edge can't follow itself
+            candidate = np.where(candidate == index, second[row, col], candidate)
+            next_edges = np.minimum(next_edges, candidate)
+
+    next_edges[next_edges == count] = -1
+    return next_edges
 
-        if _edge.convex is not None:
-            continue
+def classify_edges(edges):
+    """
+        Join each edge to the next one around its room and mark
+        whether the corner between them is convex.
+    """
+
+    next_edges = get_next_edges(edges)
 
-        for _edge2 in edges:
+    for i,_edge in enumerate(edges):
 
-            if _edge2 == _edge:
-                continue
+        if _edge.convex is not None or next_edges[i] < 0:
+            continue
 
-            row_check = abs(_edge.point_b[0] - _edge2.point_a[0]) <= 1
-            col_check = abs(_edge.point_b[1] - _edge2.point_a[1]) <= 1
+        _edge2 = edges[next_edges[i]]
 
-            if row_check and col_check:
-                convex = is_convex(_edge.type, _edge2.type)
+        convex = is_convex(_edge.type, _edge2.type)
 
-                if _edge.convex is None:
-                    _edge.convex = convex
-                else:
-                    _edge.convex = _edge.convex and convex
+        if _edge.convex is None:
+            _edge.convex = convex
+        else:
+            _edge.convex = _edge.convex and convex
 
-                if _edge2.convex is None:
-                    _edge2.convex = convex
-                else:
-                    _edge2.convex = _edge2.convex and convex
-                #print(f"Edge {_edge.id} connects to edge {_edge2.id}")
-                #print(f"convex: {convex}")
-                break
+        if _edge2.convex is None:
+            _edge2.convex = convex
+        else:
+            _edge2.convex = _edge2.convex and convex
 
 def is_convex(type_1, type_2):
 
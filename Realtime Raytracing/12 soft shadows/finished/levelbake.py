@@ -0,0 +1,322 @@
+from config import *
+import os
+import sys
+import time
+import json
+import hashlib
+import room
+import door
+import plane
+import sphere
+import light
+import packing
+
+#A compiled level in one binary file: a small JSON header followed by
+#raw, aligned arrays. Loading maps the file and hands out views of it,
+#so the rooms' vertex arrays go to glBufferData without being copied
+#and big levels start at once. The file is named after a hash of the
+#grids and objects it was compiled from, so editing the map is all it
+#takes to have it compiled again.
+#
+#   magic (8 bytes) | version, header bytes (uint32) | header | sections
+
+MAGIC = b"LGLEVEL\0"
+
+BAKE_VERSION = 1
+
+#sections start on this boundary
+ALIGNMENT = 64
+
+#each room is a row of (first, count) spans into these sections
+ROOM_SPANS = ("planes", "vertices", "room_doors", "coordinates", "internal", "spheres", "lights")
+
+#each door is a row of row, col, then (first, count) spans
+DOOR_SPANS = ("planes", "vertices")
+
+def describe_sphere(_sphere):
+
+    return [
+        *_sphere.center_of_motion, _sphere.radius,
+        *_sphere.color, _sphere.roughness,
+        *_sphere.axis, _sphere.radius_of_motion,
+        _sphere.velocity
+    ]
+
+def describe_light(_light):
+
+    return [
+        *_light.center, _light.strength,
+        *_light.color, _light.radius,
+        *_light.axis, _light.velocity
+    ]
+
+def get_key(scene):
+    """
+        Hash of everything the compiled level depends on.
+    """
+
+    sources = {
+        "version": BAKE_VERSION,
+        "walls": scene.wall_geometry,
+        "floors": scene.floor_geometry,
+        "ceilings": scene.ceiling_geometry,
+        "spheres": [describe_sphere(_sphere) for _sphere in scene.spheres],
+        "lights": [describe_light(_light) for _light in scene.lights]
+    }
+    text = json.dumps(sources, default = float)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+def get_level_path(key, cache):
+
+    return os.path.join(cache, f"level_{key}.bin")
+
+def pack_level(scene):
+    """
+        Flatten a compiled scene's rooms and doors into named arrays.
+    """
+
+    sections = {name: [] for name in ROOM_SPANS}
+    planes = sections["planes"]
+    vertices = sections["vertices"]
+    rooms = np.zeros((len(scene.rooms), 2 * len(ROOM_SPANS)), dtype = np.int32)
+    doors = np.zeros((len(scene.doors), 2 + 2 * len(DOOR_SPANS)), dtype = np.int32)
+    door_index = {id(_door): i for i,_door in enumerate(scene.doors)}
+    vertex_count = 0
+
+    for i,_room in enumerate(scene.rooms):
+        items = {
+            "planes": _room.planes,
+            "vertices": [np.ravel(_room.vertices)],
+            "room_doors": [door_index[id(_door)] for _door in _room.doors],
+            "coordinates": _room.coordinates,
+            "internal": _room.internalCoordinates,
+            "spheres": [describe_sphere(_sphere) for _sphere in _room.spheres],
+            "lights": [describe_light(_light) for _light in _room.lights]
+        }
+        for j,name in enumerate(ROOM_SPANS):
+            #vertex spans count vertices, not arrays
+            if name == "vertices":
+                rooms[i, 2*j:2*j + 2] = (vertex_count, _room.vertexCount)
+                vertex_count += _room.vertexCount
+            else:
+                rooms[i, 2*j:2*j + 2] = (len(sections[name]), len(items[name]))
+            sections[name].extend(items[name])
+
+    for i,_door in enumerate(scene.doors):
+        doors[i, 0:2] = _door.coordinate
+        doors[i, 2:4] = (len(planes), len(_door.planes))
+        doors[i, 4:6] = (vertex_count, _door.vertexCount)
+        planes.extend(_door.planes)
+        vertices.append(np.ravel(_door.vertices))
+        vertex_count += _door.vertexCount
+
+    plane_records = np.zeros(len(planes), dtype = packing.RECORD)
+    for i,_plane in enumerate(planes):
+        packing.record_plane(plane_records.reshape(-1), i, _plane)
+
+    #room of each block, as the scene's room_lookup has it
+    room_index = {id(_room): i for i,_room in enumerate(scene.rooms)}
+    lookup = np.full(np.shape(scene.wall_geometry), -1, dtype = np.int32)
+    for (row, col),_room in scene.room_lookup.items():
+        lookup[row, col] = room_index[id(_room)]
+
+    return {
+        "rooms": rooms,
+        "doors": doors,
+        "planes": plane_records,
+        "plane_materials": np.array([_plane.material_index for _plane in planes], dtype = np.int32),
+        "vertices": np.concatenate(vertices + [np.zeros(0)]).astype(np.float32).reshape(-1, 14),
+        "room_doors": np.array(sections["room_doors"], dtype = np.int32),
+        "coordinates": np.array(sections["coordinates"], dtype = np.int32).reshape(-1, 2),
+        "internal": np.array(sections["internal"], dtype = np.int32).reshape(-1, 2),
+        "spheres": np.array(sections["spheres"], dtype = np.float64).reshape(-1, 13),
+        "lights": np.array(sections["lights"], dtype = np.float64).reshape(-1, 12),
+        "room_lookup": lookup
+    }
+
+def write_level(sections, filepath, key):
+    """
+        Write named arrays to a level file, through a temporary
+        file so a crash never leaves half a level behind.
+    """
+
+    header = {"key": key, "sections": {}}
+    offset = 0
+    for name,array in sections.items():
+        header["sections"][name] = {
+            "offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)
+        }
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    text = json.dumps(header).encode()
+    #the sections start on a boundary too
+    start = -(-(len(MAGIC) + 8 + len(text)) // ALIGNMENT) * ALIGNMENT
+    text = text.ljust(start - len(MAGIC) - 8)
+
+    temporary = f"{filepath}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array([BAKE_VERSION, len(text)], dtype = "<u4").tobytes())
+        f.write(text)
+        for name,array in sections.items():
+            f.seek(start + header["sections"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+    os.replace(temporary, filepath)
+
+def read_level(filepath, key = None):
+    """
+        Map a level file. Returns a dict of read only arrays, or
+        None if the file is missing, damaged, from another version
+        or, given a key, baked from other sources.
+    """
+
+    try:
+        with open(filepath, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            version, length = np.frombuffer(f.read(8), dtype = "<u4")
+            if version != BAKE_VERSION:
+                return None
+            header = json.loads(f.read(int(length)))
+    except (OSError, ValueError):
+        return None
+
+    if key is not None and header["key"] != key:
+        return None
+
+    start = len(MAGIC) + 8 + int(length)
+    if os.path.getsize(filepath) < start:
+        return None
+    #plain arrays backed by the map, memmap's own indexing is slow
+    data = np.memmap(filepath, dtype = np.uint8, mode = "r").view(np.ndarray)
+
+    sections = {}
+    for name,section in header["sections"].items():
+        dtype = np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+        first = start + section["offset"]
+        last = first + dtype.itemsize * int(np.prod(shape))
+        if last > data.size:
+            return None
+        sections[name] = data[first:last].view(dtype).reshape(shape)
+    return sections
+
+def get_span(spans, j):
+
+    first, count = spans[2*j:2*j + 2]
+    return slice(first, first + count)
+
+def make_plane(record, material_index):
+
+    return plane.Plane(
+        normal = record[9:12],
+        tangent = record[3:6],
+        bitangent = record[6:9],
+        uMin = float(record[12]), uMax = float(record[13]),
+        vMin = float(record[14]), vMax = float(record[15]),
+        center = record[0:3],
+        material_index = int(material_index)
+    )
+
+def make_sphere(record):
+
+    return sphere.Sphere(
+        center = record[0:3], radius = float(record[3]),
+        color = record[4:7], roughness = float(record[7]),
+        axis = record[8:11], radius_of_motion = float(record[11]),
+        velocity = float(record[12])
+    )
+
+def make_light(record):
+
+    return light.Light(
+        position = record[0:3], strength = float(record[3]),
+        color = record[4:7], radius = float(record[7]),
+        axis = record[8:11], velocity = float(record[11])
+    )
+
+def unpack_level(level, scene):
+    """
+        Fill a scene's rooms, doors and room lookup from a level,
+        as make_level and send_objects_to_rooms would have. Vertex
+        arrays are left as views of the level.
+    """
+
+    #Python lists index far faster than small slices of a map
+    planes = [
+        make_plane(record, material)
+        for record,material in zip(level["planes"].tolist(), level["plane_materials"].tolist())
+    ]
+    vertices = level["vertices"]
+    room_doors = level["room_doors"].tolist()
+    coordinates = [tuple(pair) for pair in level["coordinates"].tolist()]
+    internal = [tuple(pair) for pair in level["internal"].tolist()]
+    spheres = level["spheres"].tolist()
+    lights = level["lights"].tolist()
+
+    scene.doors = []
+    for row, col, first_plane, plane_count, first_vertex, vertex_count in level["doors"].tolist():
+        _door = door.Door((row, col))
+        _door.planes = planes[first_plane:first_plane + plane_count]
+        _door.vertices = vertices[first_vertex:first_vertex + vertex_count].reshape(-1)
+        _door.vertexCount = vertex_count
+        scene.doors.append(_door)
+
+    scene.rooms = []
+    for spans in level["rooms"].tolist():
+        _room = room.Room()
+        _room.planes = planes[get_span(spans, 0)]
+        span = get_span(spans, 1)
+        _room.vertices = vertices[span].reshape(-1)
+        _room.vertexCount = span.stop - span.start
+        _room.doors = [scene.doors[j] for j in room_doors[get_span(spans, 2)]]
+        _room.coordinates = coordinates[get_span(spans, 3)]
+        _room.internalCoordinates = internal[get_span(spans, 4)]
+        _room.spheres = [make_sphere(record) for record in spheres[get_span(spans, 5)]]
+        _room.lights = [make_light(record) for record in lights[get_span(spans, 6)]]
+        scene.rooms.append(_room)
+
+    lookup = level["room_lookup"]
+    rows, cols = np.nonzero(lookup >= 0)
+    scene.room_lookup = {
+        (row, col): scene.rooms[i]
+        for row,col,i in zip(rows.tolist(), cols.tolist(), lookup[rows, cols].tolist())
+    }
+
+    #every object now lives in a room
+    scene.spheres = []
+    scene.lights = []
+    scene.active_rooms = [scene.rooms[0],]
+
+def load(scene, cache = "cache"):
+    """
+        Fill the scene from its baked level if there's one for its
+        current grids and objects. Returns whether there was.
+    """
+
+    key = get_key(scene)
+    level = read_level(get_level_path(key, cache), key)
+    if level is None:
+        return False
+
+    unpack_level(level, scene)
+    return True
+
+def bake(scene, key, cache = "cache"):
+    """
+        Write a compiled scene to the cache, key being get_key
+        of the scene as it was before compiling.
+    """
+
+    os.makedirs(cache, exist_ok = True)
+    write_level(pack_level(scene), get_level_path(key, cache), key)
+
+if __name__ == "__main__":
+
+    #bake the level ahead of time: python levelbake.py [cache]
+    import scene
+    cache = sys.argv[1] if len(sys.argv) > 1 else "cache"
+    start = time.perf_counter()
+    _scene = scene.Scene(use_gl = False, cache = cache)
+    print(f"{len(_scene.rooms)} rooms, {len(_scene.doors)} doors in {time.perf_counter() - start:.2f}s")
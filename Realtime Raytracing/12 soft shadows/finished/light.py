@@ -24,8 +24,13 @@ class Light:
         self.axis = np.array(axis, dtype=np.float32)
         self.radius = radius
         self.velocity = velocity
+        #bumped each time the light moves
+        self.version = 0
     
     def update(self, rate):
 
         self.t += rate
-        self.position = self.center + self.radius * self.axis * np.sin(self.velocity * self.t)
\ No newline at end of file
+        position = self.center + self.radius * self.axis * np.sin(self.velocity * self.t)
+        if (position != self.position).any():
+            self.position = position
+            self.version += 1
\ No newline at end of file
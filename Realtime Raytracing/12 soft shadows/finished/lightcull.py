@@ -0,0 +1,188 @@
+from config import *
+
+#Sorts the lights into screen tiles, so each pixel only tries the lights
+#that can reach it. A light's range is where its falloff drops below
+#LIGHT_CUTOFF; its range sphere is projected to a rectangle of tiles and
+#it's listed in each of them. The grid is one int array:
+#
+#   (first, count) per tile, row by row from the bottom | light indices
+#
+#first being where the tile's indices start in the same array.
+
+#light each pixel may lose to culling, against 0.2 ambient
+LIGHT_CUTOFF = 0.02
+
+#half diagonal of the soft shadow sample cube, shaders/rayTracer.txt
+LIGHT_SPREAD = 0.05 * np.sqrt(3)
+
+def get_light_range(strength, color):
+    """
+        Distance past which a light adds less than LIGHT_CUTOFF:
+        diffuse and specular together reach 2 * strength * color / d^2.
+    """
+
+    return np.sqrt(2 * strength * np.max(color, axis = -1) / LIGHT_CUTOFF) + LIGHT_SPREAD
+
+def get_tile_count(width, height, tile_size):
+
+    return (-(-width // tile_size), -(-height // tile_size))
+
+def get_tile_bounds(positions, ranges, camera, width, height, tile_size,
+                    fovy = 45, near = 0.1):
+    """
+        First and last tile (x, y) covered by each light's range sphere,
+        as four (n,) arrays. The sphere's view space box is projected,
+        which always covers the sphere; one reaching behind the near
+        plane covers the whole screen.
+    """
+
+    tiles_x, tiles_y = get_tile_count(width, height, tile_size)
+    count = len(positions)
+    first_x = np.zeros(count, dtype = np.int64)
+    first_y = np.zeros(count, dtype = np.int64)
+    last_x = np.full(count, tiles_x - 1, dtype = np.int64)
+    last_y = np.full(count, tiles_y - 1, dtype = np.int64)
+    if count == 0:
+        return first_x, first_y, last_x, last_y
+
+    offset = np.asarray(positions, dtype = np.float64) - camera.position
+    x = offset @ camera.right
+    y = offset @ camera.up
+    z = offset @ camera.forwards
+
+    scale = np.tan(np.deg2rad(fovy) / 2)
+    aspect = width / height
+    ahead = z - ranges > near
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        #corners of the box, nearest and furthest depth
+        depth = np.stack((z - ranges, z + ranges))
+        ndc_x = np.stack((x - ranges, x + ranges))[:,np.newaxis,:] / (depth[np.newaxis,:,:] * scale * aspect)
+        ndc_y = np.stack((y - ranges, y + ranges))[:,np.newaxis,:] / (depth[np.newaxis,:,:] * scale)
+
+    #ndc to pixels to tiles, clamped to the screen
+    def to_tiles(ndc, pixels, tiles):
+        pixel = (ndc + 1) / 2 * pixels
+        return (
+            np.clip(np.floor(pixel.min(axis = (0, 1)) / tile_size), 0, tiles - 1).astype(np.int64),
+            np.clip(np.floor(pixel.max(axis = (0, 1)) / tile_size), 0, tiles - 1).astype(np.int64)
+        )
+
+    box_first_x, box_last_x = to_tiles(ndc_x, width, tiles_x)
+    box_first_y, box_last_y = to_tiles(ndc_y, height, tiles_y)
+
+    #off screen altogether
+    outside = ahead & (
+        (ndc_x.max(axis = (0, 1)) < -1) | (ndc_x.min(axis = (0, 1)) > 1)
+        | (ndc_y.max(axis = (0, 1)) < -1) | (ndc_y.min(axis = (0, 1)) > 1)
+    )
+
+    first_x = np.where(ahead, box_first_x, first_x)
+    first_y = np.where(ahead, box_first_y, first_y)
+    last_x = np.where(ahead, box_last_x, last_x)
+    last_y = np.where(ahead, box_last_y, last_y)
+    #an empty rectangle
+    last_x = np.where(outside, -1, last_x)
+
+    return first_x, first_y, last_x, last_y
+
+def build_light_grid(positions, ranges, camera, width, height, tile_size = 16,
+                     fovy = 45, near = 0.1):
+    """
+        The tile light lists for this view. positions is (n, 3),
+        ranges (n,), the indices listed are rows of them.
+        Returns the int32 grid and the tile count (x, y).
+    """
+
+    tiles_x, tiles_y = get_tile_count(width, height, tile_size)
+    first_x, first_y, last_x, last_y = get_tile_bounds(
+        positions, ranges, camera, width, height, tile_size, fovy, near
+    )
+
+    #(tiles, lights): does the light's rectangle hold the tile?
+    tile_y, tile_x = np.divmod(np.arange(tiles_x * tiles_y), tiles_x)
+    covered = (tile_x[:,np.newaxis] >= first_x) & (tile_x[:,np.newaxis] <= last_x) \
+            & (tile_y[:,np.newaxis] >= first_y) & (tile_y[:,np.newaxis] <= last_y)
+
+    counts = covered.sum(axis = 1)
+    header = 2 * tiles_x * tiles_y
+    grid = np.empty(header + counts.sum(), dtype = np.int32)
+    grid[0:header:2] = header + np.cumsum(counts) - counts
+    grid[1:header:2] = counts
+    #nonzero walks row by row, so each tile's lights come out together
+    grid[header:] = np.nonzero(covered)[1]
+
+    return grid, (tiles_x, tiles_y)
+
+def get_pixel_lights(grid, tiles, tile_size, x, y, light_count):
+    """
+        (pixels, lights) boolean array: is the light listed
+        for the tile holding pixel (x, y)?
+    """
+
+    tiles_x, tiles_y = tiles
+    tile = np.minimum(y // tile_size, tiles_y - 1) * tiles_x + np.minimum(x // tile_size, tiles_x - 1)
+
+    listed = np.zeros((tiles_x * tiles_y, light_count), dtype = bool)
+    for index in range(tiles_x * tiles_y):
+        first, count = grid[2 * index:2 * index + 2]
+        listed[index, grid[first:first + count]] = True
+
+    return listed[tile]
+
+class LightGrid:
+    """
+        The tile light lists, in a shader storage buffer.
+    """
+
+    def __init__(self, binding, tile_size = 16):
+        """
+            Parameters:
+                binding (int): shader storage binding point
+                tile_size (int): tile width and height, in pixels
+        """
+
+        self.binding = binding
+        self.tile_size = tile_size
+        self.tiles = (0, 0)
+        self.listed = 0
+
+        self.capacity = 0
+        self.buffer = glGenBuffers(1)
+
+    def update(self, positions, ranges, camera, width, height):
+        """
+            Rebuild the lists for this view and send them over.
+        """
+
+        grid, self.tiles = build_light_grid(
+            positions, ranges, camera, width, height, self.tile_size
+        )
+        header = 2 * self.tiles[0] * self.tiles[1]
+        self.listed = len(grid) - header
+
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.buffer)
+        if grid.nbytes > self.capacity:
+            self.capacity = 2 * grid.nbytes
+            glBufferData(GL_SHADER_STORAGE_BUFFER, self.capacity, None, GL_DYNAMIC_DRAW)
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, grid.nbytes, grid)
+
+    def bind(self):
+
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.buffer)
+
+    def stats(self):
+        """
+            Tiles, and lights listed per tile on average.
+        """
+
+        tile_count = self.tiles[0] * self.tiles[1]
+        return {
+            "tiles": tile_count,
+            "listed": self.listed,
+            "per_tile": self.listed / max(1, tile_count)
+        }
+
+    def destroy(self):
+
+        glDeleteBuffers(1, (self.buffer,))
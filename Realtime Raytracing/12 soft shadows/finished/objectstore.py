@@ -0,0 +1,111 @@
+from config import *
+
+class ObjectStore:
+    """
+        A growable array of packed records, mirrored in a shader storage
+        buffer. The shader sees the records as a flat vec4 array, so
+        every layout must be a whole number of vec4s.
+    """
+
+    def __init__(self, layout, binding, capacity = 1024):
+        """
+            Allocate room for capacity records and attach the buffer
+            to the given shader storage binding point.
+
+                Parameters:
+                    layout (np.dtype): record layout
+                    binding (int): shader storage binding point
+                    capacity (int): initial number of records
+        """
+
+        self.layout = layout
+        self.binding = binding
+        self.capacity = capacity
+        self.count = 0
+        self.grow_count = 0
+
+        self.data = np.zeros(capacity, dtype = layout)
+        self.buffer = self.make_buffer(capacity)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.buffer)
+
+    def make_buffer(self, capacity):
+        """
+            Make an empty storage buffer big enough for capacity records.
+        """
+
+        buffer = glGenBuffers(1)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, buffer)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, capacity * self.layout.itemsize, None, GL_DYNAMIC_DRAW)
+        return buffer
+
+    def reserve(self, count):
+        """
+            Make sure there's room for count records, doubling the
+            capacity as often as needed. Existing records are kept,
+            both in the array and on the GPU.
+        """
+
+        if count <= self.capacity:
+            return
+
+        capacity = self.capacity
+        while capacity < count:
+            capacity *= 2
+
+        data = np.zeros(capacity, dtype = self.layout)
+        data[:self.capacity] = self.data
+        self.data = data
+
+        #copy the old records across on the GPU, then drop the old buffer
+        buffer = self.make_buffer(capacity)
+        glBindBuffer(GL_COPY_READ_BUFFER, self.buffer)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+        glCopyBufferSubData(
+            GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER,
+            0, 0, self.capacity * self.layout.itemsize
+        )
+        glDeleteBuffers(1, (self.buffer,))
+
+        self.buffer = buffer
+        self.capacity = capacity
+        self.grow_count += 1
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.buffer)
+
+    def upload(self, first, count):
+        """
+            Send records [first, first + count) to the GPU.
+        """
+
+        if count <= 0:
+            return
+
+        size = self.layout.itemsize
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.buffer)
+        glBufferSubData(
+            GL_SHADER_STORAGE_BUFFER, int(first) * size, int(count) * size,
+            self.data[first:first + count].view(np.uint8)
+        )
+
+    def bind(self):
+        """
+            Attach the buffer to its binding point.
+        """
+
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.buffer)
+
+    def stats(self):
+        """
+            Capacity and occupancy of the store.
+        """
+
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "occupancy": self.count / self.capacity,
+            "bytes": self.capacity * self.layout.itemsize,
+            "grow_count": self.grow_count
+        }
+
+    def destroy(self):
+
+        glDeleteBuffers(1, (self.buffer,))
@@ -0,0 +1,129 @@
+from config import *
+import lightcull
+
+#Every object gets one 16 float record in the object store.
+# sphere: (cx cy cz r)  (- - - -)     (- - - -)     (- - - -)
+# plane:  (cx cy cz tx) (ty tz bx by) (bz nx ny nz) (umin umax vmin vmax)
+# light:  (x y z s)     (r g b range) (- - - -)     (- - - -)
+RECORD = np.dtype((np.float32, 16))
+
+#a slot nothing holds: far below the level, with no radius, no strength
+#and, as a plane, no extent, so it's never hit and never lights anything
+EMPTY_RECORD = np.array(
+    (0, 0, -1e6, 0,  0, 0, 0, 0,  0, 0, 0, 1,  1, -1, 1, -1), dtype = np.float32
+)
+
+def gather_rooms(scene):
+    """
+        Each active room with its doors, leaving out any door
+        already listed with an earlier room: the rooms either
+        side of a door share it.
+    """
+
+    listed = set()
+    rooms = []
+    for room in scene.active_rooms:
+        doors = [door for door in room.doors if id(door) not in listed]
+        listed.update(id(door) for door in doors)
+        rooms.append((room, doors))
+
+    return rooms
+
+def gather_objects(scene):
+    """
+        Collect the spheres, planes and lights the raytracer sees:
+        the scene's own, then those of each active room.
+    """
+
+    spheres = list(scene.spheres)
+    planes = list(scene.planes)
+    lights = list(scene.lights)
+    for room,doors in gather_rooms(scene):
+        spheres += room.spheres
+        planes += room.planes
+        for door in doors:
+            planes += door.planes
+        lights += room.lights
+    
+    return spheres, planes, lights
+
+def record_empty(target, i):
+
+    target[16*i:16*i + 16] = EMPTY_RECORD
+
+def record_sphere(target, i, _sphere):
+
+    target[16*i]     = _sphere.center[0]
+    target[16*i + 1] = _sphere.center[1]
+    target[16*i + 2] = _sphere.center[2]
+
+    target[16*i + 3] = _sphere.radius
+
+def record_plane(target, i, _plane):
+
+    target[16*i]     = _plane.center[0]
+    target[16*i + 1] = _plane.center[1]
+    target[16*i + 2] = _plane.center[2]
+
+    target[16*i + 3] = _plane.tangent[0]
+    target[16*i + 4] = _plane.tangent[1]
+    target[16*i + 5] = _plane.tangent[2]
+
+    target[16*i + 6] = _plane.bitangent[0]
+    target[16*i + 7] = _plane.bitangent[1]
+    target[16*i + 8] = _plane.bitangent[2]
+
+    target[16*i + 9]  = _plane.normal[0]
+    target[16*i + 10] = _plane.normal[1]
+    target[16*i + 11] = _plane.normal[2]
+
+    target[16*i + 12] = _plane.uMin
+    target[16*i + 13] = _plane.uMax
+    target[16*i + 14] = _plane.vMin
+    target[16*i + 15] = _plane.vMax
+
+def record_light(target, i, _light):
+
+    target[16*i]     = _light.position[0]
+    target[16*i + 1] = _light.position[1]
+    target[16*i + 2] = _light.position[2]
+    target[16*i + 3] = _light.strength
+
+    target[16*i + 4] = _light.color[0]
+    target[16*i + 5] = _light.color[1]
+    target[16*i + 6] = _light.color[2]
+    target[16*i + 7] = lightcull.get_light_range(_light.strength, _light.color)
+
+def pack_scene(scene):
+    """
+        Pack everything gather_objects finds into a fresh array of records,
+        in the same slot order the engine uses.
+        Returns the (n, 16) array and the sphere, plane and light counts.
+    """
+
+    spheres, planes, lights = gather_objects(scene)
+    objects = np.zeros(len(spheres) + len(planes) + len(lights), dtype = RECORD)
+    target = objects.reshape(-1)
+
+    recorders = [record_sphere] * len(spheres) \
+                + [record_plane] * len(planes) \
+                + [record_light] * len(lights)
+    for slot,(recorder, _object) in enumerate(zip(recorders, spheres + planes + lights)):
+        recorder(target, slot, _object)
+
+    return objects, len(spheres), len(planes), len(lights)
+
+def pack_triangles(scene):
+    """
+        Gather the triangles the geometry pass draws (the scene's, then
+        each active room's and its doors') into an (n, 3, 14) array:
+        x,y,z,u,v,tx,ty,tz,bx,by,bz,nx,ny,nz per corner.
+    """
+
+    vertices = [np.ravel(scene.vertices)]
+    for room,doors in gather_rooms(scene):
+        for door in doors:
+            vertices.append(np.ravel(door.vertices))
+        vertices.append(np.ravel(room.vertices))
+
+    return np.concatenate(vertices).astype(np.float32).reshape(-1, 3, 14)
@@ -27,4 +27,6 @@ class Plane:
         self.vMin = vMin
         self.vMax = vMax
         self.center = np.array(center, dtype=np.float32)
-        self.material_index = material_index
\ No newline at end of file
+        self.material_index = material_index
+        #planes are static, so this stays put
+        self.version = 0
\ No newline at end of file
@@ -0,0 +1,140 @@
+from config import *
+import collections
+
+#Rooms only meet at doors, so a room can only be seen down a chain of
+#doors. Looking down on the map, the camera sees a fan of directions
+#(bearings, relative to where it faces); each door it looks through
+#narrows the fan to the door's width, and a room stays hidden once its
+#fan closes. Everything is worked out in the plane of the floor, so the
+#result is a superset of what's visible, never less.
+
+def wrap(angle):
+
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+ALL_ROUND = (-np.inf, np.inf)
+
+def find_door_rooms(rooms):
+    """
+        For each door, the rooms it opens onto.
+    """
+
+    door_rooms = collections.defaultdict(list)
+    for _room in rooms:
+        for _door in _room.doors:
+            door_rooms[id(_door)].append(_room)
+    return door_rooms
+
+def find_cell_rooms(rooms):
+    """
+        For each block, the rooms it's inside: one, or two for a door.
+    """
+
+    cell_rooms = collections.defaultdict(list)
+    for _room in rooms:
+        for coordinate in _room.internalCoordinates:
+            cell_rooms[coordinate].append(_room)
+    return cell_rooms
+
+def get_heading(camera):
+
+    return np.arctan2(camera.forwards[1], camera.forwards[0])
+
+def get_view_fan(camera, aspect = 800/600):
+    """
+        Bearings the screen covers, as the raytracer casts its rays:
+        forwards plus up to one right and 1/aspect up. ALL_ROUND
+        when looking down or up steeply enough to see behind.
+    """
+
+    heading = get_heading(camera)
+    facing = np.array([np.cos(heading), np.sin(heading)])
+
+    bearings = []
+    for x in (-1, 1):
+        for y in (-1 / aspect, 1 / aspect):
+            ray = (camera.forwards + x * camera.right + y * camera.up)[0:2]
+            if np.dot(ray, facing) <= 1e-6:
+                return ALL_ROUND
+            bearings.append(wrap(np.arctan2(ray[1], ray[0]) - heading))
+
+    return (min(bearings), max(bearings))
+
+def get_door_fan(position, heading, coordinate):
+    """
+        Bearings from position covered by a door's block,
+        ALL_ROUND if position is inside it.
+    """
+
+    row,col = coordinate
+    x,y = position[0:2]
+    if col <= x <= col + 1 and row <= y <= row + 1:
+        return ALL_ROUND
+
+    centre = np.arctan2(row + 0.5 - y, col + 0.5 - x)
+    spread = [
+        wrap(np.arctan2(corner_y - y, corner_x - x) - centre)
+        for corner_x in (col, col + 1) for corner_y in (row, row + 1)
+    ]
+    centre = wrap(centre - heading)
+    return (centre + min(spread), centre + max(spread))
+
+def clip_fan(fan, door_fan):
+    """
+        The part of fan seen through door_fan, None if there's none.
+        Both are less than half a turn wide unless ALL_ROUND, so only
+        one turn of door_fan can overlap.
+    """
+
+    if np.isinf(fan[0]):
+        return door_fan
+    if np.isinf(door_fan[0]):
+        return fan
+
+    first, last = door_fan
+    turns = np.round((fan[0] + fan[1] - first - last) / (4 * np.pi))
+    first += 2 * np.pi * turns
+    last += 2 * np.pi * turns
+
+    first = max(first, fan[0])
+    last = min(last, fan[1])
+    if first >= last:
+        return None
+    return (first, last)
+
+def find_visible_rooms(camera, cell_rooms, door_rooms, max_depth = 4, aspect = 800/600):
+    """
+        Rooms the camera can see, its own first, then in the order
+        their doors were reached. max_depth caps the doors a chain
+        may pass through.
+    """
+
+    row = int(camera.position[1])
+    col = int(camera.position[0])
+    heading = get_heading(camera)
+    view_fan = get_view_fan(camera, aspect)
+
+    visible = []
+    seen = set()
+
+    def visit(_room, fan, depth, path):
+
+        if id(_room) not in seen:
+            seen.add(id(_room))
+            visible.append(_room)
+
+        if depth == max_depth:
+            return
+
+        for _door in _room.doors:
+            door_fan = clip_fan(fan, get_door_fan(camera.position, heading, _door.coordinate))
+            if door_fan is None:
+                continue
+            for neighbour in door_rooms[id(_door)]:
+                if id(neighbour) not in path:
+                    visit(neighbour, door_fan, depth + 1, path | {id(neighbour)})
+
+    for _room in cell_rooms.get((row, col), []):
+        visit(_room, view_fan, 0, {id(_room)})
+
+    return visible
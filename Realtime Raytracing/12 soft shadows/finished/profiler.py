@@ -0,0 +1,186 @@
+from config import *
+import collections
+import contextlib
+import csv
+import ctypes
+import json
+import time
+from OpenGL.raw.GL.VERSION import GL_3_3
+
+def get_query_result(query):
+    """
+        A timer query's result, in nanoseconds. Read through the raw
+        binding: the wrapped glGetQueryObjectui64v looks up an output
+        size for GL_UNSIGNED_INT64_AMD, which PyOpenGL doesn't know.
+    """
+
+    value = ctypes.c_uint64()
+    GL_3_3.glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(value))
+    return value.value
+
+class Profiler:
+    """
+        Times the passes of each frame, on the CPU with perf_counter and
+        on the GPU with GL_TIME_ELAPSED queries, and keeps a rolling
+        window of samples per pass. A pass measured more than once in
+        a frame counts as one sample, the sum of its times.
+    """
+
+    def __init__(self, window = 240, gpu = True):
+        """
+            Parameters:
+                window (int): samples kept per pass
+                gpu (bool): also time passes with timer queries
+        """
+
+        self.window = window
+        self.gpu = gpu
+
+        self.cpu_times = collections.defaultdict(self.make_history)
+        self.gpu_times = collections.defaultdict(self.make_history)
+        #CPU times of the frame in progress
+        self.frame_cpu_times = collections.defaultdict(float)
+
+        #GPU results arrive a frame or two late, so queries wait here,
+        #tagged with the frame they were made in
+        self.free_queries = []
+        self.pending_queries = []
+
+        self.frame_start = None
+        self.frame_number = 0
+        #frame each pass's latest returned timing was recorded in
+        self.sample_frames = {}
+
+    def make_history(self):
+
+        return collections.deque(maxlen = self.window)
+
+    def get_query(self):
+
+        if len(self.free_queries) == 0:
+            return int(glGenQueries(1)[0])
+        return self.free_queries.pop()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """
+            Time the enclosed code as the pass called name.
+            Passes must not nest, timer queries can't overlap.
+        """
+
+        query = None
+        if self.gpu:
+            query = self.get_query()
+            glBeginQuery(GL_TIME_ELAPSED, query)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.frame_cpu_times[name] += 1000 * (time.perf_counter() - start)
+            if query is not None:
+                glEndQuery(GL_TIME_ELAPSED)
+                self.pending_queries.append((name, query, self.frame_number))
+
+    def end_frame(self):
+        """
+            Record the whole frame's time and collect the GPU timings
+            of any frames which have become available, without waiting
+            on the rest. Returns the new timings, {pass: milliseconds}:
+            the latest collected frame's GPU times if the profiler has
+            them, otherwise this frame's CPU times. sample_frames says
+            which frame each of them came from.
+        """
+
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.cpu_times["frame"].append(1000 * (now - self.frame_start))
+        self.frame_start = now
+
+        frame = self.frame_number
+        self.frame_number += 1
+
+        cpu_times = dict(self.frame_cpu_times)
+        self.frame_cpu_times.clear()
+        for name,milliseconds in cpu_times.items():
+            self.cpu_times[name].append(milliseconds)
+
+        if not self.gpu:
+            for name in cpu_times:
+                self.sample_frames[name] = frame
+            return cpu_times
+
+        frames = collections.defaultdict(list)
+        for name,query,made_in in self.pending_queries:
+            frames[made_in].append((name, query))
+
+        #a frame is only collected once all of its results are in, so
+        #a pass measured twice is never reported half summed
+        collected = {}
+        waiting = []
+        for made_in,queries in sorted(frames.items()):
+            if len(waiting) > 0 or not all(
+                int(glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE)) for name,query in queries):
+                waiting.extend((name, query, made_in) for name,query in queries)
+                continue
+
+            gpu_times = collections.defaultdict(float)
+            for name,query in queries:
+                gpu_times[name] += get_query_result(query) / 1e6
+                self.free_queries.append(query)
+            for name,milliseconds in gpu_times.items():
+                self.gpu_times[name].append(milliseconds)
+                self.sample_frames[name] = made_in
+            collected.update(gpu_times)
+        self.pending_queries = waiting
+
+        return collected
+
+    def percentiles(self, samples):
+
+        if len(samples) == 0:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "count": 0}
+
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        return {
+            "p50": float(p50), "p95": float(p95), "p99": float(p99),
+            "mean": float(np.mean(samples)), "count": len(samples)
+        }
+
+    def summary(self):
+        """
+            Rolling percentiles of every pass, in milliseconds:
+            {pass: {"cpu": {...}, "gpu": {...}}}
+        """
+
+        names = list(self.cpu_times) + [name for name in self.gpu_times if name not in self.cpu_times]
+        return {
+            name: {
+                "cpu": self.percentiles(self.cpu_times.get(name, ())),
+                "gpu": self.percentiles(self.gpu_times.get(name, ()))
+            } for name in names
+        }
+
+    def dump_json(self, filepath):
+
+        with open(filepath, "w") as f:
+            json.dump(self.summary(), f, indent = 4)
+
+    def dump_csv(self, filepath):
+
+        with open(filepath, "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(("pass", "clock", "p50", "p95", "p99", "mean", "count"))
+            for name,clocks in self.summary().items():
+                for clock,stats in clocks.items():
+                    writer.writerow(
+                        (name, clock, stats["p50"], stats["p95"], stats["p99"], stats["mean"], stats["count"])
+                    )
+
+    def destroy(self):
+
+        queries = self.free_queries + [query for name,query,made_in in self.pending_queries]
+        if len(queries) > 0:
+            glDeleteQueries(len(queries), queries)
+        self.free_queries = []
+        self.pending_queries = []
@@ -5,6 +5,8 @@ import light
 import geometry
 import room
 import plane
+import levelbake
+import portals
 
 class Scene:
     """
@@ -12,9 +14,15 @@ class Scene:
     """
 
 
-    def __init__(self):
+    def __init__(self, use_gl = True, cache = "cache"):
         """
             Set up scene objects.
+
+                Parameters:
+                    use_gl (bool): make the vertex buffers for drawing,
+                        leave this off to build the scene without a context.
+                    cache (str): where the compiled level is baked,
+                        None to compile it every time.
         """
 
         """
@@ -163,11 +171,34 @@ class Scene:
 
         self.outDated = True
 
+        self.load_level(cache)
+
+        #doors are portals between rooms, rooms more doors
+        #away than this aren't traced
+        self.portal_depth = 4
+        self.door_rooms = portals.find_door_rooms(self.rooms)
+        self.cell_rooms = portals.find_cell_rooms(self.rooms)
+
+        if use_gl:
+            self.finalize()
+    
+    def load_level(self, cache):
+        """
+            Load the level baked from the current grids and objects,
+            or compile it, and bake it if there's a cache to bake to.
+        """
+
+        if cache is not None and levelbake.load(self, cache):
+            return
+
+        key = levelbake.get_key(self)
+
         self.make_level()
 
         self.send_objects_to_rooms()
 
-        self.finalize()
+        if cache is not None:
+            levelbake.bake(self, key, cache)
     
     def make_level(self):
 
@@ -235,7 +266,8 @@ class Scene:
     
     def finalize(self):
 
-        self.vertices = np.array(self.vertices, dtype=np.float32)
+        #a view of a baked level goes to the driver as it is
+        self.vertices = np.ascontiguousarray(self.vertices, dtype=np.float32)
         self.vao = glGenVertexArrays(1)
         glBindVertexArray(self.vao)
         self.vbo = glGenBuffers(1)
@@ -307,20 +339,17 @@ class Scene:
 
     def update(self, rate):
 
-        row = int(self.camera.position[1])
-        col = int(self.camera.position[0])
-        coordinate = (row,col)
-        
-        self.active_rooms = []
+        #the camera's room and those seen through its doors
+        self.active_rooms = portals.find_visible_rooms(
+            self.camera, self.cell_rooms, self.door_rooms, self.portal_depth
+        )
 
-        for room in self.rooms:
-            if coordinate in room.internalCoordinates:
-                self.active_rooms.append(room)
+        for room in self.active_rooms:
+            
+            for _light in room.lights:
+                _light.update(rate)
             
-                for _light in room.lights:
-                    _light.update(rate)
-                
-                for _sphere in room.spheres:
-                    _sphere.update(rate)
+            for _sphere in room.spheres:
+                _sphere.update(rate)
         
         self.outDated = True
\ No newline at end of file
@@ -24,8 +24,13 @@ class Sphere:
         self.axis = np.array(axis, dtype=np.float32)
         self.radius_of_motion = radius_of_motion
         self.velocity = velocity
+        #bumped whenever the sphere changes, so the engine knows to re-send it
+        self.version = 0
     
     def update(self, rate):
 
         self.t += rate
-        self.center = self.center_of_motion + self.radius_of_motion * self.axis * np.sin(self.velocity * self.t)
\ No newline at end of file
+        center = self.center_of_motion + self.radius_of_motion * self.axis * np.sin(self.velocity * self.t)
+        if (center != self.center).any():
+            self.center = center
+            self.version += 1
\ No newline at end of file
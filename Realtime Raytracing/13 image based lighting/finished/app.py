@@ -44,6 +44,7 @@ class App:
             
             self.handleKeys()
             self.handleMouse()
+            self.scene.update(rate = self.frameTime / 16)
             
             #render
             self.graphicsEngine.renderScene(self.scene)
@@ -87,7 +88,6 @@ class App:
             self.lastTime = self.currentTime
             self.numFrames = -1
             self.frameTime = float(1000.0 / max(1,framerate))
-            self.graphicsEngine.adaptResolution(framerate)
         self.numFrames += 1
 
     def quit(self):
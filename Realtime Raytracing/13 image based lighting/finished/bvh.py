@@ -0,0 +1,415 @@
+from config import *
+
+class BVH:
+    """
+        Bounding volume hierarchy over a set of spheres, stored as flat arrays.
+
+        Nodes are numbered depth first, so every hit and miss link points
+        forwards, which is what the stackless loop in rayTracer.txt expects.
+    """
+
+
+    def __init__(self, bin_count = 16, max_leaf_size = 16, min_leaf_size = 4,
+                 traversal_cost = 1.0, intersection_cost = 1.0):
+        """
+            Set the build parameters.
+
+            Parameters:
+                bin_count (int): number of SAH bins along the split axis
+                max_leaf_size (int): leaves never hold more spheres than this
+                min_leaf_size (int): nodes this small are never split
+                traversal_cost (float): relative cost of visiting a node
+                intersection_cost (float): relative cost of testing a sphere
+        """
+
+        self.bin_count = bin_count
+        self.max_leaf_size = max_leaf_size
+        self.min_leaf_size = min_leaf_size
+        self.traversal_cost = traversal_cost
+        self.intersection_cost = intersection_cost
+
+        self.node_count = 0
+
+    def build(self, centers, radii):
+        """
+            Build the tree from scratch.
+
+            Parameters:
+                centers (array [n,3])
+                radii (array [n])
+        """
+
+        centers = np.asarray(centers, dtype=np.float32)
+        radii = np.asarray(radii, dtype=np.float32)
+        sphere_count = len(radii)
+
+        #(min corner, max corner, center) per sphere, kept in sphere_ids order
+        self.sphere_data = np.hstack(
+            (centers - radii[:, None], centers + radii[:, None], centers)
+        ).astype(np.float32)
+        self.sphere_ids = np.arange(sphere_count, dtype=np.int32)
+
+        capacity = max(1, 2 * sphere_count - 1)
+        self.min_corner = np.zeros((capacity, 3), dtype=np.float32)
+        self.max_corner = np.zeros((capacity, 3), dtype=np.float32)
+        self.first_sphere_index = np.zeros(capacity, dtype=np.int32)
+        self.sphere_count = np.zeros(capacity, dtype=np.int32)
+        self.left_child = np.full(capacity, -1, dtype=np.int32)
+        self.right_child = np.full(capacity, -1, dtype=np.int32)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+
+        self.sphere_count[0] = sphere_count
+        self.node_count = 1
+
+        #split one whole level of the tree at a time
+        levels = []
+        frontier = np.zeros(1, dtype=np.int32)
+        while frontier.size > 0:
+            levels.append(frontier)
+            frontier = self.split_level(frontier)
+
+        del self.sphere_data
+        self.renumber(levels)
+        self.build_links()
+        self.find_levels()
+
+        self.built_cost = self.relative_cost()
+
+    def split_level(self, frontier):
+        """
+            Compute bounds for every node in the frontier, then split
+            those for which the surface area heuristic says it pays.
+            Returns the indices of the newly created children.
+        """
+
+        first = self.first_sphere_index[frontier]
+        count = self.sphere_count[frontier]
+        segment_starts, segment, positions = gather(first, count)
+        spheres = self.sphere_data[positions]
+
+        lower = np.minimum.reduceat(spheres, segment_starts)
+        upper = np.maximum.reduceat(spheres, segment_starts)
+        self.min_corner[frontier] = lower[:, 0:3]
+        self.max_corner[frontier] = upper[:, 3:6]
+
+        #small nodes stay leaves, without binning their spheres
+        open_nodes = count > max(1, self.min_leaf_size)
+        if not open_nodes.any():
+            return np.zeros(0, dtype=np.int32)
+
+        if not open_nodes.all():
+            frontier = frontier[open_nodes]
+            first = first[open_nodes]
+            count = count[open_nodes]
+            lower = lower[open_nodes]
+            upper = upper[open_nodes]
+            segment_starts, segment, positions = gather(first, count)
+            spheres = self.sphere_data[positions]
+
+        node_total = len(frontier)
+        node_min = lower[:, 0:3]
+        node_max = upper[:, 3:6]
+
+        #bin sphere centers along the longest axis of each node's centroid bounds
+        bin_count = self.bin_count
+        centroid_min = lower[:, 6:9]
+        extent = upper[:, 6:9] - centroid_min
+        best_axis = np.argmax(extent, axis = 1)
+        rows = np.arange(node_total)
+        axis_min = centroid_min[rows, best_axis]
+        axis_extent = extent[rows, best_axis]
+        scale = np.divide(bin_count, axis_extent, out = np.zeros_like(axis_extent), where = axis_extent > 0)
+        axis_center = spheres[np.arange(segment.size), 6 + best_axis[segment]]
+        bins = ((axis_center - axis_min[segment]) * scale[segment]).astype(np.int32)
+        np.clip(bins, 0, bin_count - 1, out = bins)
+
+        #bins are laid out (bin, node, component), so the
+        #sweeps below run over long contiguous rows
+        bin_total = bin_count * node_total
+        key = bins * node_total + segment
+        bin_sizes = np.bincount(key, minlength = bin_total)
+        bin_sizes = bin_sizes.reshape(bin_count, node_total).astype(np.float32)
+
+        slot = (3 * key[:, None] + np.arange(3)).ravel()
+        bin_min = np.full(3 * bin_total, np.inf, dtype=np.float32)
+        bin_max = np.full(3 * bin_total, -np.inf, dtype=np.float32)
+        np.minimum.at(bin_min, slot, spheres[:, 0:3].ravel())
+        np.maximum.at(bin_max, slot, spheres[:, 3:6].ravel())
+        bin_min = bin_min.reshape(bin_count, node_total, 3)
+        bin_max = bin_max.reshape(bin_count, node_total, 3)
+
+        #split i puts bins [0, i) on the left and [i, bin_count) on the right
+        left_min = np.minimum.accumulate(bin_min, axis = 0)[:-1]
+        left_max = np.maximum.accumulate(bin_max, axis = 0)[:-1]
+        right_min = np.minimum.accumulate(bin_min[::-1], axis = 0)[::-1][1:]
+        right_max = np.maximum.accumulate(bin_max[::-1], axis = 0)[::-1][1:]
+        left_count = np.cumsum(bin_sizes, axis = 0)[:-1]
+        right_count = count.astype(np.float32) - left_count
+
+        with np.errstate(invalid = "ignore"):
+            cost = surface_area(left_min, left_max) * left_count \
+                + surface_area(right_min, right_max) * right_count
+        cost[(left_count == 0) | (right_count == 0)] = np.inf
+
+        best_split = np.argmin(cost, axis = 0)
+        best_cost = cost[best_split, rows]
+        best_split += 1
+
+        node_area = np.maximum(surface_area(node_min, node_max), 1e-12)
+        split_cost = self.traversal_cost + self.intersection_cost * best_cost / node_area
+        leaf_cost = self.intersection_cost * count
+
+        has_split = np.isfinite(best_cost)
+        too_big = count > self.max_leaf_size
+        use_sah = has_split & ((split_cost < leaf_cost) | too_big)
+        #every center landed in the same bin, fall back to an even split
+        use_median = too_big & ~has_split
+        splitting = use_sah | use_median
+
+        if not splitting.any():
+            return np.zeros(0, dtype=np.int32)
+
+        rank = np.arange(segment.size) - segment_starts[segment]
+        goes_left = np.where(
+            use_sah[segment],
+            bins < best_split[segment],
+            rank < count[segment] // 2
+        )
+        goes_left |= ~splitting[segment]
+
+        #stable partition inside each node
+        order = np.argsort(2 * segment + (~goes_left), kind = "stable")
+        self.sphere_data[positions] = spheres[order]
+        self.sphere_ids[positions] = self.sphere_ids[positions[order]]
+
+        left_count = np.bincount(segment[goes_left], minlength = node_total)
+
+        parents = frontier[splitting]
+        split_count = len(parents)
+        left_children = self.node_count + 2 * np.arange(split_count, dtype=np.int32)
+        right_children = left_children + 1
+        self.node_count += 2 * split_count
+
+        self.parent[left_children] = parents
+        self.parent[right_children] = parents
+        self.left_child[parents] = left_children
+        self.right_child[parents] = right_children
+
+        self.first_sphere_index[left_children] = first[splitting]
+        self.sphere_count[left_children] = left_count[splitting]
+        self.first_sphere_index[right_children] = first[splitting] + left_count[splitting]
+        self.sphere_count[right_children] = count[splitting] - left_count[splitting]
+        self.sphere_count[parents] = 0
+
+        children = np.empty(2 * split_count, dtype=np.int32)
+        children[0::2] = left_children
+        children[1::2] = right_children
+        return children
+
+    def renumber(self, levels):
+        """
+            Levels are built breadth first, reorder the nodes depth first.
+        """
+
+        node_count = self.node_count
+        subtree_size = np.ones(node_count, dtype=np.int32)
+        for level in reversed(levels):
+            internal = level[self.left_child[level] >= 0]
+            subtree_size[internal] += subtree_size[self.left_child[internal]] \
+                                    + subtree_size[self.right_child[internal]]
+
+        new_index = np.zeros(node_count, dtype=np.int32)
+        for level in levels:
+            internal = level[self.left_child[level] >= 0]
+            left = self.left_child[internal]
+            new_index[left] = new_index[internal] + 1
+            new_index[self.right_child[internal]] = new_index[internal] + 1 + subtree_size[left]
+
+        def remap(links):
+            return np.where(links >= 0, new_index[np.maximum(links, 0)], -1).astype(np.int32)
+
+        order = np.empty(node_count, dtype=np.int32)
+        order[new_index] = np.arange(node_count, dtype=np.int32)
+
+        self.min_corner = self.min_corner[order]
+        self.max_corner = self.max_corner[order]
+        self.first_sphere_index = self.first_sphere_index[order]
+        self.sphere_count = self.sphere_count[order]
+        self.left_child = remap(self.left_child[order])
+        self.right_child = remap(self.right_child[order])
+        self.parent = remap(self.parent[order])
+        self.subtree_size = subtree_size[order]
+
+    def build_links(self):
+        """
+            In depth first order, the node after a subtree is exactly
+            where a ray goes when it misses that subtree.
+        """
+
+        self.index = np.arange(self.node_count, dtype=np.int32)
+
+        self.miss_link = self.index + self.subtree_size
+        self.miss_link[self.miss_link >= self.node_count] = -1
+
+        self.hit_link = np.where(self.sphere_count > 0, self.miss_link, self.left_child)
+
+    def find_levels(self):
+        """
+            Group node indices by depth, root first.
+        """
+
+        self.levels = []
+        level = np.zeros(1, dtype=np.int32)
+        while level.size > 0:
+            self.levels.append(level)
+            internal = level[self.left_child[level] >= 0]
+            level = np.concatenate((self.left_child[internal], self.right_child[internal]))
+
+    def refit(self, centers, radii):
+        """
+            Recompute every node's bounds for moved spheres,
+            keeping the current topology. Bounds are updated in place.
+
+            Parameters:
+                centers (array [n,3])
+                radii (array [n])
+        """
+
+        centers = np.asarray(centers, dtype=np.float32)[self.sphere_ids]
+        radii = np.asarray(radii, dtype=np.float32)[self.sphere_ids, None]
+
+        #leaves cover the sphere list in order, one contiguous run each
+        leaves = np.flatnonzero(self.sphere_count[:self.node_count] > 0)
+        starts = self.first_sphere_index[leaves]
+        self.min_corner[leaves] = np.minimum.reduceat(centers - radii, starts)
+        self.max_corner[leaves] = np.maximum.reduceat(centers + radii, starts)
+
+        for level in reversed(self.levels):
+            internal = level[self.left_child[level] >= 0]
+            left = self.left_child[internal]
+            right = self.right_child[internal]
+            self.min_corner[internal] = np.minimum(self.min_corner[left], self.min_corner[right])
+            self.max_corner[internal] = np.maximum(self.max_corner[left], self.max_corner[right])
+
+    def relative_cost(self):
+        """
+            SAH cost of each node's subtree, divided by the node's own area.
+            For a well built subtree this stays put when its spheres move
+            together and grows as they drift apart.
+        """
+
+        area = surface_area(self.min_corner[:self.node_count], self.max_corner[:self.node_count])
+        count = self.sphere_count[:self.node_count]
+        cost = np.where(count > 0, self.intersection_cost * count, self.traversal_cost) * area
+
+        for level in reversed(self.levels):
+            internal = level[self.left_child[level] >= 0]
+            cost[internal] += cost[self.left_child[internal]] + cost[self.right_child[internal]]
+
+        return cost / np.maximum(area, 1e-12)
+
+    def update(self, centers, radii, threshold = 1.5):
+        """
+            Refit the tree, then rebuild the subtrees whose SAH cost
+            has grown by more than the given factor since they were built.
+            Returns the number of subtrees rebuilt.
+
+            Parameters:
+                centers (array [n,3])
+                radii (array [n])
+                threshold (float): allowed cost growth before a rebuild
+        """
+
+        self.refit(centers, radii)
+
+        growth = self.relative_cost() / self.built_cost
+        degraded = growth > threshold
+
+        #only rebuild the topmost degraded node of each branch
+        covered = np.zeros(self.node_count, dtype=bool)
+        for level in self.levels:
+            internal = level[self.left_child[level] >= 0]
+            blocked = covered[internal] | degraded[internal]
+            covered[self.left_child[internal]] = blocked
+            covered[self.right_child[internal]] = blocked
+        roots = np.flatnonzero(degraded & ~covered)
+
+        #work from the back so earlier subtrees keep their indices
+        for root in roots[::-1]:
+            self.rebuild_subtree(int(root), centers, radii)
+
+        if roots.size > 0:
+            self.build_links()
+            self.find_levels()
+
+        return roots.size
+
+    def rebuild_subtree(self, root, centers, radii):
+        """
+            Build a fresh tree over the spheres below root
+            and splice it into the node arrays in place of the old subtree.
+        """
+
+        size = self.subtree_size[root]
+        last = root + size - 1
+        begin = self.first_sphere_index[root]
+        end = self.first_sphere_index[last] + self.sphere_count[last]
+
+        ids = self.sphere_ids[begin:end]
+        subtree = BVH(self.bin_count, self.max_leaf_size, self.min_leaf_size,
+                      self.traversal_cost, self.intersection_cost)
+        subtree.build(np.asarray(centers)[ids], np.asarray(radii)[ids])
+        self.sphere_ids[begin:end] = ids[subtree.sphere_ids]
+
+        delta = subtree.node_count - size
+        node_count = self.node_count
+
+        def shift(links):
+            return np.where(links > last, links + delta, links)
+
+        def offset(links):
+            return np.where(links >= 0, links + root, links)
+
+        parent = offset(subtree.parent)
+        parent[0] = self.parent[root]
+
+        #ancestors of root grow or shrink with it
+        index = np.arange(node_count)
+        ancestors = (index < root) & (index + self.subtree_size[:node_count] > root)
+        self.subtree_size[ancestors] += delta
+
+        def splice(old, new):
+            return np.concatenate((old[:root], new, old[last + 1:node_count]))
+
+        self.min_corner = splice(self.min_corner, subtree.min_corner)
+        self.max_corner = splice(self.max_corner, subtree.max_corner)
+        self.first_sphere_index = splice(self.first_sphere_index, subtree.first_sphere_index + begin)
+        self.sphere_count = splice(self.sphere_count, subtree.sphere_count)
+        self.left_child = splice(shift(self.left_child), offset(subtree.left_child))
+        self.right_child = splice(shift(self.right_child), offset(subtree.right_child))
+        self.parent = splice(shift(self.parent), parent)
+        self.subtree_size = splice(self.subtree_size, subtree.subtree_size)
+        self.built_cost = splice(self.built_cost, subtree.built_cost)
+        self.node_count += delta
+
+def gather(first, count):
+    """
+        Where the spheres of a list of nodes are, grouped node by node:
+        the start of each node's group, the node of each sphere and
+        the sphere's position in the sphere list.
+    """
+
+    segment_starts = np.cumsum(count) - count
+    segment = np.repeat(np.arange(len(count)), count)
+    positions = np.arange(segment.size) - segment_starts[segment] + first[segment]
+    return segment_starts, segment, positions
+
+def surface_area(min_corner, max_corner):
+    """
+        Surface area of boxes given by their corners (array [...,3]).
+    """
+
+    extent = max_corner - min_corner
+    return 2.0 * (extent[..., 0] * extent[..., 1]
+                + extent[..., 1] * extent[..., 2]
+                + extent[..., 2] * extent[..., 0])
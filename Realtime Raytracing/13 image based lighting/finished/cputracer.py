@@ -0,0 +1,307 @@
+from config import *
+import packing
+
+#A NumPy port of shaders/rayTracer.txt, for checking scenes and BVHs
+#without a GL 4.3 context. It reads the same packed records the engine
+#uploads, and traces whole batches of rays at once.
+
+PHI = np.float32(1.61803398874989484820459)
+
+def pack_scene(scene):
+    """
+        Pack a scene into fresh SPHERE, NODE and SPHERE_LOOKUP arrays,
+        exactly as Engine.updateScene does for its object stores.
+    """
+
+    sphere_count = len(scene.spheres)
+
+    spheres = np.zeros(sphere_count, dtype = packing.SPHERE)
+    packing.pack_spheres(
+        spheres, scene.sphere_centers, scene.sphere_radii,
+        scene.sphere_colors, scene.sphere_roughness
+    )
+
+    nodes = np.zeros(scene.nodes_used, dtype = packing.NODE)
+    packing.pack_nodes(nodes, scene.bvh)
+
+    sphere_lookup = np.zeros(sphere_count, dtype = packing.SPHERE_LOOKUP)
+    packing.pack_sphere_lookup(sphere_lookup, scene.sphere_ids)
+
+    return spheres, nodes, sphere_lookup
+
+def gradient_sky(directions):
+    """
+        Stand-in for the sky cube map: blends from a pale horizon
+        to a blue zenith.
+    """
+
+    height = directions[:,2] / np.linalg.norm(directions, axis = 1)
+    blend = (0.5 * (height + 1.0))[:,np.newaxis]
+    horizon = np.array((0.9, 0.9, 0.85), dtype = np.float32)
+    zenith = np.array((0.3, 0.5, 0.9), dtype = np.float32)
+    return ((1.0 - blend) * horizon + blend * zenith).astype(np.float32)
+
+def gold_noise(xy, seed):
+
+    distance = np.linalg.norm(xy * PHI - xy, axis = 1)
+    value = np.tan(distance * np.float32(seed)) * xy[:,0]
+    return value - np.floor(value)
+
+def random_vec(xy, seed):
+
+    radius = 0.99 * gold_noise(xy, seed)
+    theta = 2.0 * np.pi * gold_noise(xy, seed + 1.0)
+    phi = np.pi * gold_noise(xy, seed + 2.0)
+
+    return np.stack(
+        (
+            radius * np.cos(theta) * np.cos(phi),
+            radius * np.sin(theta) * np.cos(phi),
+            radius * np.sin(phi)
+        ), axis = 1
+    ).astype(np.float32)
+
+def normalize(vectors):
+
+    return vectors / np.linalg.norm(vectors, axis = 1, keepdims = True)
+
+def save_image(image, filepath):
+    """
+        Save a float image: .npy files keep the raw values,
+        anything else is clamped to 8 bits and written by PIL.
+    """
+
+    if filepath.endswith(".npy"):
+        np.save(filepath, image)
+        return
+
+    pixels = (255 * np.clip(image, 0.0, 1.0)).astype(np.uint8)
+    Image.fromarray(pixels, mode = "RGB").save(filepath)
+
+class CPURayTracer:
+    """
+        Renders packed scene records on the CPU.
+    """
+
+    def __init__(self, width, height, bounces = 4, batch_size = 65536, sky = gradient_sky):
+        """
+            Parameters:
+                width, height (int): size of the output image
+                bounces (int): most traces per pixel, as in the shader
+                batch_size (int): rays traced together
+                sky (function): maps (n,3) directions to (n,3) colors
+        """
+
+        self.width = width
+        self.height = height
+        self.bounces = bounces
+        self.batch_size = batch_size
+        self.sky = sky
+
+        self.ray_count = 0
+        self.render_time = 0.0
+
+    def load(self, spheres, nodes, sphere_lookup):
+        """
+            Unpack the records into plain arrays for tracing.
+        """
+
+        self.sphere_centers = spheres["center"]
+        self.sphere_radii = spheres["radius"]
+        self.sphere_colors = spheres["color"]
+        self.sphere_roughness = spheres["roughness"]
+
+        self.node_count = len(nodes)
+        self.min_corner = nodes["min_corner"]
+        self.max_corner = nodes["max_corner"]
+        self.hit_link = nodes["hit_link"].astype(np.int64)
+        self.miss_link = nodes["miss_link"].astype(np.int64)
+        self.first_sphere_index = nodes["first_sphere_index"].astype(np.int64)
+        self.sphere_count = nodes["sphere_count"].astype(np.int64)
+
+        self.sphere_lookup = sphere_lookup["index"].astype(np.int64)
+
+    def primary_rays(self, camera, tile = None):
+        """
+            One ray per pixel of the tile (x, y, width, height), or of
+            the whole screen, laid out row by row from the bottom of
+            the screen, like gl_GlobalInvocationID.
+        """
+
+        x, y, width, height = tile or (0, 0, self.width, self.height)
+        x,y = np.meshgrid(
+            np.arange(x, x + width, dtype = np.float32),
+            np.arange(y, y + height, dtype = np.float32)
+        )
+        pixels = np.stack((x.ravel(), y.ravel()), axis = 1)
+
+        horizontal = (pixels[:,0:1] * 2 - self.width) / self.width
+        vertical = (pixels[:,1:2] * 2 - self.height) / self.width
+
+        directions = camera.forwards + horizontal * camera.right + vertical * camera.up
+        origins = np.broadcast_to(camera.position, directions.shape)
+
+        return np.array(origins, dtype = np.float32), directions.astype(np.float32), pixels
+
+    def render_tile(self, camera, tile = None):
+        """
+            Render one tile (x, y, width, height) of the loaded scene,
+            or the whole screen. Returns a (height, width, 3) array,
+            bottom row first.
+        """
+
+        origins, directions, pixels = self.primary_rays(camera, tile)
+        colors = np.empty((len(pixels), 3), dtype = np.float32)
+
+        for first in range(0, len(pixels), self.batch_size):
+            last = first + self.batch_size
+            colors[first:last] = self.shade(
+                origins[first:last], directions[first:last], pixels[first:last]
+            )
+
+        x, y, width, height = tile or (0, 0, self.width, self.height)
+        return colors.reshape(height, width, 3)
+
+    def render(self, spheres, nodes, sphere_lookup, camera):
+        """
+            Render the packed scene from the camera's point of view.
+            Returns a (height, width, 3) float32 image, top row first.
+        """
+
+        start = time.perf_counter()
+        self.ray_count = 0
+        self.load(spheres, nodes, sphere_lookup)
+
+        image = self.render_tile(camera)
+
+        self.render_time = time.perf_counter() - start
+
+        return np.ascontiguousarray(image[::-1])
+
+    def rays_per_second(self):
+
+        if self.render_time == 0:
+            return 0.0
+        return self.ray_count / self.render_time
+
+    def shade(self, origins, directions, pixels):
+        """
+            Follow a batch of rays through their bounces (main() in the shader).
+        """
+
+        pixel = np.ones((len(origins), 3), dtype = np.float32)
+        last_hit = np.zeros(len(origins), dtype = bool)
+        alive = np.arange(len(origins))
+
+        for bounce in range(self.bounces):
+
+            if len(alive) == 0:
+                break
+
+            hit, position, normal, color, roughness = self.trace(origins, directions)
+            self.ray_count += len(alive)
+
+            pixel[alive] *= color
+            last_hit[alive] = hit
+
+            #set up rays for the next trace
+            alive = alive[hit]
+            origins = position[hit]
+            directions = directions[hit]
+            normal = normal[hit]
+            directions = directions - 2.0 * np.sum(normal * directions, axis = 1, keepdims = True) * normal
+            variation = random_vec(pixels[alive], float(bounce))
+            directions = normalize(directions + roughness[hit,np.newaxis] * variation).astype(np.float32)
+
+        pixel[last_hit] = 0.0
+        return pixel
+
+    def trace(self, origins, directions):
+        """
+            Find the nearest sphere along each ray with a stackless walk
+            over the BVH. Every ray steps to its node's hit or miss link
+            until it runs off the end of the node array.
+        """
+
+        ray_count = len(origins)
+        nearest = np.full(ray_count, 999999999, dtype = np.float32)
+        nearest_sphere = np.full(ray_count, -1, dtype = np.int64)
+
+        active = np.arange(ray_count) if self.node_count > 0 else np.arange(0)
+        node = np.zeros(len(active), dtype = np.int64)
+
+        while len(active) > 0:
+
+            origin = origins[active]
+            direction = directions[active]
+
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                t_min = (self.min_corner[node] - origin) / direction
+                t_max = (self.max_corner[node] - origin) / direction
+            t_near = np.minimum(t_min, t_max).max(axis = 1)
+            t_far = np.maximum(t_min, t_max).min(axis = 1)
+            hit_node = (t_near <= t_far) & (t_far > 0) & (t_near < nearest[active])
+
+            leaf = hit_node & (self.sphere_count[node] > 0)
+            if np.any(leaf):
+                self.hit_leaves(
+                    active[leaf], self.first_sphere_index[node[leaf]],
+                    self.sphere_count[node[leaf]],
+                    origins, directions, nearest, nearest_sphere
+                )
+
+            node = np.where(hit_node, self.hit_link[node], self.miss_link[node])
+            keep = (node >= 0) & (node < self.node_count)
+            active = active[keep]
+            node = node[keep]
+
+        hit = nearest_sphere >= 0
+        index = nearest_sphere[hit]
+
+        position = origins + nearest[:,np.newaxis] * directions
+        normal = np.zeros_like(origins)
+        normal[hit] = normalize(position[hit] - self.sphere_centers[index])
+        color = self.sky(directions)
+        color[hit] = self.sphere_colors[index]
+        roughness = np.zeros(ray_count, dtype = np.float32)
+        roughness[hit] = self.sphere_roughness[index]
+
+        return hit, position, normal, color, roughness
+
+    def hit_leaves(self, rays, first, count, origins, directions, nearest, nearest_sphere):
+        """
+            Test each ray against the spheres of the leaf it reached,
+            one slot of the leaves at a time.
+        """
+
+        for slot in range(count.max()):
+
+            in_leaf = slot < count
+            ray = rays[in_leaf]
+            sphere = self.sphere_lookup[first[in_leaf] + slot]
+
+            direction = directions[ray]
+            co = origins[ray] - self.sphere_centers[sphere]
+            a = np.sum(direction * direction, axis = 1)
+            b = 2 * np.sum(direction * co, axis = 1)
+            c = np.sum(co * co, axis = 1) - self.sphere_radii[sphere] ** 2
+            discriminant = b * b - 4 * a * c
+
+            with np.errstate(invalid = "ignore"):
+                t = (-b - np.sqrt(discriminant)) / (2 * a)
+            closer = (discriminant > 0.0) & (t > 0.001) & (t < nearest[ray])
+
+            nearest[ray[closer]] = t[closer]
+            nearest_sphere[ray[closer]] = sphere[closer]
+
+if __name__ == "__main__":
+
+    import scene
+
+    _scene = scene.Scene()
+    spheres, nodes, sphere_lookup = pack_scene(_scene)
+
+    tracer = CPURayTracer(400, 300)
+    image = tracer.render(spheres, nodes, sphere_lookup, _scene.camera)
+    save_image(image, "cpu_frame.npy")
+    print(f"{tracer.ray_count} rays in {tracer.render_time:.2f}s, {tracer.rays_per_second():.0f} rays/s")
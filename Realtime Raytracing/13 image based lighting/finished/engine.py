@@ -1,33 +1,38 @@
 from config import *
+import re
 import scene
-import sphere
-import node
 import materials
+import packing
+import objectstore
+import profiler
+import resolution
 
 class Engine:
     """
         Responsible for drawing scenes
     """
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, tileSize = (8, 8)):
         """
             Initialize a flat raytracing context
             
                 Parameters:
                     width (int): width of screen
                     height (int): height of screen
+                    tileSize (tuple): pixels per work group, (x, y)
         """
         self.screenWidth = width
         self.screenHeight = height
+        self.tileSize = tileSize
 
         self.targetFrameRate = 60
-        self.frameRateMargin = 10
+        self.dynamicResolution = True
 
         #general OpenGL configuration
         self.shader = self.createShader("shaders/frameBufferVertex.txt",
                                         "shaders/frameBufferFragment.txt")
         
-        self.rayTracerShader = self.createComputeShader("shaders/rayTracer.txt")
+        self.rayTracerShader = self.createComputeShader("shaders/rayTracer.txt", tileSize)
         
         glUseProgram(self.shader)
         
@@ -35,6 +40,7 @@ class Engine:
         self.createLODChain()
         self.createColorBuffers()
         self.createResourceMemory()
+        self.profiler = profiler.Profiler()
         self.skyBoxMaterial = materials.CubeMapMaterial("gfx/sky")
         glUseProgram(self.rayTracerShader)
         glUniform1i(glGetUniformLocation(self.rayTracerShader, "sky_cube"), 4)
@@ -75,79 +81,66 @@ class Engine:
             self.resolutions.append((width, height))
         
         self.resolutionLevel = len(self.resolutions) - 1
+        #first profiler frame rendered at the current rung
+        self.resolutionFrame = 0
+        self.resolutionController = resolution.ResolutionController(
+            len(self.resolutions), scale = 1.25,
+            frame_budget = 1000 / self.targetFrameRate
+        )
         
         self.screenWidth,self.screenHeight = self.resolutions[self.resolutionLevel]
 
     def createColorBuffers(self):
 
-        self.colorBuffers = []
-
-        for resolution in self.resolutions:
-
-            width,height = resolution
-
-            newColorBuffer = glGenTextures(1)
-            self.colorBuffers.append(newColorBuffer)
-            glActiveTexture(GL_TEXTURE0)
-            glBindTexture(GL_TEXTURE_2D, newColorBuffer)
-
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-
-        
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, width, height, 0, GL_RGBA, GL_FLOAT, None)
-        
-        self.colorBuffer = self.colorBuffers[self.resolutionLevel]
-    
-    def createResourceMemory(self):
+        #rungs get a color buffer the first time they're used
+        self.colorBuffers = {}
+        self.colorBuffer = self.getColorBuffer(self.resolutionLevel)
 
+    def getColorBuffer(self, level):
         """
-            allocate storage for up to 1024 objects (why not?)
+            Color buffer for the given rung of the resolution ladder.
         """
 
-        # sphere: (cx cy cz r) (r g b roughness)
-        self.objectData = np.zeros(8 * 1024, dtype = np.float32)
+        if level in self.colorBuffers:
+            return self.colorBuffers[level]
 
-        self.objectDataTexture = glGenTextures(1)
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.objectDataTexture)
+        width,height = self.resolutions[level]
+
+        newColorBuffer = glGenTextures(1)
+        self.colorBuffers[level] = newColorBuffer
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, newColorBuffer)
 
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F, 2, 1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
 
-        # node: (x_min, y_min, z_min, x_max) (y_max, z_max, index hit_link) (miss_link, offset, count, _)
-        self.nodeData = np.zeros(12 * 1024, dtype = np.float32)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, width, height, 0, GL_RGBA, GL_FLOAT, None)
 
-        self.nodeTexture = glGenTextures(1)
-        glActiveTexture(GL_TEXTURE2)
-        glBindTexture(GL_TEXTURE_2D, self.nodeTexture)
-
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        return newColorBuffer
     
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,3,1024,0,GL_RGBA,GL_FLOAT,bytes(self.nodeData))
+    def createResourceMemory(self):
 
-        # sphere_lookup: (index _ _ _)
-        self.sphereLookupData = np.zeros(4 * 1024, dtype = np.float32)
+        """
+            allocate storage for the scene records, starting at 1024 of
+            each and growing as the scene needs more.
+        """
 
-        self.sphereLookupTexture = glGenTextures(1)
-        glActiveTexture(GL_TEXTURE3)
-        glBindTexture(GL_TEXTURE_2D, self.sphereLookupTexture)
+        self.objectStore = objectstore.ObjectStore(packing.SPHERE, binding = 1)
+        self.nodeStore = objectstore.ObjectStore(packing.NODE, binding = 2)
+        self.sphereLookupStore = objectstore.ObjectStore(packing.SPHERE_LOOKUP, binding = 3)
 
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-    
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,1,1024,0,GL_RGBA,GL_FLOAT,bytes(self.sphereLookupData))
+    def getStorageStats(self):
+        """
+            Capacity and occupancy of each scene record store.
+        """
+
+        return {
+            "spheres": self.objectStore.stats(),
+            "nodes": self.nodeStore.stats(),
+            "sphere_lookup": self.sphereLookupStore.stats()
+        }
 
     def createShader(self, vertexFilepath, fragmentFilepath):
         """
@@ -166,93 +159,64 @@ class Engine:
         
         return shader
     
-    def createComputeShader(self, filepath):
+    def createComputeShader(self, filepath, localSize = (1, 1)):
         """
             Read source code, compile and link shaders.
+            The work group size in the source is replaced by localSize.
             Returns the compiled and linked program.
         """
 
         with open(filepath,'r') as f:
-            compute_src = f.readlines()
+            compute_src = f.read()
+
+        compute_src = re.sub(
+            r"layout\(local_size_x = \d+, local_size_y = \d+\) in;",
+            f"layout(local_size_x = {localSize[0]}, local_size_y = {localSize[1]}) in;",
+            compute_src
+        )
         
         shader = compileProgram(compileShader(compute_src, GL_COMPUTE_SHADER))
         
         return shader
 
-    def recordSphere(self, i, _sphere: sphere.Sphere):
-
-        # sphere: (cx cy cz r) (r g b roughness)
-
-        self.objectData[8*i]     = _sphere.center[0]
-        self.objectData[8*i + 1] = _sphere.center[1]
-        self.objectData[8*i + 2] = _sphere.center[2]
-
-        self.objectData[8*i + 3] = _sphere.radius
-
-        self.objectData[8*i + 4] = _sphere.color[0]
-        self.objectData[8*i + 5] = _sphere.color[1]
-        self.objectData[8*i + 6] = _sphere.color[2]
-
-        self.objectData[8*i + 7] = _sphere.roughness
-    
-    def recordNode(self, i, _node: node.Node):
-
-        # node: (x_min, y_min, z_min, x_max) (y_max, z_max, index hit_link) (miss_link, offset, count, _)
-
-        self.nodeData[12*i]      = _node.min_corner[0]
-        self.nodeData[12*i + 1]  = _node.min_corner[1]
-        self.nodeData[12*i + 2]  = _node.min_corner[2]
-
-        self.nodeData[12*i + 3]  = _node.max_corner[0]
-        self.nodeData[12*i + 4]  = _node.max_corner[1]
-        self.nodeData[12*i + 5]  = _node.max_corner[2]
-
-        self.nodeData[12*i + 6]  = _node.index
-
-        self.nodeData[12*i + 7]  = _node.hit_link
-        self.nodeData[12*i + 8]  = _node.miss_link
-
-        self.nodeData[12*i + 9]  = _node.first_sphere_index
-        self.nodeData[12*i + 10] = _node.sphere_count
-    
-    def recordSphereIndex(self, i, index):
+    def getWorkGroupCount(self):
+        """
+            Work groups needed to cover the screen with tiles, the shader
+            skips the pixels of edge tiles which fall off the screen.
+        """
 
-        # index: (index, _, _, _)
+        tileWidth,tileHeight = self.tileSize
+        return (
+            (self.screenWidth + tileWidth - 1) // tileWidth,
+            (self.screenHeight + tileHeight - 1) // tileHeight
+        )
 
-        self.sphereLookupData[4*i] = index
-    
     def updateScene(self, scene: scene.Scene):
 
         scene.outDated = False
 
         glUseProgram(self.rayTracerShader)
 
-        glUniform1f(glGetUniformLocation(self.rayTracerShader, "sphereCount"), len(scene.spheres))
-
-        for i,_sphere in enumerate(scene.spheres):
-            self.recordSphere(i, _sphere)
-        
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.objectDataTexture)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,2,1024,0,GL_RGBA,GL_FLOAT,bytes(self.objectData))
+        sphereCount = len(scene.spheres)
+        glUniform1f(glGetUniformLocation(self.rayTracerShader, "sphereCount"), sphereCount)
+        self.objectStore.reserve(sphereCount)
+        packing.pack_spheres(
+            self.objectStore.data, scene.sphere_centers, scene.sphere_radii,
+            scene.sphere_colors, scene.sphere_roughness
+        )
+        self.objectStore.count = sphereCount
+        self.objectStore.upload(0, sphereCount)
 
         glUniform1f(glGetUniformLocation(self.rayTracerShader, "nodeCount"), scene.nodes_used)
+        self.nodeStore.reserve(scene.nodes_used)
+        packing.pack_nodes(self.nodeStore.data, scene.bvh)
+        self.nodeStore.count = scene.nodes_used
+        self.nodeStore.upload(0, scene.nodes_used)
 
-        for i in range(scene.nodes_used):
-            _node = scene.nodes[i]
-            if _node.min_corner is not None:
-                self.recordNode(i, _node)
-
-        glActiveTexture(GL_TEXTURE2)
-        glBindTexture(GL_TEXTURE_2D, self.nodeTexture)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,3,1024,0,GL_RGBA,GL_FLOAT,bytes(self.nodeData))
-
-        for i,_index in enumerate(scene.sphere_ids):
-            self.recordSphereIndex(i, _index)
-
-        glActiveTexture(GL_TEXTURE3)
-        glBindTexture(GL_TEXTURE_2D, self.sphereLookupTexture)
-        glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA32F,1,1024,0,GL_RGBA,GL_FLOAT,bytes(self.sphereLookupData))
+        self.sphereLookupStore.reserve(sphereCount)
+        packing.pack_sphere_lookup(self.sphereLookupStore.data, scene.sphere_ids)
+        self.sphereLookupStore.count = sphereCount
+        self.sphereLookupStore.upload(0, sphereCount)
 
     def prepareScene(self, scene: scene.Scene):
         """
@@ -267,16 +231,12 @@ class Engine:
         glUniform3fv(glGetUniformLocation(self.rayTracerShader, "viewer.up"), 1, scene.camera.up)
 
         if scene.outDated:
-            self.updateScene(scene)
+            with self.profiler.measure("updateScene"):
+                self.updateScene(scene)
         
-        glActiveTexture(GL_TEXTURE1)
-        glBindImageTexture(1, self.objectDataTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
-
-        glActiveTexture(GL_TEXTURE2)
-        glBindImageTexture(2, self.nodeTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
-
-        glActiveTexture(GL_TEXTURE3)
-        glBindImageTexture(3, self.sphereLookupTexture, 0, GL_FALSE, 0, GL_READ_ONLY, GL_RGBA32F)
+        self.objectStore.bind()
+        self.nodeStore.bind()
+        self.sphereLookupStore.bind()
 
         self.skyBoxMaterial.use()
         
@@ -284,22 +244,24 @@ class Engine:
         """
             Draw all objects in the scene
         """
-        #start = time.time()
         glUseProgram(self.rayTracerShader)
 
         self.prepareScene(scene)
 
-        glActiveTexture(GL_TEXTURE0)
-        glBindImageTexture(0, self.colorBuffer, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
-        
-        glDispatchCompute(self.screenWidth, self.screenHeight, 1)
-  
-        # make sure writing to image has finished before read
-        glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
-        glBindImageTexture(0, 0, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
-        self.drawScreen()
-        #finish = time.time()
-        #print(f"render took {(finish - start) * 1000} milliseconds.")
+        with self.profiler.measure("raytrace_pass"):
+            glActiveTexture(GL_TEXTURE0)
+            glBindImageTexture(0, self.colorBuffer, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+
+            glDispatchCompute(*self.getWorkGroupCount(), 1)
+
+            # make sure writing to image has finished before read
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+            glBindImageTexture(0, 0, 0, GL_FALSE, 0, GL_WRITE_ONLY, GL_RGBA32F)
+        with self.profiler.measure("drawScreen"):
+            self.drawScreen()
+        #flipped outside the timer, so waiting on vsync doesn't count as present time
+        pg.display.flip()
+        self.adaptResolution(self.profiler.end_frame())
 
     def drawScreen(self):
         glUseProgram(self.shader)
@@ -308,19 +270,33 @@ class Engine:
         glBindTexture(GL_TEXTURE_2D, self.colorBuffer)
         glBindVertexArray(self.vao)
         glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
-        pg.display.flip()
     
-    def adaptResolution(self, frameRate):
-
-        if frameRate > self.targetFrameRate + self.frameRateMargin and self.resolutionLevel > 0:
-            #increase resolution
-            self.resolutionLevel -= 1
-        elif frameRate < self.targetFrameRate - self.frameRateMargin and self.resolutionLevel < len(self.resolutions) - 1:
-            #reduce resolution
-            self.resolutionLevel += 1
-        
+    def adaptResolution(self, timings):
+        """
+            Pick the next frame's resolution from the latest pass timings.
+        """
+
+        if not self.dynamicResolution:
+            return
+
+        #timer results come in a frame or two late, and the ones made
+        #before the last switch measured a different rung
+        timings = {
+            name: milliseconds for name,milliseconds in timings.items()
+            if self.profiler.sample_frames[name] >= self.resolutionFrame
+        }
+
+        self.setResolutionLevel(self.resolutionController.update(
+            timings.get("raytrace_pass"), timings.get("drawScreen")
+        ))
+
+    def setResolutionLevel(self, level):
+
+        if level != self.resolutionLevel:
+            self.resolutionFrame = self.profiler.frame_number
+        self.resolutionLevel = level
         self.screenWidth,self.screenHeight = self.resolutions[self.resolutionLevel]
-        self.colorBuffer = self.colorBuffers[self.resolutionLevel]
+        self.colorBuffer = self.getColorBuffer(self.resolutionLevel)
     
     def destroy(self):
         """
@@ -331,5 +307,9 @@ class Engine:
         glDeleteProgram(self.rayTracerShader)
         glDeleteVertexArrays(1, (self.vao,))
         glDeleteBuffers(1, (self.vbo,))
-        glDeleteTextures(1, (self.colorBuffer,))
+        glDeleteTextures(len(self.colorBuffers), list(self.colorBuffers.values()))
+        self.objectStore.destroy()
+        self.nodeStore.destroy()
+        self.sphereLookupStore.destroy()
+        self.profiler.destroy()
         glDeleteProgram(self.shader)
\ No newline at end of file
@@ -0,0 +1,62 @@
+from config import *
+
+#Record layouts of the scene storage buffers. Every record is a whole
+#number of vec4s, so the shader can read record i as vec4s
+#[i * n, (i + 1) * n) of a flat array.
+
+# sphere: (cx cy cz r) (r g b roughness)
+SPHERE = np.dtype([
+    ("center", np.float32, 3), ("radius", np.float32),
+    ("color", np.float32, 3), ("roughness", np.float32)
+])
+
+# node: (x_min, y_min, z_min, x_max) (y_max, z_max, index hit_link) (miss_link, offset, count, _)
+NODE = np.dtype([
+    ("min_corner", np.float32, 3), ("max_corner", np.float32, 3),
+    ("index", np.float32), ("hit_link", np.float32), ("miss_link", np.float32),
+    ("first_sphere_index", np.float32), ("sphere_count", np.float32), ("padding", np.float32)
+])
+
+# sphere_lookup: (index _ _ _)
+SPHERE_LOOKUP = np.dtype([
+    ("index", np.float32), ("padding", np.float32, 3)
+])
+
+def vec4s_per_record(layout):
+    """
+        Number of vec4s the shader reads per record of the given layout.
+    """
+
+    return layout.itemsize // 16
+
+def pack_spheres(target, centers, radii, colors, roughness):
+    """
+        Fill the first len(radii) records of target (SPHERE array).
+    """
+
+    count = len(radii)
+    target["center"][:count] = centers
+    target["radius"][:count] = radii
+    target["color"][:count] = colors
+    target["roughness"][:count] = roughness
+
+def pack_nodes(target, bvh):
+    """
+        Fill the first bvh.node_count records of target (NODE array).
+    """
+
+    count = bvh.node_count
+    target["min_corner"][:count] = bvh.min_corner[:count]
+    target["max_corner"][:count] = bvh.max_corner[:count]
+    target["index"][:count] = bvh.index
+    target["hit_link"][:count] = bvh.hit_link
+    target["miss_link"][:count] = bvh.miss_link
+    target["first_sphere_index"][:count] = bvh.first_sphere_index[:count]
+    target["sphere_count"][:count] = bvh.sphere_count[:count]
+
+def pack_sphere_lookup(target, sphere_ids):
+    """
+        Fill the first len(sphere_ids) records of target (SPHERE_LOOKUP array).
+    """
+
+    target["index"][:len(sphere_ids)] = sphere_ids
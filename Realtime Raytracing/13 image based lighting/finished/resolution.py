@@ -0,0 +1,139 @@
+from config import *
+
+class ResolutionController:
+    """
+        Chooses a rung of the resolution ladder from measured frame times.
+
+        Raytracing cost is proportional to pixel count, and each rung
+        holds 1 / scale^2 as many pixels as the one above it, so the
+        controller works in rungs: log(time / budget) / log(scale^2) is
+        how many rungs the resolution is off by. A PI controller on that
+        error, fed with smoothed timings, gives a continuous level, which
+        is only acted on once it leaves a hysteresis band around the
+        current rung.
+    """
+
+    def __init__(self, level_count, scale = 1.25, frame_budget = 1000 / 60,
+                 raytrace_budget = None, present_budget = None,
+                 proportional_gain = 0.3, integral_gain = 0.05,
+                 smoothing = 0.2, deadband = 0.25, hysteresis = 0.35, dwell = 10,
+                 warmup = 3, outlier = 4.0):
+        """
+            Parameters:
+                level_count (int): rungs on the ladder, 0 is full resolution
+                scale (float): size ratio between neighbouring rungs
+                frame_budget (float): milliseconds for raytrace + present
+                raytrace_budget (float): separate budget for the dispatch,
+                    otherwise it gets whatever present leaves of the frame
+                present_budget (float): separate budget for the blit,
+                    overruns are taken out of the raytrace budget
+                proportional_gain, integral_gain (float): PI gains, in rungs
+                smoothing (float): weight of each new sample in the averages
+                deadband (float): errors, in rungs, too small to integrate
+                hysteresis (float): rungs past the half way point needed to switch
+                dwell (int): frames to hold a rung before switching again
+                warmup (int): first samples to ignore, while the driver
+                    is still compiling and uploading
+                outlier (float): samples are clamped to this many frame
+                    budgets before they enter the averages
+        """
+
+        self.level_count = level_count
+        self.rung_cost = np.log(scale * scale)
+        self.frame_budget = frame_budget
+        self.raytrace_budget = raytrace_budget
+        self.present_budget = present_budget
+        self.proportional_gain = proportional_gain
+        self.integral_gain = integral_gain
+        self.smoothing = smoothing
+        self.deadband = deadband
+        self.hysteresis = hysteresis
+        self.dwell = dwell
+        self.warmup = warmup
+        self.outlier = outlier
+
+        self.level = level_count - 1
+        self.integral = float(self.level)
+        self.raytrace_time = None
+        self.present_time = 0.0
+        self.frames_at_level = 0
+        self.samples_seen = 0
+
+    def smooth(self, average, sample):
+
+        #one stall (a shader compile, a swap) shouldn't outweigh
+        #many ordinary frames
+        sample = min(sample, self.outlier * self.frame_budget)
+        if average is None:
+            return sample
+        return average + self.smoothing * (sample - average)
+
+    def get_raytrace_budget(self):
+        """
+            Milliseconds the dispatch may take this frame.
+        """
+
+        if self.present_budget is not None:
+            overrun = max(0.0, self.present_time - self.present_budget)
+            budget = self.raytrace_budget
+            if budget is None:
+                budget = self.frame_budget - self.present_budget
+            return budget - overrun
+
+        if self.raytrace_budget is not None:
+            return self.raytrace_budget
+
+        return self.frame_budget - self.present_time
+
+    def update(self, raytrace_time, present_time = None):
+        """
+            Feed one frame's timings (milliseconds, None if not measured
+            this frame) and get back the rung to render the next one at.
+        """
+
+        self.frames_at_level += 1
+
+        if raytrace_time is not None and self.samples_seen < self.warmup:
+            self.samples_seen += 1
+            return self.level
+
+        if present_time is not None:
+            self.present_time = self.smooth(self.present_time, present_time)
+        if raytrace_time is None:
+            return self.level
+        self.raytrace_time = self.smooth(self.raytrace_time, raytrace_time)
+
+        #keep at least a sliver of budget, so the log stays finite
+        budget = max(self.get_raytrace_budget(), 0.05 * self.frame_budget)
+        error = np.log(max(self.raytrace_time, 1e-3) / budget) / self.rung_cost
+
+        if -1 < error <= 0 and self.level > 0:
+            #within budget here, but the next finer rung (one rung more
+            #expensive) would be over it: this is the rung to settle on,
+            #so hold the integral here instead of letting it drift finer
+            self.integral = float(self.level)
+            target = self.integral
+        elif abs(error) > 2:
+            #far off (startup, a sudden scene change): jump straight to
+            #the rung the cost model predicts rather than creep there
+            self.integral = self.level + error
+            target = self.integral
+        else:
+            if abs(error) > self.deadband:
+                self.integral += self.integral_gain * error
+            target = self.integral + self.proportional_gain * error
+        #clamped to the ladder so it can't wind up past the ends
+        self.integral = min(max(self.integral, 0), self.level_count - 1)
+
+        if self.frames_at_level < self.dwell:
+            return self.level
+
+        if abs(target - self.level) > 0.5 + self.hysteresis:
+            level = int(round(min(max(target, 0), self.level_count - 1)))
+            if level != self.level:
+                #the new rung's times scale with its pixel count
+                self.raytrace_time *= np.exp(self.rung_cost * (self.level - level))
+                self.level = level
+                self.frames_at_level = 0
+
+        return self.level
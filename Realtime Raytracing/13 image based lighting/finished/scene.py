@@ -1,7 +1,7 @@
 from config import *
 import sphere
 import camera
-import node
+import bvh
 
 class Scene:
     """
@@ -9,12 +9,15 @@ class Scene:
     """
 
 
-    def __init__(self):
+    def __init__(self, sphere_count = 128, moving = False):
         """
             Set up scene objects.
+
+                Parameters:
+                    sphere_count (int): number of random spheres to make
+                    moving (bool): whether the spheres bob up and down
         """
         
-        sphere_count = 128
         self.spheres = [
             sphere.Sphere(
                 center = [
@@ -36,25 +39,52 @@ class Scene:
             position = [0.0, 0.0, 1.0]
         )
 
-        self.sphere_ids = [i for i in range(sphere_count)]
+        #drawn after the layout, so the layout itself is unchanged
+        if moving:
+            for _sphere in self.spheres:
+                _sphere.radius_of_motion = np.random.uniform(low = 0.0, high = 1.0)
+                _sphere.velocity = np.random.uniform(low = 0.01, high = 0.05)
+
+        self.sphere_centers = np.array(
+            [_sphere.center for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_radii = np.array(
+            [_sphere.radius for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_colors = np.array(
+            [_sphere.color for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_roughness = np.array(
+            [_sphere.roughness for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_centers_of_motion = np.array(
+            [_sphere.center_of_motion for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_axes = np.array(
+            [_sphere.axis for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_radii_of_motion = np.array(
+            [_sphere.radius_of_motion for _sphere in self.spheres], dtype=np.float32
+        )
+        self.sphere_velocities = np.array(
+            [_sphere.velocity for _sphere in self.spheres], dtype=np.float32
+        )
+        #spheres read their centers straight out of the shared array
+        for i,_sphere in enumerate(self.spheres):
+            _sphere.center = self.sphere_centers[i]
+        self.t = 0
 
-        self.nodes = []
-        for _ in range(2 * len(self.spheres) + 1):
-            self.nodes.append(node.Node())
-        
         self.root_index = 0
-        self.nodes_used = 1
 
         self.build_bvh()
-        self.build_links(self.root_index)
 
         """
-        for _node in self.nodes:
-            print(f"Node index {_node.index}")
-            print(f"Parent ID: {_node.parent}")
+        for i in range(self.nodes_used):
+            print(f"Node index {self.bvh.index[i]}")
+            print(f"Parent ID: {self.bvh.parent[i]}")
             
-            print(f"Hit Link: {_node.hit_link}")
-            print(f"Miss Link: {_node.miss_link}")
+            print(f"Hit Link: {self.bvh.hit_link[i]}")
+            print(f"Miss Link: {self.bvh.miss_link[i]}")
             print("-------")
         """
 
@@ -89,117 +119,33 @@ class Scene:
         self.camera.recalculateVectors()
     
     def build_bvh(self):
+        """
+            Build the acceleration structure over the spheres
+            and keep track of its size for the engine.
+        """
 
-        root: node.Node = self.nodes[self.root_index]
-        root.first_sphere_index = 0
-        root.sphere_count = len(self.spheres)
-        root.index = self.root_index
-
-        self.update_bounds(self.root_index)
-
-        self.subdivide(self.root_index)
-    
-    def update_bounds(self, node_index):
-
-        _node: node.Node = self.nodes[node_index]
-        _node.min_corner = np.array([1e30, 1e30, 1e30], dtype=np.float32)
-        _node.max_corner = np.array([-1e30, -1e30, -1e30], dtype=np.float32)
-        first = _node.first_sphere_index
-        for i in range(_node.sphere_count):
-
-            sphere_index = self.sphere_ids[first + i]
-            _sphere = self.spheres[sphere_index]
+        self.bvh = bvh.BVH()
+        self.bvh.build(self.sphere_centers, self.sphere_radii)
 
-            sphere_min = _sphere.center - _sphere.radius * np.array([1, 1, 1], dtype=np.float32)
-            _node.min_corner = np.minimum(_node.min_corner, sphere_min)
+        self.sphere_ids = self.bvh.sphere_ids
+        self.nodes_used = self.bvh.node_count
 
-            sphere_max = _sphere.center + _sphere.radius * np.array([1, 1, 1], dtype=np.float32)
-            _node.max_corner = np.maximum(_node.max_corner, sphere_max)
-    
-    def subdivide(self, node_index):
+    def update(self, rate):
+        """
+            Move the spheres along their axes, then refit the BVH.
+            Subtrees which have degraded too far are rebuilt.
+            Nothing happens, and nothing needs uploading, if the
+            spheres don't move.
+        """
 
-        _node: node.Node = self.nodes[node_index]
-        if _node.sphere_count <= 16:
+        if not self.sphere_velocities.any():
             return
 
-        extent = _node.max_corner - _node.min_corner
-        axis = 0
-        if (extent[1] > extent[axis]):
-            axis = 1
-        if (extent[2] > extent[axis]):
-            axis = 2
-        split_position = _node.min_corner[axis] + 0.5 * extent[axis]
-
-        #split group into halves
-        i = _node.first_sphere_index
-        j = i + _node.sphere_count - 1
-        while i <= j:
-            if self.spheres[self.sphere_ids[i]].center[axis] < split_position:
-                i += 1
-            else:
-                temp = self.sphere_ids[i]
-                self.sphere_ids[i] = self.sphere_ids[j]
-                self.sphere_ids[j] = temp
-                j -= 1
-
-        #create child nodes
-        left_count = i - _node.first_sphere_index
-        if (left_count == 0 or left_count == _node.sphere_count):
-            return
-        
-        left_child_index = self.nodes_used
-        self.nodes_used += 1
-        _node.left_child = left_child_index
-        left_node: node.Node = self.nodes[left_child_index]
-        left_node.parent = node_index
-        left_node.index = left_child_index
-        left_node.first_sphere_index = _node.first_sphere_index
-        left_node.sphere_count = left_count
-        self.update_bounds(left_child_index)
-        self.subdivide(left_child_index)
-
-        right_child_index = self.nodes_used
-        self.nodes_used += 1
-        _node.right_child = right_child_index
-        right_node: node.Node = self.nodes[right_child_index]
-        right_node.parent = node_index
-        right_node.index = right_child_index
-        right_node.first_sphere_index = i
-        right_node.sphere_count = _node.sphere_count - left_count
-        self.update_bounds(right_child_index)
-        self.subdivide(right_child_index)
-
-        _node.sphere_count = 0
-
-    def get_right_child(self, parent_index, requestor_index):
-
-        parent: node.Node = self.nodes[parent_index]
-        
-        if requestor_index > parent.left_child:
-
-            if parent.parent < 0:
-                return -1.0
-            return self.get_right_child(parent.parent, parent_index)
-        
-        return parent.right_child
-    
-    def build_links(self, node_index):
+        self.t += rate
+        offsets = self.sphere_radii_of_motion * np.sin(self.sphere_velocities * self.t)
+        self.sphere_centers[:] = self.sphere_centers_of_motion + offsets[:, None] * self.sphere_axes
 
-        _node: node.Node = self.nodes[node_index]
+        self.bvh.update(self.sphere_centers, self.sphere_radii)
+        self.nodes_used = self.bvh.node_count
 
-        if _node.sphere_count == 0:
-            _node.hit_link = _node.left_child
-        else:
-            if _node.parent < 0:
-                _node.hit_link = -1.0
-            else:
-                _node.hit_link = self.get_right_child(_node.parent, _node.index)
-        
-        if _node.parent < 0:
-            _node.miss_link = -1.0
-        else:
-            _node.miss_link = self.get_right_child(_node.parent, _node.index)
-        
-        if (_node.left_child > 0):
-            self.build_links(_node.left_child)
-            self.build_links(_node.right_child)
\ No newline at end of file
+        self.outDated = True
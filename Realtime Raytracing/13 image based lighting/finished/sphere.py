@@ -5,7 +5,8 @@ class Sphere:
         Represents a sphere in the scene
     """
 
-    def __init__(self, center, radius, color, roughness):
+    def __init__(self, center, radius, color, roughness,
+                 axis = (0, 0, 1), radius_of_motion = 0, velocity = 0):
         """
             Create a new sphere
 
@@ -13,9 +14,16 @@ class Sphere:
                 center (array [3,1])
                 radius (float)
                 color (array [3,1])
+                axis (array [3,1]) direction the sphere bobs along
+                radius_of_motion (float)
+                velocity (float)
         """
 
         self.center = np.array(center,dtype=np.float32)
         self.radius = radius
         self.color = np.array(color, dtype=np.float32)
-        self.roughness = roughness
\ No newline at end of file
+        self.roughness = roughness
+        self.center_of_motion = np.array(center, dtype=np.float32)
+        self.axis = np.array(axis, dtype=np.float32)
+        self.radius_of_motion = radius_of_motion
+        self.velocity = velocity
\ No newline at end of file
@@ -0,0 +1,175 @@
+from config import *
+import time
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+#Splits CPU renders into tiles and spreads them over a process pool.
+#Scene arrays and the output frame live in shared memory, so a task is
+#only a tile rectangle and a few block names, never the scene itself.
+
+#per worker process: the tracer, the blocks it has attached and the
+#frame its tracer was last loaded for
+_tracer = None
+_blocks = {}
+_loaded_frame = None
+
+def attach(description):
+    """
+        View a shared block described by (name, shape, dtype) as an array.
+    """
+
+    name, shape, dtype = description
+    if name not in _blocks:
+        _blocks[name] = shared_memory.SharedMemory(name = name)
+        #the renderer owns the block, the worker mustn't unlink it on exit
+        resource_tracker.unregister(_blocks[name]._name, "shared_memory")
+    return np.ndarray(shape, dtype = dtype, buffer = _blocks[name].buf)
+
+def detach_unused(names):
+    """
+        Close the attached blocks not named: the renderer has
+        replaced them with bigger ones, under new names.
+    """
+
+    for name in list(_blocks):
+        if name not in names:
+            _blocks.pop(name).close()
+
+def init_worker(tracer):
+
+    global _tracer
+    _tracer = tracer
+
+def render_tile(task):
+    """
+        Worker side: load the frame's scene if needed, render the tile
+        and write it straight into the shared frame.
+    """
+
+    global _loaded_frame
+
+    frame, arrays, values, output, camera, tile = task
+
+    if frame != _loaded_frame:
+        scene = {key: attach(description) for key,description in arrays.items()}
+        scene.update(values)
+        _tracer.load(**scene)
+        _loaded_frame = frame
+        #the tracer now holds views of this frame's blocks only
+        del scene
+        detach_unused([description[0] for description in arrays.values()] + [output[0]])
+
+    _tracer.ray_count = 0
+    colors = _tracer.render_tile(camera, tile)
+
+    x, y, width, height = tile
+    attach(output)[y:y + height, x:x + width] = colors
+
+    return tile, _tracer.ray_count
+
+class TileRenderer:
+    """
+        Renders frames with a CPURayTracer over a pool of processes.
+    """
+
+    def __init__(self, tracer, tile_size = 64, processes = None):
+        """
+            Parameters:
+                tracer (CPURayTracer): renderer, copied once to each worker
+                tile_size (int): width and height of a tile, in pixels
+                processes (int): pool size, defaults to the core count
+        """
+
+        self.tracer = tracer
+        self.width = tracer.width
+        self.height = tracer.height
+        self.tile_size = tile_size
+
+        self.blocks = {}
+        self.frame = 0
+        self.ray_count = 0
+        self.render_time = 0.0
+
+        self.pool = multiprocessing.Pool(
+            processes = processes, initializer = init_worker, initargs = (tracer,)
+        )
+
+    def tiles(self):
+        """
+            (x, y, width, height) of every tile, clipped to the screen.
+        """
+
+        return [
+            (x, y, min(self.tile_size, self.width - x), min(self.tile_size, self.height - y))
+            for y in range(0, self.height, self.tile_size)
+            for x in range(0, self.width, self.tile_size)
+        ]
+
+    def share(self, key, array):
+        """
+            Copy an array into its shared block, making a bigger block
+            if it no longer fits. Returns the block's description.
+        """
+
+        block = self.blocks.get(key)
+        if block is None or block.size < max(array.nbytes, 1):
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+            self.blocks[key] = block
+
+        np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[...] = array
+        return (block.name, array.shape, array.dtype)
+
+    def render(self, camera, on_tile = None, **scene):
+        """
+            Render a frame. Keyword arguments are passed to the tracer's
+            load(): arrays go through shared memory, anything else
+            travels with the tasks. on_tile(frame, tile) is called as
+            each tile lands in the frame (which is bottom row first).
+            Returns a (height, width, 3) float32 image, top row first.
+        """
+
+        start = time.perf_counter()
+        self.frame += 1
+        self.ray_count = 0
+
+        arrays = {}
+        values = {}
+        for key,value in scene.items():
+            if isinstance(value, np.ndarray):
+                arrays[key] = self.share(key, value)
+            else:
+                values[key] = value
+
+        output = self.share("output", np.zeros((self.height, self.width, 3), dtype = np.float32))
+        frame = np.ndarray(output[1], dtype = output[2], buffer = self.blocks["output"].buf)
+
+        tasks = [
+            (self.frame, arrays, values, output, camera, tile)
+            for tile in self.tiles()
+        ]
+        for tile, ray_count in self.pool.imap_unordered(render_tile, tasks):
+            self.ray_count += ray_count
+            if on_tile is not None:
+                on_tile(frame, tile)
+
+        self.render_time = time.perf_counter() - start
+
+        return np.array(frame[::-1])
+
+    def rays_per_second(self):
+
+        if self.render_time == 0:
+            return 0.0
+        return self.ray_count / self.render_time
+
+    def destroy(self):
+
+        self.pool.close()
+        self.pool.join()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
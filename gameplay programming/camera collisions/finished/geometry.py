@@ -1,413 +1,822 @@
 from config import *
+import itertools
+
+#gap left between boxes that come to rest against each other
+SKIN = 1e-3
+
+#color given to boxes a mover was tested against
+HIGHLIGHT_COLOR = np.array([1, 0, 0], dtype=np.float32)
+
+class BoxStore:
+    """
+        Centers and half extents of the boxes in a grid, one row per
+        handle, so a whole set of boxes can be tested in one go.
+    """
+
+
+    def __init__(self, capacity = 64):
+
+        self.centers = np.zeros((capacity, 3), dtype=np.float32)
+        self.extents = np.zeros((capacity, 3), dtype=np.float32)
+        self.objects = [None,] * capacity
+
+        #rows handed out so far, and the ones given back
+        self.count = 0
+        self.free = []
+    
+    def grow(self):
+
+        capacity = len(self.objects)
+
+        centers = np.zeros((2 * capacity, 3), dtype=np.float32)
+        centers[:capacity] = self.centers
+        self.centers = centers
+
+        extents = np.zeros((2 * capacity, 3), dtype=np.float32)
+        extents[:capacity] = self.extents
+        self.extents = extents
+
+        self.objects.extend([None,] * capacity)
+    
+    def allocate(self, center, extent, obj):
+
+        if len(self.free) > 0:
+            handle = self.free.pop()
+        
+        else:
+
+            if self.count == len(self.objects):
+                self.grow()
+            
+            handle = self.count
+            self.count += 1
+        
+        self.centers[handle] = center
+        self.extents[handle] = extent
+        self.objects[handle] = obj
+
+        return handle
+    
+    def release(self, handle):
+
+        self.extents[handle] = 0
+        self.objects[handle] = None
+        self.free.append(handle)
+    
+    def get_objects(self, handles):
+
+        return [self.objects[handle] for handle in handles]
+    
+    def overlapping(self, center, extent, handles):
+        """
+            Those of the handles whose boxes overlap the box with the
+            given center and half extent, touching counts.
+        """
+
+        separation = np.abs(self.centers[handles] - center)
+        return handles[(separation <= self.extents[handles] + extent).all(axis = 1)]
+    
+    def containing(self, pos, handles):
+
+        return self.overlapping(pos, 0, handles)
+    
+    def sweep(self, center, extent, velocity, handles):
+        """
+            First of the handles' boxes that the box with the given
+            center and half extent runs into moving by velocity, as
+            (time, axis, handle), time being the fraction of the move
+            done at contact. (1, -1, -1) if there's nothing in the way.
+        """
+
+        times, axes, hits = self.sweep_pairs(
+            np.reshape(center, (1, 3)), np.reshape(extent, (1, 3)),
+            np.reshape(velocity, (1, 3)), np.zeros(len(handles), dtype=np.int64), handles
+        )
+        return float(times[0]), int(axes[0]), int(hits[0])
+    
+    def sweep_pairs(self, centers, extents, velocities, owners, handles):
+        """
+            sweep for n moving boxes at once, given as (n, 3) arrays.
+            Box owners[i] is tested against handles[i], and the first
+            hit of each comes back in (n,) arrays of times, axes and
+            handles, the last -1 for a box with nothing in the way.
+            Boxes already overlapped or touched only stop motion
+            further into them along an axis it's still outside on.
+        """
+
+        count = len(centers)
+        times = np.ones(count)
+        axes = np.full(count, -1, dtype=np.int64)
+        hits = np.full(count, -1, dtype=np.int64)
+
+        if len(handles) == 0:
+            return times, axes, hits
+
+        velocity = np.asarray(velocities, dtype=np.float64)[owners]
+        direction = np.sign(velocity)
+        offset = self.centers[handles] - np.asarray(centers, dtype=np.float64)[owners]
+        reach = self.extents[handles] + np.asarray(extents, dtype=np.float64)[owners]
+
+        #times the box starts and stops overlapping along each axis,
+        #without motion an axis overlaps always or never
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            entry = (offset - direction * reach) / velocity
+            exit = (offset + direction * reach) / velocity
+        apart = np.abs(offset) >= reach
+        entry = np.where(direction != 0, entry, np.where(apart, np.inf, -np.inf))
+        exit = np.where(direction != 0, exit, np.inf)
+
+        first_entry = entry.max(axis = 1)
+        pairs = np.flatnonzero((first_entry >= 0) & (first_entry < 1) & (first_entry < exit.min(axis = 1)))
+
+        if len(pairs) == 0:
+            return times, axes, hits
+        
+        np.minimum.at(times, owners[pairs], first_entry[pairs])
+
+        #the earliest pair of each box, the first of them on a tie
+        earliest = pairs[first_entry[pairs] == times[owners[pairs]]]
+        chosen = np.full(count, len(handles), dtype=np.int64)
+        np.minimum.at(chosen, owners[earliest], earliest)
+        hit = np.flatnonzero(chosen < len(handles))
+
+        axes[hit] = np.argmax(entry[chosen[hit]], axis = 1)
+        hits[hit] = handles[chosen[hit]]
+        return times, axes, hits
+    
+    def intersect_rays(self, origins, directions, handles):
+        """
+            Slab test of each ray against the box of the handle in
+            the same row, origins and directions broadcasting against
+            handles. Returns the distance to each hit, inf for a miss,
+            and the axis of the face hit. Rays starting inside a box
+            miss it.
+        """
+
+        directions = np.asarray(directions, dtype=np.float64)
+        low = self.centers[handles] - self.extents[handles] - origins
+        high = self.centers[handles] + self.extents[handles] - origins
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            first = low / directions
+            second = high / directions
+        moving = directions != 0
+        inside = (low <= 0) & (high >= 0)
+        near = np.where(moving, np.minimum(first, second), np.where(inside, -np.inf, np.inf))
+        far = np.where(moving, np.maximum(first, second), np.inf)
+
+        entry = near.max(axis = -1)
+        hit = (entry >= 0) & (entry <= far.min(axis = -1))
+        return np.where(hit, entry, np.inf), np.argmax(near, axis = -1)
 
 class Box3D:
 
     
     def __init__(self, l, w, h, center):
 
-        self.center = np.array(center, dtype=np.float32)
         self.l = l
         self.w = w
         self.h = h
+        self.extent = np.array([l / 2, w / 2, h / 2], dtype=np.float32)
         self.coords = []
-    
-    def overlaps_with(self, other):
+        self.cell_range = None
+        self.level = 0
 
-        if (self.center[0] + self.l / 2) < (other.center[0] - other.l / 2):
-            return False
+        #once added to a grid the center lives in the grid's store
+        self.own_center = np.array(center, dtype=np.float32)
+        self.store = None
+        self.handle = -1
+    
+    @property
+    def center(self):
 
-        if (self.center[0] - self.l / 2) > (other.center[0] + other.l / 2):
-            return False
+        if self.store is None:
+            return self.own_center
         
-        if (self.center[1] + self.w / 2) < (other.center[1] - other.w / 2):
-            return False
+        return self.store.centers[self.handle]
+    
+    @center.setter
+    def center(self, center):
 
-        if (self.center[1] - self.w / 2) > (other.center[1] + other.w / 2):
-            return False
-        
-        if (self.center[2] + self.h / 2) < (other.center[2] - other.h / 2):
-            return False
+        self.center[:] = center
+    
+    def overlaps_with(self, other):
 
-        if (self.center[2] - self.h / 2) > (other.center[2] + other.h / 2):
-            return False
-        
-        return True
+        separation = np.abs(self.center - other.center)
+        return bool((separation <= self.extent + other.extent).all())
     
     def has_point(self, pos):
 
-        if (self.center[0] + self.l / 2) < pos[0]:
-            return False
-
-        if (self.center[0] - self.l / 2) > pos[0]:
-            return False
-        
-        if (self.center[1] + self.w / 2) < pos[1]:
-            return False
-
-        if (self.center[1] - self.w / 2) > pos[1]:
-            return False
-        
-        if (self.center[2] + self.h / 2) < pos[2]:
-            return False
-
-        if (self.center[2] - self.h / 2) > pos[2]:
-            return False
-        
-        return True
+        return bool((np.abs(self.center - pos) <= self.extent).all())
 
 class Grid:
+    """
+        Spatial hash of boxes. With more than one level, each level's
+        cells are twice the size of the one below, and a box goes in
+        the smallest level whose cells it fits inside, so it covers
+        at most two cells per axis. Queries look through every level
+        that has anything in it.
+    """
 
 
-    def __init__(self):
+    def __init__(self, length = 10, width = 10, height = 10, levels = 1):
 
-        self.length = 10
-        self.width = 10
-        self.height = 10
+        self.length = length
+        self.width = width
+        self.height = height
+        self.levels = levels
+        self.sizes = [(length * 2**level, width * 2**level, height * 2**level) for level in range(levels)]
 
+        #(level, x, y, z) -> handles of the boxes in it, and the
+        #same as an array, made when first asked for
         self.items = {}
+        self.item_arrays = {}
+        self.boxes = BoxStore()
+        self.level_counts = [0,] * levels
+
+        self.reset_stats()
     
-    def world_to_grid(self, coord):
+    def world_to_grid(self, coord, level = 0):
 
-        return (int(coord[0] // self.length), int(coord[1] // self.width), int(coord[2] // self.height))
+        size = self.sizes[level]
+        return (level, int(coord[0] // size[0]), int(coord[1] // size[1]), int(coord[2] // size[2]))
     
     def grid_to_world(self, coord):
 
-        return ((coord[0] + 0.5) * self.length, (coord[1] + 0.5) * self.width, (coord[2] + 0.5) * self.height)
+        size = self.sizes[coord[0]]
+        return ((coord[1] + 0.5) * size[0], (coord[2] + 0.5) * size[1], (coord[3] + 0.5) * size[2])
     
     def remove_from(self, coord, obj):
 
         if coord not in self.items:
             return
-        
-        if obj not in self.items[coord]:
-            return
 
-        self.items[coord].remove(obj)
+        self.items[coord].discard(obj.box.handle)
+        self.item_arrays.pop(coord, None)
 
         if len(self.items[coord]) == 0:
             self.items.pop(coord)
         
     def add_at(self, coord, obj):
 
-        if coord in self.items:
-            
-            if obj in self.items[coord]:
-                return
-            
-            self.items[coord].append(obj)
+        if coord not in self.items:
+            self.items[coord] = set()
         
-        else:
-
-            self.items[coord] = [obj,]
-
-    def expand(self, box, temporary_box, coord, searched):
-
-        result = []
-        x = coord[0]
-        y = coord[1]
-        z = coord[2]
-
-        expand_north = (box.center[1] + box.w / 2) > (temporary_box.center[1] + temporary_box.w / 2)
-        expand_east = (box.center[0] + box.l / 2) > (temporary_box.center[0] + temporary_box.l / 2)
-        expand_south = (box.center[1] - box.w / 2) < (temporary_box.center[1] - temporary_box.w / 2)
-        expand_west = (box.center[1] - box.l / 2) < (temporary_box.center[0] - temporary_box.l / 2)
-        expand_above = (box.center[2] + box.h / 2) > (temporary_box.center[2] + temporary_box.h / 2)
-        expand_below = (box.center[2] - box.h / 2) < (temporary_box.center[2] - temporary_box.h / 2)
-        if expand_north:
-            #North
-            if (x, y + 1, z) not in searched:
-                result.append((x, y + 1, z))
-            
-            if expand_east:
-                #North East
-                if (x + 1, y + 1, z) not in searched:
-                    result.append((x + 1, y + 1, z))
-                
-                if expand_above:
-                    #North East Above
-                    if (x + 1, y + 1, z + 1) not in searched:
-                        result.append((x + 1, y + 1, z + 1))
-                
-                if expand_below:
-                    #North East Below
-                    if (x + 1, y + 1, z - 1) not in searched:
-                        result.append((x + 1, y + 1, z - 1))
-            
-            if expand_west:
-                #North West
-                if (x - 1, y + 1, z) not in searched:
-                    result.append((x - 1, y + 1, z))
-
-                if expand_above:
-                    #North West Above
-                    if (x - 1, y + 1, z + 1) not in searched:
-                        result.append((x - 1, y + 1, z + 1))
-                
-                if expand_below:
-                    #North West Below
-                    if (x - 1, y + 1, z - 1) not in searched:
-                        result.append((x - 1, y + 1, z - 1))
-            
-            if expand_above:
-                #North Above
-                if (x, y + 1, z + 1) not in searched:
-                    result.append((x, y + 1, z + 1))
-            
-            if expand_below:
-                #North Below
-                if (x, y + 1, z - 1) not in searched:
-                    result.append((x, y + 1, z - 1))
-        
-        if expand_south:
-            #South
-            if (x, y - 1, z) not in searched:
-                result.append((x, y - 1, z))
-            
-            if expand_east:
-                #South East
-                if (x + 1, y - 1, z) not in searched:
-                    result.append((x + 1, y - 1, z))
-                
-                if expand_above:
-                    #South East Above
-                    if (x + 1, y - 1, z + 1) not in searched:
-                        result.append((x + 1, y - 1, z + 1))
-                
-                if expand_below:
-                    #South East Below
-                    if (x + 1, y - 1, z - 1) not in searched:
-                        result.append((x + 1, y - 1, z - 1))
-            
-            if expand_west:
-                #South West
-                if (x - 1, y - 1, z) not in searched:
-                    result.append((x - 1, y - 1, z))
-                
-                if expand_above:
-                    #South West Above
-                    if (x - 1, y - 1, z + 1) not in searched:
-                        result.append((x - 1, y - 1, z + 1))
-                
-                if expand_below:
-                    #South West Below
-                    if (x - 1, y - 1, z - 1) not in searched:
-                        result.append((x - 1, y - 1, z - 1))
-            
-            if expand_above:
-                #South Above
-                if (x, y - 1, z + 1) not in searched:
-                    result.append((x, y - 1, z + 1))
-            
-            if expand_below:
-                #South Below
-                if (x, y - 1, z - 1) not in searched:
-                    result.append((x, y - 1, z - 1))
-        
-        if expand_east:
-            #East
-            if (x + 1, y, z) not in searched:
-                result.append((x + 1, y, z))
-            
-            if expand_above:
-                #East Above
-                if (x + 1, y, z + 1) not in searched:
-                    result.append((x + 1, y, z + 1))
-            
-            if expand_below:
-                #East Below
-                if (x + 1, y, z - 1) not in searched:
-                    result.append((x + 1, y, z - 1))
-
-        if expand_west:
-            #West
-            if (x - 1, y, z) not in searched:
-                result.append((x - 1, y, z))
-            
-            if expand_below:
-                #West Below
-                if (x - 1, y, z - 1) not in searched:
-                    result.append((x - 1, y, z - 1))
-            
-            if expand_above:
-                #West Above
-                if (x - 1, y, z + 1) not in searched:
-                    result.append((x - 1, y, z + 1))
+        self.items[coord].add(obj.box.handle)
+        self.item_arrays.pop(coord, None)
+    
+    def get_level(self, extent):
+        """
+            Smallest level whose cells the box fits in, the top one
+            if it fits none.
+        """
+
+        for level in range(self.levels - 1):
+            if (2 * extent <= self.sizes[level]).all():
+                return level
         
-        return result
+        return self.levels - 1
+    
+    def get_levels(self, extents):
+        """
+            get_level for an (n, 3) array of half extents.
+        """
+
+        fits = (2 * extents[:,np.newaxis,:] <= np.array(self.sizes)).all(axis = 2)
+        fits[:,-1] = True
+        return np.argmax(fits, axis = 1)
+    
+    def get_levels_in_use(self):
+
+        return [level for level in range(self.levels) if self.level_counts[level] > 0]
+
+    def get_cell_range(self, center, extent, level = 0):
+        """
+            First and last cell of the level the box covers, both
+            included, as two (x, y, z) tuples.
+        """
+
+        size = self.sizes[level]
+        center = center.tolist()
+        extent = extent.tolist()
+        first = tuple(int((center[i] - extent[i]) // size[i]) for i in range(3))
+        last = tuple(int((center[i] + extent[i]) // size[i]) for i in range(3))
+        return (first, last)
+    
+    def get_cell_ranges(self, centers, extents, level = 0):
+        """
+            get_cell_range for (n, 3) arrays of boxes at once,
+            as two (n, 3) int arrays.
+        """
+
+        size = np.array(self.sizes[level], dtype=np.float64)
+        centers = centers.astype(np.float64)
+        extents = extents.astype(np.float64)
+        first = ((centers - extents) // size).astype(np.int64)
+        last = ((centers + extents) // size).astype(np.int64)
+        return first, last
+    
+    def get_cells_in_range(self, first, last, level = 0):
+
+        return list(itertools.product(
+            (level,),
+            range(first[0], last[0] + 1),
+            range(first[1], last[1] + 1),
+            range(first[2], last[2] + 1)
+        ))
+    
+    def get_cells_touching(self, low, high):
+        """
+            Cells of every level in use touched by the region from low
+            to high: the ones anything overlapping it is filed under.
+        """
+
+        cells = []
+        for level in self.get_levels_in_use():
+            size = self.sizes[level]
+            first = [int(low[i] // size[i]) for i in range(3)]
+            last = [int(high[i] // size[i]) for i in range(3)]
+            cells.extend(self.get_cells_in_range(first, last, level))
         
+        return cells
+    
     def get_overlapping_coordinates(self, box):
 
-        world_coord = box.center
-        grid_coord = self.world_to_grid(world_coord)
-
-        to_search = [grid_coord,]
-        current = None
-        searched = []
-        overlapping_coords = []
+        level = self.get_level(box.extent)
+        return self.get_cells_in_range(*self.get_cell_range(box.center, box.extent, level), level)
+    
+    def register(self, obj, level):
 
-        while len(to_search) > 0:
+        box = obj.box
+        box.handle = self.boxes.allocate(box.center, box.extent, obj)
+        box.store = self.boxes
+        box.level = level
+        self.level_counts[level] += 1
+    
+    def place(self, obj, cell_range):
 
-            current = to_search.pop(0)
-            searched.append(current)
-            world_coord = self.grid_to_world(current)
-            temporary_box = Box3D(self.length, self.width, self.height, world_coord)
+        box = obj.box
+        box.cell_range = cell_range
+        box.coords = self.get_cells_in_range(*cell_range, box.level)
 
-            if temporary_box.overlaps_with(box):
-                overlapping_coords.append(current)
-                for coord in self.expand(box, temporary_box, current, searched):
-                    to_search.append(coord)
-        
-        return overlapping_coords
+        for coord in box.coords:
+            self.add_at(coord, obj)
     
     def add(self, obj):
 
-        covered_coordinates = self.get_overlapping_coordinates(obj.box)
-
-        for coord in covered_coordinates:
-            self.add_at(coord, obj)
-        
-        obj.box.coords = covered_coordinates
+        box = obj.box
+        self.register(obj, self.get_level(box.extent))
+        self.place(obj, self.get_cell_range(box.center, box.extent, box.level))
     
-    def intersects_something(self, obj, tempBox, coord):
+    def add_all(self, objects):
 
-        if coord not in self.items:
-            return False
+        if len(objects) == 0:
+            return
+
+        extents = np.array([obj.box.extent for obj in objects])
+        for obj, level in zip(objects, self.get_levels(extents).tolist()):
+            self.register(obj, level)
         
-        for obj2 in self.items[coord]:
+        for level in range(self.levels):
 
-            if obj == obj2:
+            batch = [obj for obj in objects if obj.box.level == level]
+            if len(batch) == 0:
                 continue
-        
-            obj2.color = np.array([1, 0, 0], dtype=np.float32)
-                
-            if tempBox.overlaps_with(obj2.box):
-                return True
-        
-        return False
+
+            handles = [obj.box.handle for obj in batch]
+            first, last = self.get_cell_ranges(self.boxes.centers[handles], self.boxes.extents[handles], level)
+
+            for obj, obj_first, obj_last in zip(batch, first.tolist(), last.tolist()):
+                self.place(obj, (tuple(obj_first), tuple(obj_last)))
     
-    def intersects_anything(self, obj, coords):
+    def rebucket(self, obj, cell_range = None):
+        """
+            Move obj to the cells it covers now, cell_range if it's
+            been worked out already. Only cells it entered or left are
+            touched, none if it stayed put.
+        """
 
-        for coord in coords:
+        box = obj.box
 
-            if coord not in self.items:
-                return False
+        if cell_range is None:
+            cell_range = self.get_cell_range(box.center, box.extent, box.level)
+
+        if cell_range == box.cell_range:
+            return
         
-            for obj2 in self.items[coord]:
+        new_coords = self.get_cells_in_range(*cell_range, box.level)
+        old_coords = set(box.coords)
 
-                if obj == obj2:
-                    continue
-                
-                if obj.box.overlaps_with(obj2.box):
-                    return True
+        for coord in new_coords:
+            if coord not in old_coords:
+                self.add_at(coord, obj)
         
-        return False
+        for coord in old_coords.difference(new_coords):
+            self.remove_from(coord, obj)
+        
+        box.coords = new_coords
+        box.cell_range = cell_range
     
-    def can_move(self, obj, velocity):
+    def remove(self, obj):
 
         box = obj.box
-        tempBox = Box3D(box.l, box.w, box.h, box.center + velocity)
 
         for coord in box.coords:
-
-            if self.intersects_something(obj, tempBox, coord):
-                return False
+            self.remove_from(coord, obj)
         
-        return True
+        box.coords = []
+        box.cell_range = None
+        box.own_center = np.copy(box.center)
+        self.boxes.release(box.handle)
+        self.level_counts[box.level] -= 1
+        box.store = None
+        box.handle = -1
     
-    def get_overlapping_objects(self, obj):
+    def get_candidates(self, coords, obj = None):
+        """
+            Handles of everything in the given cells, bar obj's own.
+        """
 
-        box = obj.box
-        overlapping_objects = []
+        arrays = []
+        for coord in coords:
 
-        for coord in box.coords:
-            
             if coord not in self.items:
                 continue
-                
-            for obj2 in self.items[coord]:
-                if obj == obj2:
-                    continue
 
-                if box.overlaps_with(obj2.box):
-                    overlapping_objects.append(obj2)
+            if coord not in self.item_arrays:
+                handles = self.items[coord]
+                self.item_arrays[coord] = np.fromiter(handles, dtype=np.int64, count=len(handles))
+            
+            arrays.append(self.item_arrays[coord])
+        
+        if len(arrays) == 0:
+            return np.zeros(0, dtype=np.int64)
+        
+        #boxes over several cells are in several arrays
+        if len(arrays) == 1:
+            handles = arrays[0]
+        else:
+            handles = np.unique(np.concatenate(arrays))
+        
+        if obj is not None:
+            handles = handles[handles != obj.box.handle]
         
-        return overlapping_objects
+        return handles
     
-    def expand_quick(self, box, direction):
+    def record_query(self, candidates):
 
-        test_coords = box.coords.copy()
-        for coord in box.coords:
-            test_coord = (coord[0] + direction[0], coord[1] + direction[1], coord[2] + direction[2])
-            if test_coord not in test_coords:
-                test_coords.append(test_coord)
-        return test_coords
+        self.queries += 1
+        self.candidates_tested += len(candidates)
+    
+    def reset_stats(self):
 
-    def move(self, obj, dt):
+        self.queries = 0
+        self.candidates_tested = 0
+    
+    def stats(self):
+        """
+            Objects, cells in use, objects per cell (mean and most) and
+            cells per object for each level, and boxes tested per query
+            since reset_stats.
+        """
+
+        per_cell = [[] for level in range(self.levels)]
+        for coord, handles in self.items.items():
+            per_cell[coord[0]].append(len(handles))
+        
+        levels = []
+        for level in range(self.levels):
+            cells = len(per_cell[level])
+            filed = sum(per_cell[level])
+            levels.append({
+                "cell_size": self.sizes[level],
+                "objects": self.level_counts[level],
+                "cells": cells,
+                "objects_per_cell": filed / max(1, cells),
+                "most_per_cell": max(per_cell[level], default = 0),
+                "cells_per_object": filed / max(1, self.level_counts[level])
+            })
+        
+        return {
+            "levels": levels,
+            "queries": self.queries,
+            "candidates_per_query": self.candidates_tested / max(1, self.queries)
+        }
+    
+    def highlight(self, candidates):
+
+        for obj in self.boxes.get_objects(candidates):
+            obj.color = HIGHLIGHT_COLOR
+    
+    def can_move(self, obj, velocity, candidates = None):
 
-        velocity = dt * obj.velocity
         box = obj.box
 
-        box.coords = self.expand_quick(box, (np.sign(velocity[0]), 0, 0))
-        test_velocity = np.array([velocity[0], 0, 0], dtype=np.float32)
-        if self.can_move(obj, test_velocity):
-            box.center += test_velocity
-        
-        box.coords = self.expand_quick(box, (0, np.sign(velocity[1]), 0))
-        test_velocity = np.array([0, velocity[1], 0], dtype=np.float32)
-        if self.can_move(obj, test_velocity):
-            box.center += test_velocity
-        
-        box.coords = self.expand_quick(box, (0, 0, np.sign(velocity[2])))
-        test_velocity = np.array([0, 0, velocity[2]], dtype=np.float32)
-        if self.can_move(obj, test_velocity):
-            box.center += test_velocity
-        elif velocity[2] < 0:
-            obj.velocity = 0 * obj.velocity
-            obj.on_ground = True
-        
-        if box.center[2] <= 0.9:
-            box.center[2] = 0.9
-            obj.on_ground = True
-        
-        newCoords = self.get_overlapping_coordinates(box)
-        for coord in newCoords:
-            if coord not in box.coords:
-                self.add_at(coord, obj)
+        if candidates is None:
+            moved = box.center + velocity
+            candidates = self.get_candidates(self.get_cells_touching(moved - box.extent, moved + box.extent), obj)
+            self.record_query(candidates)
+            self.highlight(candidates)
         
-        for coord in box.coords:
-            if coord not in newCoords:
-                self.remove_from(coord, obj)
+        blocking = self.boxes.overlapping(box.center + velocity, box.extent, candidates)
+        return len(blocking) == 0
+    
+    def get_overlapping_objects(self, obj, candidates = None):
+
+        box = obj.box
+
+        if candidates is None:
+            candidates = self.get_candidates(self.get_cells_touching(box.center - box.extent, box.center + box.extent), obj)
+            self.record_query(candidates)
         
-        box.coords = newCoords
+        overlapping = self.boxes.overlapping(box.center, box.extent, candidates)
+        return self.boxes.get_objects(overlapping)
+    
+    def get_swept_cells(self, box, velocity):
+        """
+            Cells touched by box on its way across velocity.
+        """
+
+        center = box.center.tolist()
+        extent = box.extent.tolist()
+        if isinstance(velocity, np.ndarray):
+            velocity = velocity.tolist()
+        low = [center[i] - extent[i] + min(velocity[i], 0) for i in range(3)]
+        high = [center[i] + extent[i] + max(velocity[i], 0) for i in range(3)]
+        return self.get_cells_touching(low, high)
+    
+    def sweep(self, obj, velocity, candidates = None):
+        """
+            What obj runs into if it moves by velocity, as (time,
+            normal, object), time being the fraction of the move done
+            at contact and normal the hit face's. (1, None, None) if
+            there's nothing in the way.
+        """
 
-        overlapping_objects = self.get_overlapping_objects(obj)
-        if len(overlapping_objects) > 0:
-            box2 = overlapping_objects[0].box
-            box.center[2] = box2.center[2] + box2.h / 2 + box.h / 2
-            obj.on_ground = True
+        box = obj.box
 
-    def get_length_to_hit(self, pos, direction, length_min, length_max):
+        if candidates is None:
+            candidates = self.get_candidates(self.get_swept_cells(box, velocity), obj)
+            self.record_query(candidates)
+        
+        time, axis, handle = self.boxes.sweep(box.center, box.extent, velocity, candidates)
 
-        length = length_min / 2
-        length_increment = length_min / 2
+        if handle < 0:
+            return time, None, None
+        
+        normal = np.zeros(3, dtype=np.float32)
+        normal[axis] = -np.sign(velocity[axis])
+        return time, normal, self.boxes.objects[handle]
 
-        while length < length_max:
+    def move(self, obj, dt):
+        """
+            Move obj by dt of its velocity, stopping at whatever it runs
+            into and sliding along it for the rest of the move.
+            Returns the contacts made as (time, normal, object).
+        """
 
-            length += length_increment
-            test_pos = pos + length * direction
+        return self.move_all([obj,], dt)[0]
+    
+    def move_all(self, objects, dt):
+        """
+            move for many objects, sweeping them all together. Each is
+            swept against the others as they were before the call; any
+            that end up overlapping another are put back and moved one
+            at a time. Returns the contacts made by each.
+        """
+
+        count = len(objects)
+        handles = np.array([obj.box.handle for obj in objects], dtype=np.int64)
+        centers = self.boxes.centers[handles].astype(np.float64)
+        extents = self.boxes.extents[handles].astype(np.float64)
+        velocities = dt * np.array([obj.velocity for obj in objects], dtype=np.float64)
+
+        #kept in case a box has to be moved again on its own
+        if count > 1:
+            starts = np.copy(centers)
+            states = [(np.copy(obj.velocity), obj.on_ground) for obj in objects]
+
+        #the ground is a plane at 0.9, stop the motion on it before sweeping
+        #so a box never drops out from under the blocks it's beside
+        grounded = centers[:,2] + velocities[:,2] <= 0.9
+        velocities[grounded, 2] = 0.9 - centers[grounded, 2]
+        for i in np.flatnonzero(grounded):
+            objects[i].velocity[2] = 0
+            objects[i].on_ground = True
+
+        #(box, candidate) pairs, sliding never leaves the cells of the full move
+        candidates = []
+        for obj, velocity in zip(objects, velocities.tolist()):
+            found = self.get_candidates(self.get_swept_cells(obj.box, velocity), obj)
+            self.record_query(found)
+            self.highlight(found)
+            candidates.append(found)
+        owners = np.repeat(np.arange(count), [len(found) for found in candidates])
+        candidates = np.concatenate(candidates)
+
+        contacts = [[] for obj in objects]
+        elapsed = np.zeros(count)
+        moving = np.ones(count, dtype=bool)
+
+        #each contact takes an axis out of a box's motion
+        for i in range(3):
+
+            pairs = moving[owners]
+            times, axes, hits = self.boxes.sweep_pairs(
+                centers, extents, velocities, owners[pairs], candidates[pairs]
+            )
+            centers[moving] += times[moving, np.newaxis] * velocities[moving]
+
+            moving &= hits >= 0
+            for j in np.flatnonzero(moving):
+
+                obj = objects[j]
+                time = times[j]
+                axis = axes[j]
+                hit = hits[j]
+
+                elapsed[j] += (1 - elapsed[j]) * time
+                normal = np.zeros(3, dtype=np.float32)
+                normal[axis] = -np.sign(velocities[j, axis])
+                contacts[j].append((float(elapsed[j]), normal, self.boxes.objects[hit]))
+
+                #rest just off the face, so sliding along it is free
+                centers[j, axis] = self.boxes.centers[hit, axis] \
+                    + normal[axis] * (self.boxes.extents[hit, axis] + extents[j, axis] + SKIN)
+
+                velocities[j] *= 1 - time
+                velocities[j, axis] = 0
+                obj.velocity[axis] = 0
+
+                if normal[2] > 0:
+                    obj.on_ground = True
+            
+            if not moving.any():
+                break
+        
+        #boxes that moved into each other's way
+        clashing = np.zeros(count, dtype=bool)
+        if count > 1:
+            index = np.full(self.boxes.count, -1, dtype=np.int64)
+            index[handles] = np.arange(count)
+            other = index[candidates]
+            pairs = np.flatnonzero(other >= 0)
+            separation = np.abs(centers[owners[pairs]] - centers[other[pairs]])
+            overlap = (separation < extents[owners[pairs]] + extents[other[pairs]]).all(axis = 1)
+            clashing[owners[pairs[overlap]]] = True
+            clashing[other[pairs[overlap]]] = True
+            centers[clashing] = starts[clashing]
+        
+        self.boxes.centers[handles] = centers
+
+        levels = np.array([obj.box.level for obj in objects])
+        for level in set(levels.tolist()):
+            batch = np.flatnonzero(levels == level)
+            first, last = self.get_cell_ranges(
+                self.boxes.centers[handles[batch]], self.boxes.extents[handles[batch]], level
+            )
+            for j, obj_first, obj_last in zip(batch.tolist(), first.tolist(), last.tolist()):
+                self.rebucket(objects[j], (tuple(obj_first), tuple(obj_last)))
+        
+        for j in np.flatnonzero(clashing):
+            obj = objects[j]
+            obj.velocity, obj.on_ground = states[j]
+            contacts[j] = self.move_all([obj,], dt)[0]
+        
+        return contacts
+
+    def get_ray_cells(self, origin, direction, max_length, level = 0):
+        """
+            Walk the level's cells a ray passes through, in order, up
+            to max_length (Amanatides and Woo). Yields each cell and
+            the distance at which the ray leaves it.
+        """
+
+        size = self.sizes[level]
+        cell = list(self.world_to_grid(origin, level)[1:])
+        step = [0, 0, 0]
+        t_next = [np.inf, np.inf, np.inf]
+        t_delta = [np.inf, np.inf, np.inf]
+
+        for axis in range(3):
+
+            if direction[axis] > 0:
+                step[axis] = 1
+                t_next[axis] = ((cell[axis] + 1) * size[axis] - origin[axis]) / direction[axis]
+                t_delta[axis] = size[axis] / direction[axis]
+
+            elif direction[axis] < 0:
+                step[axis] = -1
+                t_next[axis] = (cell[axis] * size[axis] - origin[axis]) / direction[axis]
+                t_delta[axis] = -size[axis] / direction[axis]
+        
+        t = 0
+        while t <= max_length:
 
-            grid_pos = self.world_to_grid(test_pos)
+            axis = t_next.index(min(t_next))
+            yield (level, cell[0], cell[1], cell[2]), t_next[axis]
 
-            if test_pos[2] <= 0.9:
-                return length
+            t = t_next[axis]
+            cell[axis] += step[axis]
+            t_next[axis] += t_delta[axis]
+    
+    def cast_ray(self, pos, direction, max_length, obj = None):
+        """
+            First box along the ray within max_length, bar obj's, as
+            (distance, normal, object). (max_length, None, None) if
+            nothing's hit. direction should be unit length.
+        """
+
+        direction = np.asarray(direction, dtype=np.float64)
+        distance = max_length
+        axis = -1
+        handle = -1
+        tested = 0
+
+        for level in self.get_levels_in_use():
+            for cell, t_exit in self.get_ray_cells(pos, direction, distance, level):
+
+                if cell in self.items:
+
+                    candidates = self.get_candidates((cell,), obj)
+                    t, axes = self.boxes.intersect_rays(pos, direction, candidates)
+                    tested += len(candidates)
+
+                    if len(t) > 0 and t.min() < distance:
+                        nearest = np.argmin(t)
+                        distance = float(t[nearest])
+                        axis = axes[nearest]
+                        handle = candidates[nearest]
+                
+                #a box in a later cell of the level can't be nearer
+                if distance <= t_exit:
+                    break
+        
+        self.queries += 1
+        self.candidates_tested += tested
 
-            if grid_pos not in self.items:
-                continue
+        if handle < 0:
+            return max_length, None, None
+        
+        normal = np.zeros(3, dtype=np.float32)
+        normal[axis] = -np.sign(direction[axis])
+        return distance, normal, self.boxes.objects[handle]
+    
+    def cast_rays(self, positions, directions, max_length):
+        """
+            cast_ray for (n, 3) arrays of rays at once: the cells are
+            walked ray by ray, then every ray's boxes are tested in one
+            go. Returns (n,) distances, (n, 3) normals (zero for a miss)
+            and a list of the objects hit (None for a miss).
+        """
+
+        positions = np.asarray(positions, dtype=np.float64)
+        directions = np.asarray(directions, dtype=np.float64)
+        count = len(positions)
+
+        #(ray, handle) pairs to test
+        rays = []
+        handles = []
+        for ray in range(count):
+            cells = [
+                cell for level in self.get_levels_in_use()
+                for cell, t_exit in self.get_ray_cells(positions[ray], directions[ray], max_length, level)
+            ]
+            candidates = self.get_candidates(cells)
+            self.record_query(candidates)
+            rays.append(np.full(len(candidates), ray))
+            handles.append(candidates)
+        rays = np.concatenate(rays + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        handles = np.concatenate(handles + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+
+        t, axes = self.boxes.intersect_rays(positions[rays], directions[rays], handles)
+
+        distances = np.full(count, np.inf)
+        np.minimum.at(distances, rays, t)
+        hit = distances <= max_length
+
+        #the pair each hit came from
+        first = np.full(count, len(t), dtype=np.int64)
+        nearest = np.flatnonzero(t == distances[rays])
+        np.minimum.at(first, rays[nearest], nearest)
+
+        normals = np.zeros((count, 3), dtype=np.float32)
+        objects = [None,] * count
+        for ray in np.flatnonzero(hit):
+            pair = first[ray]
+            normals[ray, axes[pair]] = -np.sign(directions[ray, axes[pair]])
+            objects[ray] = self.boxes.objects[handles[pair]]
+        
+        return np.where(hit, distances, max_length), normals, objects
+
+    def get_length_to_hit(self, pos, direction, length_min, length_max):
+
+        length = self.cast_ray(pos, direction, length_max)[0]
 
-            for obj in self.items[grid_pos]:
-                if obj.box.has_point(test_pos):
-                    return length
+        #the ground
+        if direction[2] < 0:
+            length = min(length, (0.9 - pos[2]) / direction[2])
         
-        return length_max
+        return min(max(length, length_min), length_max)
 
 grid = Grid()
\ No newline at end of file
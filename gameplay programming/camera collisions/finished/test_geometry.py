@@ -0,0 +1,41 @@
+import numpy as np
+import geometry
+
+class Mover:
+
+    def __init__(self, size, position, velocity):
+
+        self.box = geometry.Box3D(*size, position)
+        self.velocity = np.array(velocity, dtype=np.float32)
+        self.on_ground = False
+
+def test_ground_does_not_let_a_mover_under_a_low_block():
+
+    grid = geometry.Grid()
+    block = Mover((8, 8, 1), (5, 0, 2.1), (0, 0, 0))
+    player = Mover((0.7, 0.7, 1.8), (0.5, 0, 0.9), (0.3, 0, -0.5))
+    grid.add(block)
+    grid.add(player)
+
+    for frame in range(8):
+        player.velocity[:] = (0.3, 0, -0.5)
+        grid.move(player, 1.0)
+
+    #up against the block's side, on the ground
+    assert player.box.center[0] <= 1 - 0.35
+    assert player.box.center[2] >= 0.9 - 1e-6
+    assert player.on_ground
+    assert not player.box.overlaps_with(block.box)
+
+def test_movers_moved_together_do_not_end_up_inside_each_other():
+
+    grid = geometry.Grid()
+    left = Mover((0.7, 0.7, 1.8), (0, 0, 0.9), (1, 0, 0))
+    right = Mover((0.7, 0.7, 1.8), (1.5, 0, 0.9), (-1, 0, 0))
+    grid.add(left)
+    grid.add(right)
+
+    grid.move_all([left, right], 1.0)
+
+    assert not left.box.overlaps_with(right.box)
+    assert right.box.center[0] - left.box.center[0] >= 0.7
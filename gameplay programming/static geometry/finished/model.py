@@ -194,8 +194,7 @@ class Scene:
                             x + np.random.uniform(0, 16),
                             y + np.random.uniform(0, 16),
                             z + np.random.uniform(0, 16))))
-        for block in self.blocks:
-            geometry.grid.add(block)
+        geometry.grid.add_all(self.blocks)
     
     def get_static_geometry(self) -> list[Block]:
 